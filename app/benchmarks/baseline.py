@@ -0,0 +1,36 @@
+#--output and --baseline handling shared by the benchmarks, a run worse than its baseline exits with 1
+import json
+import sys
+
+# A value is flagged as a regression when it is this much worse than the baseline
+REGRESSION_TOLERANCE = 0.25
+
+def add_arguments(parser):
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare against a previous --output file')
+
+def regressions(values):
+    """Messages of the (label, value, before, higher_is_better) values that are worse than before by more than the tolerance."""
+    found = []
+    for label, value, before, higher_is_better in values:
+        if not before:
+            continue
+        if value < before * (1 - REGRESSION_TOLERANCE) if higher_is_better else value > before * (1 + REGRESSION_TOLERANCE):
+            found.append(f"{label}: {value} vs baseline {before}")
+    return found
+
+def finish(args, results, compare):
+    """Write results to --output and check them against --baseline.
+
+    compare(results, baseline) yields the (label, value, before, higher_is_better) values to check.
+    """
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(results, indent=2))
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(compare(results, json.load(f)))
+        for regression in found:
+            print("REGRESSION " + regression)
+        if found:
+            sys.exit(1)
@@ -0,0 +1,62 @@
+#Startup benchmark for VickyTopiaReportCLI.py
+#Usage: python app/benchmarks/cli_importtime.py [--runs 5] [--output results.json] [--baseline results.json]
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import baseline
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts')
+CLI_PATH = os.path.join(SCRIPTS_DIR, 'VickyTopiaReportCLI.py')
+
+def import_times():
+    """Return {module: cumulative microseconds} from python -X importtime for the CLI module."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import VickyTopiaReportCLI'],
+                            cwd=SCRIPTS_DIR, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative_us)
+    return times
+
+def version_wall_time():
+    """Wall time of a full `VickyTopiaReportCLI.py --version` process in seconds."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, CLI_PATH, '--version'], cwd=SCRIPTS_DIR, capture_output=True, check=True)
+    return time.perf_counter() - start
+
+def run(runs):
+    imports = [import_times() for _ in range(runs)]
+    walls = sorted(version_wall_time() for _ in range(runs))
+    totals = sorted(times.get('VickyTopiaReportCLI', 0) for times in imports)
+    slowest = sorted(imports[-1].items(), key=lambda item: item[1], reverse=True)
+    return {
+        'import_us': totals[len(totals) // 2],
+        'version_seconds': round(walls[len(walls) // 2], 4),
+        'top_imports': [{'module': name, 'cumulative_us': us} for name, us in slowest[:15]],
+    }
+
+def compare(results, before):
+    for key in ('import_us', 'version_seconds'):
+        yield key, results[key], before.get(key), False
+
+def main():
+    parser = argparse.ArgumentParser(description='VickyTopiaReportCLI startup benchmark')
+    parser.add_argument('--runs', type=int, default=5)
+    baseline.add_arguments(parser)
+    args = parser.parse_args()
+
+    results = run(max(1, args.runs))
+    print(f"import VickyTopiaReportCLI: {results['import_us'] / 1000:.1f} ms")
+    print(f"VickyTopiaReportCLI.py --version: {results['version_seconds'] * 1000:.1f} ms")
+    for item in results['top_imports']:
+        print(f"  {item['cumulative_us'] / 1000:8.1f} ms  {item['module']}")
+
+    baseline.finish(args, results, compare)
+
+if __name__ == '__main__':
+    main()
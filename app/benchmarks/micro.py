@@ -0,0 +1,196 @@
+#Micro benchmarks for the API page parsers and the insert_into_table_* write paths
+#Usage: python app/benchmarks/micro.py [--pages DIR] [--sizes 1000,10000,100000] [--skip-db] [--output results.json] [--baseline results.json]
+#--pages holds recorded API responses named <collection>.json (endpoint.json, incidentEvent.json, ...), synthetic pages are used for the missing ones
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import time
+
+import baseline
+import mock_tenable
+import mock_vicarius
+import sync_throughput
+
+import DatabaseConnector as db
+import Endpoint as assets
+import EndpointVulnerabilities as vuln
+import EndpointsEventTask as tasks
+import IncidentsEvents as incidents
+import PatchsByAssets as patchs
+import utils
+from TenableClient import TenableClient
+
+# Documents per synthetic page, the page size the reports ask the API for
+PAGE_SIZE = 500
+
+def _patch_pages(page):
+    """aggregation/searchGroup is queried per endpoint, split a page into one page per endpoint."""
+    by_endpoint = {}
+    for doc in page['serverResponseObject']:
+        endpoint = doc.get('organizationEndpointExternalReferenceExternalReferencesEndpoint', {})
+        by_endpoint.setdefault((endpoint.get('endpointName'), endpoint.get('endpointHash')), []).append(doc)
+    return [(name, endpoint_hash, {'serverResponseObject': docs}) for (name, endpoint_hash), docs in by_endpoint.items()]
+
+def parse_patches(page):
+    rows = []
+    for name, endpoint_hash, endpoint_page in _patch_pages(page):
+        rows.extend(patchs.parseEndpointpatches(endpoint_page, name, endpoint_hash))
+    return rows
+
+# Parser: (collection of its page, function returning the parsed rows)
+PARSERS = {
+    'parseEndpoints': ('endpoint', lambda page: assets.parseEndpoints(page)[0]),
+    'parseEndpointVulnerabilities': ('organizationEndpointVulnerabilities', lambda page: vuln.parseEndpointVulnerabilities(None, None, page)),
+    'parseIncidentEventsbyType': ('incidentEvent', lambda page: incidents.parseIncidentEventsbyType(page)[0]),
+    'parseTasksEndpointsEvents': ('taskEndpointsEvent', lambda page: tasks.parseTasksEndpointsEvents(page, '0')[0]),
+    'parseEndpointpatches': ('organizationEndpointExternalReferenceExternalReferences', parse_patches),
+}
+
+def synthetic_page(collection, documents, seed=1):
+    """A generated API page of about documents documents of one collection."""
+    per_endpoint = {'endpoint': 0, 'organizationEndpointVulnerabilities': 20, 'incidentEvent': 20,
+                    'taskEndpointsEvent': 20, 'organizationEndpointExternalReferenceExternalReferences': 20}[collection]
+    endpoints = documents if not per_endpoint else -(-documents // per_endpoint)
+    counts = {'vulnerabilities': 0, 'patches': 0, 'tasks': 0, 'incidents': 0}
+    key = {'organizationEndpointVulnerabilities': 'vulnerabilities', 'incidentEvent': 'incidents',
+           'taskEndpointsEvent': 'tasks', 'organizationEndpointExternalReferenceExternalReferences': 'patches'}.get(collection)
+    if key:
+        counts[key] = per_endpoint
+    fixtures = mock_vicarius.generate_fixtures(endpoints, groups=0, seed=seed, **counts)
+    docs = fixtures[collection][:documents]
+    return {'serverResponseCount': len(docs), 'serverResponseObject': docs}
+
+def load_page(collection, pages_dir):
+    path = os.path.join(pages_dir, collection + '.json') if pages_dir else None
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return synthetic_page(collection, PAGE_SIZE)
+
+def timed(function, repeat):
+    """Median seconds of repeat calls, the output of the parsers and inserts is discarded."""
+    times = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def bench_parsers(pages_dir, repeat):
+    results = {}
+    for name, (collection, parse) in PARSERS.items():
+        page = load_page(collection, pages_dir)
+        documents = len(page['serverResponseObject'])
+        seconds = timed(lambda: parse(page), repeat)
+        results[name] = {'documents': documents, 'seconds_per_page': round(seconds, 6),
+                         'docs_per_s': round(documents / seconds, 1) if seconds else 0}
+    stamps = [1700000000000 + i * 997 for i in range(10000)]
+    seconds = timed(lambda: [utils.timestamptodatetime(stamp) for stamp in stamps], repeat)
+    results['timestamptodatetime'] = {'documents': len(stamps), 'seconds_per_page': round(seconds, 6),
+                                      'docs_per_s': round(len(stamps) / seconds, 1) if seconds else 0}
+    return results
+
+def _parsed_rows(collection, rows):
+    parse = next(parse for name, (parsed_collection, parse) in PARSERS.items() if parsed_collection == collection)
+    return parse(synthetic_page(collection, rows))
+
+def _endpoint_groups(rows):
+    endpoints = assets.parseEndpoints(synthetic_page('endpoint', rows))[0]
+    return [{'groupId': 200 + i % 10, 'groupName': f'Bench group {i % 10}', 'endpointName': e['endpointName'],
+             'endpointId': e['endpointId'], 'endpointHash': e['endpointHash']} for i, e in enumerate(endpoints)]
+
+def _tenable_assets(rows):
+    tenant = mock_tenable.SyntheticTenant(rows, 0)
+    return TenableClient('benchmark', 'benchmark')._parse_assets([tenant.asset(i) for i in range(rows)])
+
+# Table: (check_create_table_* function, insert_into_table_* function, rows builder)
+INSERTS = {
+    'endpoints': ('check_create_table_endpoints', 'insert_into_table_endpoints',
+                  lambda rows: assets.parseEndpoints(synthetic_page('endpoint', rows))[0]),
+    'endpoints_status': ('check_create_table_endpoints', 'insert_into_table_endpointsStatus',
+                         lambda rows: assets.parseEndpoints(synthetic_page('endpoint', rows))[1]),
+    'activevulnerabilities': ('check_create_table_activevulnerabilities', 'insert_into_table_activevulnerabilities',
+                              lambda rows: _parsed_rows('organizationEndpointVulnerabilities', rows)),
+    'incident': ('check_create_table_incident', 'insert_into_table_incident',
+                 lambda rows: _parsed_rows('incidentEvent', rows)),
+    'tasks': ('check_create_table_tasks', 'insert_into_table_tasks',
+              lambda rows: _parsed_rows('taskEndpointsEvent', rows)),
+    'assetspatchs': ('check_create_table_assetspatchs', 'insert_into_table_assetspatchs',
+                     lambda rows: _parsed_rows('organizationEndpointExternalReferenceExternalReferences', rows)),
+    'endpointgroups': ('check_create_table_endpointgroups', 'insert_into_table_endpointgroups', _endpoint_groups),
+    'tenable_assets': ('check_create_table_tenable_assets', 'insert_into_table_tenable_assets', _tenable_assets),
+}
+
+def bench_inserts(sizes, tables, repeat):
+    settings = sync_throughput.db_settings()
+    args = (settings['host'], settings['port'], settings['user'], settings['password'], settings['database'])
+    db.check_create_database(*args)
+    results = {}
+    try:
+        for table in tables:
+            create, insert, build = INSERTS[table]
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                getattr(db, create)(*args)
+            results[table] = {}
+            for size in sizes:
+                rows = build(size)
+
+                def run():
+                    # Every timed insert starts from an empty table
+                    conn = db.get_connection(settings)
+                    try:
+                        with conn:
+                            cur = conn.cursor()
+                            cur.execute("TRUNCATE " + table + " CASCADE")
+                            cur.close()
+                    finally:
+                        conn.close()
+                    getattr(db, insert)(rows, *args)
+
+                seconds = timed(run, repeat)
+                results[table][str(size)] = {'rows': len(rows), 'seconds': round(seconds, 4),
+                                             'rows_per_s': round(len(rows) / seconds, 1) if seconds else 0}
+                print(f"  {table:24} {len(rows):8} rows {seconds:9.3f} s", file=sys.stderr)
+    finally:
+        sync_throughput.drop_database(settings)
+    return results
+
+def compare(results, before):
+    for name, result in results.get('parsers', {}).items():
+        previous = before.get('parsers', {}).get(name, {})
+        yield f"{name} s/page", result['seconds_per_page'], previous.get('seconds_per_page'), False
+    for table, sizes in results.get('inserts', {}).items():
+        for size, result in sizes.items():
+            previous = before.get('inserts', {}).get(table, {}).get(size, {})
+            yield f"insert {table} x{size} s", result['seconds'], previous.get('seconds'), False
+
+def main():
+    parser = argparse.ArgumentParser(description='Parser and insert micro benchmarks')
+    parser.add_argument('--pages', help='Directory of recorded API pages, <collection>.json')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='Row counts for the insert benchmarks')
+    parser.add_argument('--tables', help='Comma separated subset of ' + ','.join(INSERTS))
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per parser timing, the median is kept')
+    parser.add_argument('--insert-repeat', type=int, default=1, help='Runs per insert timing')
+    parser.add_argument('--skip-db', action='store_true', help='Only time the parsers')
+    baseline.add_arguments(parser)
+    args = parser.parse_args()
+
+    results = {'parsers': bench_parsers(args.pages, max(1, args.repeat))}
+    for name, result in results['parsers'].items():
+        print(f"  {name:30} {result['seconds_per_page'] * 1000:9.2f} ms/page  {result['docs_per_s']:12.1f} docs/s")
+    if not args.skip_db:
+        sizes = [int(size) for size in args.sizes.split(',')]
+        tables = args.tables.split(',') if args.tables else list(INSERTS)
+        results['inserts'] = bench_inserts(sizes, tables, max(1, args.insert_repeat))
+        for table, by_size in results['inserts'].items():
+            for size, result in by_size.items():
+                print(f"  insert {table:24} x{size:>7}  {result['seconds']:9.3f} s  {result['rows_per_s']:12.1f} rows/s")
+
+    baseline.finish(args, results, compare)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+#Local stand-in for the Tenable.io API, serves a synthetic or fixture tenant for the Tenable benchmarks
+#Usage: python app/benchmarks/mock_tenable.py [--assets 20000] [--vulns 200 | --fixtures tenant.json] [--port 8898] [--throttle-every 0]
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# The workbench endpoints never return more than this many assets, like cloud.tenable.com
+WORKBENCH_ASSET_LIMIT = 5000
+SEVERITIES = ['info', 'low', 'medium', 'high', 'critical']
+STATES = ['Active', 'Active', 'Active', 'Resurfaced', 'Fixed']
+
+class SyntheticTenant:
+    """Deterministic tenant of assets x vulns_per_asset findings.
+
+    Findings are generated per asset when asked for, so 20k assets x 200 vulns
+    is served without holding millions of documents in memory.
+    """
+
+    def __init__(self, assets=1000, vulns_per_asset=50, seed=1, now=None):
+        self.count = assets
+        self.vulns_per_asset = vulns_per_asset
+        self.seed = seed
+        self.now = now or datetime.utcnow()
+        self.ids = [str(uuid.UUID(int=random.Random(seed * 1000003 + i).getrandbits(128), version=4)) for i in range(assets)]
+        self.index = {asset_id: i for i, asset_id in enumerate(self.ids)}
+
+    def _stamp(self, rng, days=30):
+        return (self.now - timedelta(seconds=rng.randint(0, days * 86400))).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+    def asset(self, i):
+        """Workbench asset document."""
+        rng = random.Random(self.seed * 7919 + i)
+        name = f'bench-{i:05d}'
+        return {
+            'id': self.ids[i],
+            'has_agent': i % 4 != 0,
+            'hostname': [name],
+            'fqdn': [name + '.bench.local'],
+            'ipv4': [f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}'],
+            'operating_system': [rng.choice(['Microsoft Windows Server 2022', 'Microsoft Windows 11', 'Linux Kernel 5.15'])],
+            'last_seen': self._stamp(rng, 7),
+        }
+
+    def vulns(self, i):
+        """Workbench vulnerability documents of asset i."""
+        rng = random.Random(self.seed * 104729 + i)
+        found = []
+        for k in range(self.vulns_per_asset):
+            plugin = 10000 + (i * 7 + k * 13) % 5000
+            severity = plugin % 5
+            found.append({
+                'plugin_id': plugin,
+                'plugin_name': f'Synthetic plugin {plugin}',
+                'plugin_family': 'Windows : Microsoft Bulletins',
+                'cve': f'CVE-2024-{plugin},CVE-2023-{plugin}' if plugin % 3 == 0 else f'CVE-2024-{plugin}',
+                'severity_default_id': severity,
+                'v3_base_score': round(2 + severity * 2 - rng.random(), 1) if severity else None,
+                'v2_base_score': round(2 + severity * 1.8, 1),
+                'first_found': self._stamp(rng, 180),
+                'last_found': self._stamp(rng, 7),
+                'vulnerability_state': STATES[rng.randrange(len(STATES))],
+                'count': 1,
+            })
+        return found
+
+    def asset_export(self, i):
+        """Asset document of the /assets/export chunks."""
+        asset = self.asset(i)
+        return {'id': asset['id'], 'hostnames': asset['hostname'], 'fqdns': asset['fqdn'], 'ipv4s': asset['ipv4'],
+                'operating_systems': asset['operating_system'], 'last_seen': asset['last_seen'], 'has_agent': asset['has_agent']}
+
+    def vuln_export(self, i):
+        """Finding documents of the /vulns/export chunks for asset i."""
+        asset = self.asset(i)
+        return [{
+            'asset': {'uuid': asset['id'], 'hostname': asset['hostname'][0], 'fqdn': asset['fqdn'][0],
+                      'ipv4': asset['ipv4'][0], 'operating_system': asset['operating_system']},
+            'plugin': {'id': v['plugin_id'], 'name': v['plugin_name'], 'family': v['plugin_family'],
+                       'cve': v['cve'].split(','), 'cvss3_base_score': v['v3_base_score'], 'cvss_base_score': v['v2_base_score']},
+            'severity': SEVERITIES[v['severity_default_id']],
+            'severity_id': v['severity_default_id'],
+            'state': 'FIXED' if v['vulnerability_state'] == 'Fixed' else 'OPEN',
+            'first_found': v['first_found'],
+            'last_found': v['last_found'],
+        } for v in self.vulns(i)]
+
+class FixtureTenant(SyntheticTenant):
+    """Tenant read from {"assets": [workbench assets], "vulnerabilities": {asset id: [workbench vulns]}}."""
+
+    def __init__(self, fixtures):
+        self.assets = fixtures['assets']
+        self.findings = fixtures.get('vulnerabilities', {})
+        self.count = len(self.assets)
+        self.ids = [asset['id'] for asset in self.assets]
+        self.index = {asset_id: i for i, asset_id in enumerate(self.ids)}
+
+    def asset(self, i):
+        return self.assets[i]
+
+    def vulns(self, i):
+        return self.findings.get(self.ids[i], [])
+
+class MockTenable:
+    """Serves workbench assets, per asset vulnerabilities and the asynchronous export jobs.
+
+    Export jobs report PROCESSING for the first export_polls status calls, then
+    FINISHED with every chunk available. Every throttle_every-th call is answered
+    with a 429 and a Retry-After header.
+    """
+
+    def __init__(self, tenant, latency=0.0, throttle_every=0, retry_after=1, export_polls=1, workbench_limit=WORKBENCH_ASSET_LIMIT):
+        self.tenant = tenant
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.export_polls = export_polls
+        self.workbench_limit = workbench_limit
+        self.exports = {}
+        self.lock = threading.Lock()
+        self.server = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.calls = 0
+            self.counts = {'requests': 0, 'throttled': 0, 'by_route': {}}
+
+    def stats(self):
+        with self.lock:
+            return json.loads(json.dumps(self.counts))
+
+    def _record(self, route, throttled=False):
+        with self.lock:
+            self.calls += 1
+            self.counts['requests'] += 1
+            self.counts['throttled'] += int(throttled)
+            self.counts['by_route'][route] = self.counts['by_route'].get(route, 0) + 1
+
+    def _throttled(self):
+        with self.lock:
+            return bool(self.throttle_every) and (self.calls + 1) % self.throttle_every == 0
+
+    def _new_export(self, kind, body):
+        size_key = 'num_assets' if kind == 'vulns' else 'chunk_size'
+        size = max(1, int(body.get(size_key) or (50 if kind == 'vulns' else 1000)))
+        export_uuid = str(uuid.uuid4())
+        with self.lock:
+            self.exports[export_uuid] = {'kind': kind, 'size': size, 'polls': 0,
+                                         'chunks': max(1, -(-self.tenant.count // size))}
+        return {'export_uuid': export_uuid}
+
+    def _export_status(self, export):
+        with self.lock:
+            export['polls'] += 1
+            finished = export['polls'] > self.export_polls
+        if not finished:
+            return {'status': 'PROCESSING', 'chunks_available': []}
+        return {'status': 'FINISHED', 'chunks_available': list(range(1, export['chunks'] + 1))}
+
+    def _export_chunk(self, export, chunk):
+        start = (chunk - 1) * export['size']
+        assets = range(start, min(start + export['size'], self.tenant.count))
+        if export['kind'] == 'assets':
+            return [self.tenant.asset_export(i) for i in assets]
+        return list(itertools.chain.from_iterable(self.tenant.vuln_export(i) for i in assets))
+
+    def handle(self, method, path, body=None):
+        """Return (status, response body, extra headers) for one API call."""
+        route = re.sub(r'/[0-9a-f-]{36}', '/{uuid}', path)
+        route = re.sub(r'/chunks/\d+', '/chunks/{n}', route)
+        if self.latency:
+            time.sleep(self.latency)
+        if self._throttled():
+            self._record(route, throttled=True)
+            return 429, {'error': 'You have exceeded the rate limit'}, {'Retry-After': str(self.retry_after)}
+        self._record(route)
+
+        parts = path.strip('/').split('/')
+        if method == 'GET' and parts == ['workbenches', 'assets']:
+            limit = min(self.tenant.count, self.workbench_limit)
+            return 200, {'assets': [self.tenant.asset(i) for i in range(limit)], 'total': limit}, {}
+        if method == 'GET' and len(parts) == 4 and parts[:2] == ['workbenches', 'assets'] and parts[3] == 'vulnerabilities':
+            i = self.tenant.index.get(parts[2])
+            if i is None:
+                return 404, {'error': 'Asset not found'}, {}
+            vulns = self.tenant.vulns(i)
+            return 200, {'vulnerabilities': vulns, 'total_vulnerability_count': len(vulns)}, {}
+        if parts and parts[0] in ('vulns', 'assets') and len(parts) >= 2 and parts[1] == 'export':
+            kind = parts[0]
+            if method == 'POST' and len(parts) == 2:
+                return 200, self._new_export(kind, json.loads(body or '{}')), {}
+            export = self.exports.get(parts[2]) if len(parts) > 2 else None
+            if export is None or export['kind'] != kind:
+                return 404, {'error': 'Export not found'}, {}
+            if method == 'GET' and len(parts) == 4 and parts[3] == 'status':
+                return 200, self._export_status(export), {}
+            if method == 'GET' and len(parts) == 5 and parts[3] == 'chunks' and parts[4].isdigit():
+                chunk = int(parts[4])
+                if not 1 <= chunk <= export['chunks']:
+                    return 404, {'error': 'Chunk not found'}, {}
+                return 200, self._export_chunk(export, chunk), {}
+        return 404, {'error': 'not found'}, {}
+
+    def start(self, host='127.0.0.1', port=0):
+        """Serve in a background thread and return the base url, port 0 picks a free port."""
+        self.server = ThreadingHTTPServer((host, port), make_handler(self))
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='mock-tenable', daemon=True).start()
+        return f'http://{host}:{self.server.server_address[1]}'
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+def make_handler(mock):
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _reply(self, code, body, headers=None):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _handle(self, method):
+            url = urlparse(self.path)
+            length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(length).decode() if length else None
+            if url.path == '/__stats':
+                return self._reply(200, mock.stats())
+            self._reply(*mock.handle(method, url.path, body))
+
+        def do_GET(self):
+            self._handle('GET')
+
+        def do_POST(self):
+            self._handle('POST')
+
+        def log_message(self, format, *args):
+            pass
+
+    return MockHandler
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock Tenable.io API')
+    parser.add_argument('--fixtures', help='JSON file of {"assets": [...], "vulnerabilities": {asset id: [...]}}')
+    parser.add_argument('--assets', type=int, default=1000, help='Assets of the generated tenant')
+    parser.add_argument('--vulns', type=int, default=50, help='Findings per generated asset')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8898)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every call')
+    parser.add_argument('--throttle-every', type=int, default=0, help='Answer every Nth call with a 429')
+    parser.add_argument('--export-polls', type=int, default=1, help='Status polls an export stays PROCESSING')
+    args = parser.parse_args()
+
+    if args.fixtures:
+        with open(args.fixtures) as f:
+            tenant = FixtureTenant(json.load(f))
+    else:
+        tenant = SyntheticTenant(args.assets, args.vulns, args.seed)
+    mock = MockTenable(tenant, args.latency, args.throttle_every, export_polls=args.export_polls)
+    url = mock.start(args.host, args.port)
+    print(f"Mock Tenable API on {url}, point TENABLE_API_URL at it")
+    threading.Event().wait()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,384 @@
+#Local stand-in for vicarius-external-data-api, serves fixture documents for the report benchmarks
+#Usage: python app/benchmarks/mock_vicarius.py [--fixtures fixtures.json | --endpoints 200] [--port 8899] [--latency 0.05] [--throttle-every 0]
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+API_PREFIX = '/vicarius-external-data-api/'
+
+# RSQL comparisons used by the report modules, longer operators first so '>=' is not read as '>'
+RSQL_TERM = re.compile(r'^([\w.]+)(=in=|=out=|==|!=|>=|<=|>|<)(.*)$')
+
+def resolve(doc, path):
+    """Value of a dotted field path in a fixture document, None when it is missing."""
+    value = doc
+    for key in path.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _text(value):
+    # RSQL spells booleans in lower case
+    return str(value).lower() if isinstance(value, bool) else str(value)
+
+def _matches(value, op, arg):
+    values = value if isinstance(value, list) else [value]
+    if op in ('=in=', '=out='):
+        wanted = set(arg.strip('()').split(','))
+        found = any(_text(v) in wanted for v in values)
+        return found if op == '=in=' else not found
+    if op in ('==', '!='):
+        found = any(_text(v) == arg for v in values)
+        return found if op == '==' else not found
+    left, right = _number(value), _number(arg)
+    if left is None or right is None:
+        left, right = str(value), arg
+        if value is None:
+            return False
+    return {'>': left > right, '<': left < right, '>=': left >= right, '<=': left <= right}[op]
+
+def rsql_filter(docs, query):
+    """Documents matching an RSQL query, only ';' (and) between terms is supported."""
+    if not query:
+        return docs
+    terms = []
+    for term in query.split(';'):
+        match = RSQL_TERM.match(term.strip())
+        if not match:
+            raise ValueError(f"Unsupported RSQL term {term}")
+        terms.append(match.groups())
+    return [doc for doc in docs if all(_matches(resolve(doc, field), op, arg) for field, op, arg in terms)]
+
+def sort_docs(docs, sort):
+    """Apply a '+field' or '-field' sort, fields the documents do not have are ignored like the API does."""
+    if not sort or not docs:
+        return docs
+    field = sort.lstrip('+-')
+    if resolve(docs[0], field) is None:
+        return docs
+    def key(doc):
+        value = resolve(doc, field)
+        number = _number(value)
+        return (0, number, '') if number is not None else (1, 0, str(value))
+    return sorted(docs, key=key, reverse=sort.startswith('-'))
+
+def _collection_name(object_name):
+    return object_name[:1].lower() + object_name[1:]
+
+class MockVicarius:
+    """Fixture backed API server.
+
+    fixtures maps a collection to its documents, the collection is the first
+    path segment after /vicarius-external-data-api/ (endpoint, incidentEvent, ...)
+    or the objectName of aggregation/searchGroup calls. Every call sleeps latency
+    seconds and every throttle_every-th call is answered with a 429.
+    """
+
+    def __init__(self, fixtures, latency=0.0, jitter=0.0, throttle_every=0, seed=1):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_every = throttle_every
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.server = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.calls = 0
+            self.counts = {'requests': 0, 'throttled': 0, 'documents': 0, 'by_path': {}}
+
+    def stats(self):
+        with self.lock:
+            return json.loads(json.dumps(self.counts))
+
+    def _record(self, path, throttled=False, documents=0):
+        with self.lock:
+            self.counts['requests'] += 1
+            self.counts['throttled'] += int(throttled)
+            self.counts['documents'] += documents
+            self.counts['by_path'][path] = self.counts['by_path'].get(path, 0) + 1
+
+    def _throttle(self):
+        with self.lock:
+            self.calls += 1
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+            return delay, bool(self.throttle_every) and self.calls % self.throttle_every == 0
+
+    def _join_filter(self, docs, body):
+        """PrefetchIds joins, e.g. the endpoints of a group: endpoint/search with an OrganizationEndpointGroup query."""
+        try:
+            queries = json.loads(body) if body else []
+        except ValueError:
+            return docs
+        for search in queries if isinstance(queries, list) else []:
+            joined = rsql_filter(self.fixtures.get(_collection_name(search.get('searchQueryObjectName', '')), []),
+                                 search.get('searchQueryQuery'))
+            foreign = search.get('searchQueryObjectJoinByForeignFieldName')
+            ids = set()
+            for doc in joined:
+                value = resolve(doc, foreign)
+                ids.update(str(v) for v in (value if isinstance(value, list) else [value]))
+            field = search.get('searchQueryObjectJoinByFieldName')
+            docs = [doc for doc in docs if str(resolve(doc, field)) in ids]
+        return docs
+
+    def handle(self, path, query, body=None):
+        """Return (status, response body) for one API call."""
+        if not path.startswith(API_PREFIX):
+            return 404, {'error': 'not found'}
+        resource, _, action = path[len(API_PREFIX):].strip('/?').partition('/')
+        params = {key: values[-1] for key, values in parse_qs(query, keep_blank_values=True).items()}
+        delay, throttled = self._throttle()
+        if delay:
+            time.sleep(delay)
+        if throttled:
+            self._record(path, throttled=True)
+            return 429, {'error': 'Too Many Requests'}
+
+        collection = _collection_name(params['objectName']) if resource == 'aggregation' and 'objectName' in params else resource
+        try:
+            docs = rsql_filter(self.fixtures.get(collection, []), params.get('q'))
+        except ValueError as e:
+            self._record(path)
+            return 400, {'error': str(e)}
+        docs = self._join_filter(docs, body)
+        total = len(docs)
+        if action == 'count':
+            self._record(path)
+            return 200, {'serverResponseCount': total, 'serverResponseObject': []}
+        docs = sort_docs(docs, params.get('sort'))
+        start = int(params.get('from') or 0)
+        page = docs[start:start + int(params.get('size') or 10)]
+        self._record(path, documents=len(page))
+        return 200, {'serverResponseCount': total, 'serverResponseObject': page}
+
+    def start(self, host='127.0.0.1', port=0):
+        """Serve in a background thread and return the base url, port 0 picks a free port."""
+        self.server = ThreadingHTTPServer((host, port), make_handler(self))
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='mock-vicarius', daemon=True).start()
+        return f'http://{host}:{self.server.server_address[1]}'
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+def make_handler(mock):
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _reply(self, code, body):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self):
+            length = int(self.headers.get('Content-Length', 0))
+            return self.rfile.read(length).decode() if length else None
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/__stats':
+                return self._reply(200, mock.stats())
+            self._reply(*mock.handle(url.path, url.query, self._body()))
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path == '/__stats/reset':
+                mock.reset_stats()
+                return self._reply(200, mock.stats())
+            self._reply(*mock.handle(url.path, url.query, self._body()))
+
+        def log_message(self, format, *args):
+            pass
+
+    return MockHandler
+
+def generate_fixtures(endpoints=100, vulnerabilities=20, patches=5, tasks=10, incidents=10, groups=5, seed=1, now=None):
+    """Synthetic tenant with the fields the report parsers read, counts are per endpoint except groups.
+
+    Event timestamps are spread over the 30 days before now, in milliseconds and nanoseconds like the API.
+    """
+    rng = random.Random(seed)
+    now_ms = int((now or time.time()) * 1000)
+    day_ms = 86400 * 1000
+    severities = ['Low', 'Medium', 'High', 'Critical']
+    products = [('Google', 'Chrome'), ('Mozilla', 'Firefox'), ('Oracle', 'Java'), ('Adobe', 'Reader'), ('7-Zip', '7-Zip')]
+    teams = [{'organizationTeamName': 'Team ' + str(t), 'organizationTeamId': t} for t in range(1, 4)]
+
+    def stamp():
+        ms = now_ms - rng.randint(0, 30 * day_ms)
+        return ms, ms * 1000000 + rng.randint(0, 999999)
+
+    def vulnerability(number):
+        return {
+            'vulnerabilityId': 100000 + number,
+            'vulnerabilityExternalReference': {'externalReferenceExternalId': f'CVE-2024-{10000 + number}'},
+            'vulnerabilitySensitivityLevel': {'sensitivityLevelName': severities[number % 4], 'threatLevelId': number % 4},
+            'vulnerabilitySummary': f'Synthetic vulnerability {number}, for benchmarks only',
+            'vulnerabilityV3ExploitabilityLevel': round(rng.uniform(0, 4), 1),
+            'vulnerabilityV3BaseScore': round(rng.uniform(1, 10), 1),
+        }
+
+    fixtures = {'endpoint': [], 'organizationEndpointVulnerabilities': [], 'incidentEvent': [], 'taskEndpointsEvent': [],
+                'organizationEndpointExternalReferenceExternalReferences': [], 'organizationEndpointGroup': []}
+    for e in range(endpoints):
+        created, _ = stamp()
+        endpoint = {
+            'endpointId': 1000 + e,
+            'endpointName': f'BENCH-{e:05d}' if e % 3 else f'bench-{e:05d}.bench.local',
+            'endpointHash': '%032x' % rng.getrandbits(128),
+        }
+        ref = dict(endpoint)
+        fixtures['endpoint'].append(dict(endpoint, **{
+            'endpointCreatedAt': created,
+            'endpointUpdatedAt': now_ms - rng.randint(0, day_ms),
+            'endpointOperatingSystem': {'operatingSystemName': rng.choice(['Windows 11', 'Windows Server 2022', 'Ubuntu 22.04'])},
+            'endpointVersion': {'versionName': '4.2.' + str(e % 10)},
+            'endpointAlive': e % 5 != 0,
+            'endpointTokenGenerationTime': created,
+            'endpointEndpointSubStatus': {'endpointSubStatusName': 'Running'},
+            'endpointConnectedByProxy': False,
+            'endpointEndpointStatus': {'endpointStatusName': 'Connected'},
+        }))
+
+        for v in range(vulnerabilities):
+            publisher, product = products[v % len(products)]
+            created, _ = stamp()
+            has_patch = v % 3 != 0
+            fixtures['organizationEndpointVulnerabilities'].append({
+                'organizationEndpointVulnerabilitiesEndpoint': dict(ref, endpointCreatedAt=created),
+                'organizationEndpointVulnerabilitiesVulnerability': vulnerability(e * vulnerabilities + v),
+                'organizationEndpointVulnerabilitiesProduct': {'productName': product},
+                'organizationEndpointVulnerabilitiesVersion': {'versionName': f'{v}.0'},
+                'organizationEndpointVulnerabilitiesSubVersion': {'subVersionName': f'{v}.0.1'},
+                'organizationEndpointVulnerabilitiesProductRawEntry': {'productRawEntryName': f'{publisher} {product}'},
+                'organizationEndpointVulnerabilitiesPatch': {'patchId': 5000 + v if has_patch else 0, 'patchName': f'{product} {v}.1' if has_patch else '',
+                                                             'patchReleaseDate': created},
+                'organizationEndpointVulnerabilitiesCreatedAt': created,
+                'organizationEndpointVulnerabilitiesUpdatedAt': created,
+            })
+
+        for p in range(patches):
+            released, _ = stamp()
+            aggregation = lambda name, value, children=(): {'aggregationName': name, 'aggregationId': str(value), 'aggregationAggregations': list(children)}
+            fixtures['organizationEndpointExternalReferenceExternalReferences'].append({
+                'organizationEndpointExternalReferenceExternalReferencesEndpoint': dict(ref),
+                'aggregationName': 'patchNames',
+                'aggregationId': f'Synthetic patch {p}',
+                'aggregationAggregations': [
+                    aggregation('patchReleaseDates', released),
+                    aggregation('patchDescriptions', f'Fixes synthetic issue {p}'),
+                    aggregation('sensitivityLevelNames', severities[p % 4]),
+                    aggregation('sensitivityLevelRanks', p % 4),
+                    aggregation('externalReferenceIds', 9000 + p, [
+                        aggregation('patchIds', 7000 + p, [aggregation('externalReferenceSourceIds', f'KB{500000 + p}')]),
+                    ]),
+                ],
+            })
+
+        for t in range(tasks):
+            created, created_nano = stamp()
+            publisher, product = products[t % len(products)]
+            fixtures['taskEndpointsEvent'].append({
+                'taskEndpointsEventTask': {
+                    'taskId': e * tasks + t + 1,
+                    'taskAutomation': {'automationName': 'Weekly patching', 'automationId': 1 + t % 3, 'automationOrganizationTeam': teams[t % 3]},
+                    'taskUser': {'userFirstName': 'Bench', 'userLastName': 'User'},
+                    'taskTaskType': {'taskTypeName': 'DeployPatch'},
+                    'taskPublisher': {'publisherName': publisher},
+                    'taskProduct': {'productName': product},
+                    'taskPatch': {'patchName': f'{product} update', 'patchFileName': f'{product.lower()}.msi', 'patchReleaseDate': created,
+                                  'patchDescription': 'Synthetic patch'},
+                    'taskAutomationRun': {'automationRunSequence': t},
+                    'taskTaskStatus': {'taskStatusName': 'Succeeded'},
+                },
+                'taskEndpointsEventEndpoint': dict(ref, endpointEndpointStatus={'endpointStatusName': 'Connected'}),
+                'taskEndpointsEventOrganizationEndpointPatchPatchPackages': {
+                    'organizationEndpointPatchPatchPackagesActionStatus': {'actionStatusName': 'Succeeded'},
+                    'organizationEndpointPatchPatchPackagesStatusMessage': 'Installed',
+                },
+                'analyticsEventCreatedAt': created,
+                'analyticsEventUpdatedAt': created,
+                'analyticsEventCreatedAtNano': created_nano,
+                'analyticsEventUpdatedAtNano': created_nano,
+            })
+
+        for i in range(incidents):
+            created, created_nano = stamp()
+            publisher, product = products[i % len(products)]
+            # Every other detection is followed by its mitigation
+            event_type = 'MitigatedVulnerability' if i % 2 else 'DetectedVulnerability'
+            fixtures['incidentEvent'].append({
+                'incidentEventIncidentEventType': event_type,
+                'incidentEventEndpoint': dict(ref),
+                'incidentEventVulnerability': vulnerability(e * vulnerabilities + i // 2),
+                'incidentEventDetecetdDate': created - day_ms,
+                'incidentEventOrganizationPublisherProducts': {
+                    'organizationPublisherProductsPublisher': {'publisherName': publisher, 'publisherId': i % len(products)},
+                    'organizationPublisherProductsProduct': {'productName': product},
+                },
+                'analyticsEventCreatedAt': created,
+                'analyticsEventUpdatedAt': created,
+                'analyticsEventCreatedAtNano': created_nano,
+            })
+
+    ids = [endpoint['endpointId'] for endpoint in fixtures['endpoint']]
+    for g in range(groups):
+        fixtures['organizationEndpointGroup'].append({
+            'organizationEndpointGroupId': 200 + g,
+            'organizationEndpointGroupName': f'Bench group {g}',
+            'organizationEndpointGroupOrganizationTeam': teams[g % 3],
+            'organizationEndpointGroupUpdatedAt': now_ms - g * day_ms,
+            # Members for PrefetchIds joins from endpoint/search
+            'endpointId': ids[g::groups],
+        })
+    return fixtures
+
+def load_fixtures(path):
+    with open(path) as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock vicarius-external-data-api')
+    parser.add_argument('--fixtures', help='JSON file of {collection: [documents]}, generated when omitted')
+    parser.add_argument('--endpoints', type=int, default=100, help='Endpoints of the generated tenant')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--dump', help='Write the generated fixtures to this file and exit')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8899)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Random extra seconds, up to this much')
+    parser.add_argument('--throttle-every', type=int, default=0, help='Answer every Nth call with a 429')
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures) if args.fixtures else generate_fixtures(args.endpoints, seed=args.seed)
+    if args.dump:
+        with open(args.dump, 'w') as f:
+            f.write(json.dumps(fixtures))
+        return
+    mock = MockVicarius(fixtures, args.latency, args.jitter, args.throttle_every, args.seed)
+    url = mock.start(args.host, args.port)
+    print(f"Mock Vicarius API on {url}, point VICARIUS_API_URL at it")
+    threading.Event().wait()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+#End to end sync benchmark, runs the report pulls against mock_vicarius.py and a throwaway Postgres database
+#Usage: python app/benchmarks/sync_throughput.py [--endpoints 200] [--reports endpoints,vulnerabilities] [--latency 0.02] [--output results.json] [--baseline results.json]
+#Postgres is reached with POSTGRES_HOST/POSTGRES_PORT/POSTGRES_USER/POSTGRES_PASSWORD, a bench_<pid> database is created and dropped
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(BENCH_DIR, '..', 'scripts')
+sys.path.insert(0, SCRIPTS_DIR)
+
+import baseline
+import mock_vicarius
+
+# Report pulls in dependency order: (report, CLI function, table it fills)
+REPORTS = [
+    ('endpoints', 'ReportEndpoints', 'endpoints'),
+    ('groups', 'ReportGroupsSearchs', 'endpointgroups'),
+    ('vulnerabilities', 'ReportVunerabilities', 'activevulnerabilities'),
+    ('patches', 'ReportEndpointPatchs', 'assetspatchs'),
+    ('tasks', 'ReportTaskEvents', 'tasks'),
+    ('incidents', 'ReportIncident', 'incident'),
+]
+
+def db_settings(database=None):
+    return {
+        'host': os.environ.get('POSTGRES_HOST', 'appdb'),
+        'port': os.environ.get('POSTGRES_PORT', '5432'),
+        'user': os.environ.get('POSTGRES_USER', 'postgres'),
+        'password': os.environ.get('POSTGRES_PASSWORD', ''),
+        'database': database or f'bench_{os.getpid()}',
+    }
+
+def drop_database(settings):
+    import DatabaseConnector as db
+    # Pooled connections to the benchmark database would block the drop
+    db.close_all_connections()
+    conn = db.get_connection(dict(settings, database='postgres'))
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("DROP DATABASE IF EXISTS " + settings['database'])
+    cur.close()
+    conn.close()
+    db.close_all_connections()
+
+def count_rows(settings, table):
+    import DatabaseConnector as db
+    conn = db.get_connection(settings)
+    try:
+        with conn:
+            cur = conn.cursor()
+            cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (table,))
+            if not cur.fetchone()[0]:
+                return 0
+            cur.execute("SELECT count(*) FROM " + table)
+            rows = cur.fetchone()[0]
+            cur.close()
+    finally:
+        conn.close()
+    return rows
+
+def prepare_cli(url, settings, workdir, quota_per_minute):
+    """Point VickyTopiaReportCLI at the mock API and the benchmark database without touching state.json."""
+    import VickyTopiaReportCLI as cli
+    import httpclient
+    import ratelimit
+    cli.apikey = 'benchmark'
+    cli.organization_domain = 'benchmark'
+    cli.urldashboard = url
+    cli.host, cli.port = settings['host'], settings['port']
+    cli.user, cli.password, cli.database = settings['user'], settings['password'], settings['database']
+    with open(os.path.join(SCRIPTS_DIR, 'state.json')) as f:
+        state = json.load(f)
+    # Legacy csv writers go to the scratch directory
+    for key, value in state.items():
+        if isinstance(value, str) and value.startswith('/usr/src/app/reports/'):
+            state[key] = os.path.join(workdir, os.path.basename(value))
+    cli.dictState = state
+    # Every benchmark run measures real calls to the mock, cached responses stay in the scratch directory
+    httpclient.CACHE_DIR = os.path.join(workdir, 'http_cache')
+    httpclient.configure_cache(reads=False)
+    cli.quota = ratelimit.QuotaLedger(per_minute=quota_per_minute, burst=quota_per_minute, backend='file',
+                                      path=os.path.join(workdir, 'api_quota.json'))
+    return cli
+
+def run(args):
+    fixtures = (mock_vicarius.load_fixtures(args.fixtures) if args.fixtures
+                else mock_vicarius.generate_fixtures(args.endpoints, seed=args.seed))
+    endpoints = len(fixtures.get('endpoint', []))
+    mock = mock_vicarius.MockVicarius(fixtures, args.latency, args.jitter, args.throttle_every, args.seed)
+    url = mock.start()
+    settings = db_settings()
+    selected = args.reports.split(',') if args.reports else [name for name, _, _ in REPORTS]
+
+    import DatabaseConnector as db
+    db.check_create_database(settings['host'], settings['port'], settings['user'], settings['password'], settings['database'])
+    results = {'endpoints': endpoints, 'reports': {}}
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            cli = prepare_cli(url, settings, workdir, args.quota)
+            for name, function, table in REPORTS:
+                if name not in selected:
+                    continue
+                mock.reset_stats()
+                start = time.perf_counter()
+                getattr(cli, function)()
+                seconds = time.perf_counter() - start
+                stats = mock.stats()
+                rows = count_rows(settings, table)
+                results['reports'][name] = {
+                    'seconds': round(seconds, 3),
+                    'rows': rows,
+                    'requests': stats['requests'],
+                    'throttled': stats['throttled'],
+                    'rows_per_s': round(rows / seconds, 1) if seconds else 0,
+                    'endpoints_per_s': round(endpoints / seconds, 1) if seconds else 0,
+                }
+    finally:
+        mock.stop()
+        if not args.keep_db:
+            drop_database(settings)
+    return results
+
+def compare(results, before):
+    # A report regresses when its rows/s drops or its requests per run grow
+    for name, report in results['reports'].items():
+        previous = before.get('reports', {}).get(name, {})
+        yield f"{name} rows_per_s", report['rows_per_s'], previous.get('rows_per_s'), True
+        yield f"{name} requests", report['requests'], previous.get('requests'), False
+
+def main():
+    parser = argparse.ArgumentParser(description='Report sync benchmark against the mock Vicarius API')
+    parser.add_argument('--endpoints', type=int, default=200, help='Endpoints of the generated tenant')
+    parser.add_argument('--fixtures', help='Use this fixtures file instead of a generated tenant')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reports', help='Comma separated subset of ' + ','.join(name for name, _, _ in REPORTS))
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds the mock adds to every call')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--throttle-every', type=int, default=0, help='Mock answers every Nth call with a 429')
+    parser.add_argument('--quota', type=int, default=100000, help='API calls per minute allowed by the quota ledger')
+    parser.add_argument('--keep-db', action='store_true', help='Leave the bench_<pid> database for inspection')
+    baseline.add_arguments(parser)
+    args = parser.parse_args()
+
+    results = run(args)
+    print(f"{results['endpoints']} endpoints")
+    for name, report in results['reports'].items():
+        print(f"  {name:16} {report['seconds']:8.2f} s  {report['rows']:8} rows  {report['rows_per_s']:10.1f} rows/s"
+              f"  {report['endpoints_per_s']:8.1f} endpoints/s  {report['requests']:6} requests  {report['throttled']} throttled")
+
+    baseline.finish(args, results, compare)
+
+if __name__ == '__main__':
+    main()
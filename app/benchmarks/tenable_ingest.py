@@ -0,0 +1,109 @@
+#Tenable ingestion benchmark, runs ReportTenable and the etl_orchestrator Tenable ingest against mock_tenable.py
+#Usage: python app/benchmarks/tenable_ingest.py [--assets 20000] [--vulns 200] [--stages ReportTenable,TenableIngestor] [--output results.json] [--baseline results.json]
+#Each stage runs in its own process so its peak RSS is measured alone, Postgres settings are read as in sync_throughput.py
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+
+import baseline
+import mock_tenable
+import sync_throughput
+
+# Stage: table it fills, quoted as in the query
+STAGES = {
+    'ReportTenable': 'tenable_vulnerabilities',
+    'TenableIngestor': '"Tenable_Vulns_Raw"',
+}
+
+def run_stage(stage, database):
+    """Body of one stage process, returns seconds and peak RSS."""
+    settings = sync_throughput.db_settings(database)
+    start = time.perf_counter()
+    if stage == 'ReportTenable':
+        cli = sync_throughput.prepare_cli(None, settings, tempfile.gettempdir(), 100000)
+        cli.tenable_api_key, cli.tenable_secret_key = 'benchmark', 'benchmark'
+        cli.ReportTenable()
+    else:
+        import etl_orchestrator as etl
+        etl.CONN_STR_TENABLE = (f"postgresql://{settings['user']}:{urllib.parse.quote_plus(settings['password'])}"
+                                f"@{settings['host']}:{settings['port']}/{database}")
+        etl.TenableIngestor().fetch_and_load()
+    seconds = time.perf_counter() - start
+    return {
+        'seconds': round(seconds, 3),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'rows': sync_throughput.count_rows(settings, STAGES[stage]),
+    }
+
+def run(args):
+    tenant = mock_tenable.SyntheticTenant(args.assets, args.vulns, args.seed)
+    mock = mock_tenable.MockTenable(tenant, args.latency, args.throttle_every)
+    url = mock.start()
+    settings = sync_throughput.db_settings()
+    selected = args.stages.split(',') if args.stages else list(STAGES)
+
+    import DatabaseConnector as db
+    db.check_create_database(settings['host'], settings['port'], settings['user'], settings['password'], settings['database'])
+    env = dict(os.environ, TENABLE_API_URL=url, TENABLE_API_KEY='benchmark', TENABLE_SECRET_KEY='benchmark')
+    results = {'assets': args.assets, 'vulns_per_asset': args.vulns, 'stages': {}}
+    try:
+        for stage in selected:
+            mock.reset_stats()
+            child = subprocess.run([sys.executable, os.path.abspath(__file__), '--stage', stage, '--database', settings['database']],
+                                   env=env, capture_output=True, text=True)
+            if child.returncode != 0:
+                print(child.stdout[-2000:] + child.stderr[-2000:])
+                raise RuntimeError(f"{stage} exited with {child.returncode}")
+            result = json.loads(child.stdout.strip().splitlines()[-1])
+            stats = mock.stats()
+            result.update({'requests': stats['requests'], 'throttled': stats['throttled'],
+                           'rows_per_s': round(result['rows'] / result['seconds'], 1) if result['seconds'] else 0})
+            results['stages'][stage] = result
+    finally:
+        mock.stop()
+        if not args.keep_db:
+            sync_throughput.drop_database(settings)
+    return results
+
+def compare(results, before):
+    for stage, result in results['stages'].items():
+        previous = before.get('stages', {}).get(stage, {})
+        for key in ('seconds', 'peak_rss_mb'):
+            yield f"{stage} {key}", result[key], previous.get(key), False
+
+def main():
+    parser = argparse.ArgumentParser(description='Tenable ingestion benchmark against the mock Tenable API')
+    parser.add_argument('--assets', type=int, default=1000, help='Assets of the generated tenant')
+    parser.add_argument('--vulns', type=int, default=50, help='Findings per asset')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--stages', help='Comma separated subset of ' + ','.join(STAGES))
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds the mock adds to every call')
+    parser.add_argument('--throttle-every', type=int, default=0, help='Mock answers every Nth call with a 429')
+    parser.add_argument('--keep-db', action='store_true', help='Leave the bench_<pid> database for inspection')
+    baseline.add_arguments(parser)
+    parser.add_argument('--stage', choices=list(STAGES), help=argparse.SUPPRESS)
+    parser.add_argument('--database', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        # Stage process started by run(), the last stdout line is its result
+        print(json.dumps(run_stage(args.stage, args.database)))
+        return
+
+    results = run(args)
+    print(f"{results['assets']} assets x {results['vulns_per_asset']} vulns")
+    for stage, result in results['stages'].items():
+        print(f"  {stage:16} {result['seconds']:8.2f} s  {result['peak_rss_mb']:8.1f} MB peak  {result['rows']:9} rows"
+              f"  {result['rows_per_s']:10.1f} rows/s  {result['requests']:6} requests  {result['throttled']} throttled")
+
+    baseline.finish(args, results, compare)
+
+if __name__ == '__main__':
+    main()
@@ -25,6 +25,10 @@ sleep 20
 #date
 #/usr/local/bin/python /usr/src/app/scripts/launcher.py
 
+# Report worker: runs the jobs queued from the web app in one warm process
+# (launcher.py starts its own worker, do not run both)
+/usr/local/bin/python /usr/src/app/scripts/reportWorker.py >> /var/log/reportWorker.log 2>&1 &
+
 # New Data Lakehouse Architecture Entrypoint
 echo "🚀 Starting Data Lakehouse ETL Orchestrator..."
 /usr/local/bin/python /usr/src/app/scripts/etl_orchestrator.py 2>&1 | tee -a /var/log/etl.log
@@ -1,6 +1,8 @@
 #Author: Joaldir Rani, Juan Osorio, Jordan Hamblen
 
 import psycopg2
+import psycopg2.pool
+import psycopg2.extras
 import pandas as pd
 import datetime
 import sqlalchemy as sa
@@ -8,7 +10,180 @@ import urllib
 import urllib.parse 
 import numpy as np
 from psycopg2 import sql
+from psycopg2 import extensions
 import json
+import gzip
+import os
+import threading
+import runmetrics
+
+# Connections are pooled so the long running report worker reuses them between jobs
+# instead of opening a new connection for every insert and lookup.
+DB_POOL_MAX_CONNECTIONS = int(os.environ.get('DB_POOL_MAX_CONNECTIONS', 10))
+DB_POOL_TIMEOUT = 300
+
+_pools = {}
+_engines = {}
+_pools_lock = threading.Lock()
+
+class PooledConnection:
+    """psycopg2 connection checked out of a ConnectionPool.
+
+    Behaves like the plain connection, close() hands it back to the pool.
+    A connection that is never closed goes back when the wrapper is garbage collected.
+    """
+    def __init__(self, pool, conn):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_conn', conn)
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise psycopg2.InterfaceError("connection already returned to the pool")
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._conn.__exit__(exc_type, exc_value, traceback)
+
+    def __bool__(self):
+        return self._conn is not None
+
+    def close(self):
+        conn = self._conn
+        if conn is not None:
+            object.__setattr__(self, '_conn', None)
+            self._pool.putconn(conn)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+class MetricsCursor(extensions.cursor):
+    """Cursor counting the rows every write statement touches for the run metrics."""
+    def _record(self, query):
+        if isinstance(query, sql.Composable):
+            query = query.as_string(self)
+        elif isinstance(query, bytes):
+            query = query.decode('utf-8', 'replace')
+        runmetrics.record_statement(query, self.rowcount)
+
+    def execute(self, query, vars=None):
+        result = super().execute(query, vars)
+        self._record(query)
+        return result
+
+    def executemany(self, query, vars_list):
+        result = super().executemany(query, vars_list)
+        self._record(query)
+        return result
+
+    def copy_expert(self, query, file, size=8192):
+        result = super().copy_expert(query, file, size)
+        self._record(query)
+        return result
+
+class ConnectionPool:
+    def __init__(self, db_params, maxconn=DB_POOL_MAX_CONNECTIONS):
+        self.db_params = dict(db_params)
+        self.idle = []
+        self.lock = threading.Lock()
+        self.maxconn = maxconn
+        self.slots = threading.BoundedSemaphore(maxconn)
+        # Checked out connections and threads waiting for one, read by pool_stats()
+        self.in_use = 0
+        self.waiting = 0
+
+    def getconn(self):
+        with self.lock:
+            self.waiting += 1
+        acquired = self.slots.acquire(timeout=DB_POOL_TIMEOUT)
+        with self.lock:
+            self.waiting -= 1
+        if not acquired:
+            raise psycopg2.pool.PoolError("timed out waiting for a free database connection")
+        conn = None
+        with self.lock:
+            self.in_use += 1
+            while self.idle and conn is None:
+                conn = self.idle.pop()
+                if conn.closed:
+                    conn = None
+        if conn is None:
+            try:
+                conn = psycopg2.connect(cursor_factory=MetricsCursor, **self.db_params)
+            except Exception:
+                with self.lock:
+                    self.in_use -= 1
+                self.slots.release()
+                raise
+        return PooledConnection(self, conn)
+
+    def putconn(self, conn):
+        try:
+            if not conn.closed:
+                # Leave no open transaction or session setting behind for the next user
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                conn.autocommit = False
+                with self.lock:
+                    self.idle.append(conn)
+        except psycopg2.Error:
+            conn.close()
+        finally:
+            with self.lock:
+                self.in_use -= 1
+            self.slots.release()
+
+    def closeall(self):
+        with self.lock:
+            for conn in self.idle:
+                conn.close()
+            self.idle = []
+
+def get_connection(db_params):
+    """Drop in replacement for get_connection(db_params) that reuses pooled connections."""
+    key = tuple(sorted((k, str(v)) for k, v in db_params.items()))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(db_params)
+    return pool.getconn()
+
+def pool_stats():
+    """One dict per connection pool of this process: database, in_use, idle, waiting and max connections."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    stats = []
+    for pool in pools:
+        with pool.lock:
+            stats.append({'database': pool.db_params.get('database'), 'in_use': pool.in_use,
+                          'idle': len(pool.idle), 'waiting': pool.waiting, 'max': pool.maxconn})
+    return stats
+
+def get_engine(host, port, user, password, database):
+    """Return one cached SQLAlchemy engine per database, engines keep their own connection pool."""
+    key = (host, str(port), user, password, database)
+    with _pools_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            enpassword = urllib.parse.quote_plus(password)
+            engine = _engines[key] = sa.create_engine(f"postgresql://{user}:{enpassword}@{host}:{port}/{database}", pool_pre_ping=True)
+    return engine
+
+def close_all_connections():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.closeall()
+        for engine in _engines.values():
+            engine.dispose()
 
 def add_column_to_table(cur, table, columnName):
     for col in columnName:
@@ -38,7 +213,7 @@ def create_table_views(host, port, user, password, database):
         'database': database  # Nome do banco de dados onde The table "incidente" deve ser verificada/criada
     }
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -213,7 +388,7 @@ def repair_table_incidents(host, port, user, password, database):
         'password': password,
         'database': database
     }
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
     cur = conn.cursor()
     table = "incident"
@@ -242,7 +417,7 @@ def repair_table_tasks(host, port, user, password, database):
         'password': password,
         'database': database
     }
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
     cur = conn.cursor()
     table = "tasks"
@@ -268,7 +443,7 @@ def repair_table_scriptActivity(host, port, user, password, database):
         'password': password,
         'database': database
     }
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
     cur = conn.cursor()
     table = "scriptactivity"
@@ -291,7 +466,7 @@ def check_create_database(host, port, user, password, database):
     }
 
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -323,7 +498,7 @@ def check_create_table_endpoints(host, port, user, password, database):
     }
 
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -403,7 +578,7 @@ def insert_into_table_endpointsold(data_string, host, port, user, password, data
         'database': database  # Nome do banco de dados onde The table "endpoints" está localizada
     }
     ct = datetime.datetime.now()
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     cur = conn.cursor()
@@ -445,7 +620,7 @@ def insert_into_table_endpoints(json_data, host, port, user, password, database)
         'database': database  # Nome do banco de dados onde The table "endpoints" está localizada
     }
     ct = datetime.datetime.now()
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     cur = conn.cursor()
@@ -482,7 +657,7 @@ def load_endpoints_LEID(host,port,user,password,database):
         'database': database
     }
 
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
     cur = conn.cursor()
 
@@ -515,7 +690,7 @@ def clean_table_endpoints(host, port, user, password, database):
     }
 
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -545,9 +720,8 @@ def load_endpoints_to_df(host, port, user, password, database):
         'password': password,
         'database': database
     }
-    enpassword = urllib.parse.quote_plus(password)
     # Create connection string
-    engine = sa.create_engine(f"postgresql://{user}:{enpassword}@{host}:{port}/{database}")
+    engine = get_engine(host, port, user, password, database)
     # Load table into DataFrame
     try:
         sql = (f"select * from {table}")
@@ -559,6 +733,108 @@ def load_endpoints_to_df(host, port, user, password, database):
         print(f"Error loading table {table} into DataFrame: {e}")
         return None
 
+# Rows fetched per round trip by iter_query's server side cursor and per batch by iter_keyset
+ITER_SIZE = int(os.environ.get('DB_ITER_SIZE', 2000))
+
+def iter_query(query, params, host, port, user, password, database, itersize=ITER_SIZE):
+    """Yield the rows of query as named tuples through a server side cursor, itersize rows per round trip.
+
+    Memory stays flat whatever the size of the result. The pooled connection and its
+    transaction stay open until the generator is exhausted or closed, loops doing API
+    calls per row use iter_keyset instead.
+    """
+    db_params = {
+        'host': host,
+        'port': port,
+        'user': user,
+        'password': password,
+        'database': database
+    }
+    conn = get_connection(db_params)
+    try:
+        with conn:
+            cur = conn.cursor(name=f"iter_{threading.get_ident()}_{id(conn)}", cursor_factory=psycopg2.extras.NamedTupleCursor)
+            cur.itersize = itersize
+            try:
+                cur.execute(query, params)
+                for row in cur:
+                    yield row
+            finally:
+                cur.close()
+    finally:
+        conn.close()
+
+def iter_table(host, port, user, password, database, table, columns, itersize=ITER_SIZE):
+    """Stream only columns of table, the iterator counterpart of load_table_to_df."""
+    query = sql.SQL("SELECT {} FROM {}").format(sql.SQL(', ').join(map(sql.Identifier, columns)), sql.Identifier(table))
+    return iter_query(query, None, host, port, user, password, database, itersize)
+
+def iter_keyset(host, port, user, password, database, table, columns, key, condition=None, params=None, batch=ITER_SIZE):
+    """Yield one row per distinct key of table as named tuples of columns, in key order, batch rows per query.
+
+    Every batch is a short query starting after the last key of the previous one, its pooled
+    connection is released before the rows are yielded. A loop spending hours on API calls
+    per row holds no connection, transaction or snapshot in between. Rows with a NULL key
+    are skipped, condition is an extra SQL filter string using the %(name)s params.
+    """
+    db_params = {
+        'host': host,
+        'port': port,
+        'user': user,
+        'password': password,
+        'database': database
+    }
+    columns = list(columns) if key in columns else [key] + list(columns)
+    extra = sql.SQL(' AND ({})').format(sql.SQL(condition)) if condition else sql.SQL('')
+
+    def page_query(start):
+        return sql.SQL("SELECT DISTINCT ON ({key}) {columns} FROM {table} WHERE {key} IS NOT NULL{start}{extra} ORDER BY {key} LIMIT %(batch)s").format(
+            key=sql.Identifier(key), columns=sql.SQL(', ').join(map(sql.Identifier, columns)), table=sql.Identifier(table),
+            start=sql.SQL(start).format(sql.Identifier(key)), extra=extra)
+
+    first, following = page_query(''), page_query(' AND {} > %(after)s')
+    after = None
+    while True:
+        conn = get_connection(db_params)
+        try:
+            with conn:
+                cur = conn.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor)
+                cur.execute(first if after is None else following, dict(params or {}, after=after, batch=batch))
+                rows = cur.fetchall()
+                cur.close()
+        finally:
+            conn.close()
+        for row in rows:
+            yield row
+        if len(rows) < batch:
+            return
+        after = getattr(rows[-1], key)
+
+def iter_endpoints(host, port, user, password, database, columns=('endpoint_name', 'endpoint_hash'), itersize=ITER_SIZE):
+    """Stream the endpoints once per endpoint_hash, the iterator counterpart of load_endpoints_to_df."""
+    return iter_keyset(host, port, user, password, database, 'endpoints', columns, 'endpoint_hash', batch=itersize)
+
+def count_table(host, port, user, password, database, table, distinct=None):
+    # distinct counts the distinct values of one column, what iter_keyset yields when keyed on it
+    db_params = {
+        'host': host,
+        'port': port,
+        'user': user,
+        'password': password,
+        'database': database
+    }
+    conn = get_connection(db_params)
+    conn.autocommit = True
+    cur = conn.cursor()
+    if distinct:
+        cur.execute(sql.SQL("SELECT count(DISTINCT {}) FROM {}").format(sql.Identifier(distinct), sql.Identifier(table)))
+    else:
+        cur.execute(sql.SQL("SELECT count(*) FROM {}").format(sql.Identifier(table)))
+    count = cur.fetchone()[0]
+    cur.close()
+    conn.close()
+    return count
+
 def insert_into_table_endpointsStatusold(data_string, host, port, user, password, database):
     #print (data_string)
     # Parâmetros de conexão
@@ -570,7 +846,7 @@ def insert_into_table_endpointsStatusold(data_string, host, port, user, password
         'database': database  # Nome do banco de dados onde The table "endpoints" está localizada
     }
     ct = datetime.datetime.now()
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     cur = conn.cursor()
@@ -611,7 +887,7 @@ def insert_into_table_endpointsStatus(json_data, host, port, user, password, dat
         'database': database  # Nome do banco de dados onde The table "endpoints" está localizada
     }
     ct = datetime.datetime.now()
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     cur = conn.cursor()
@@ -635,6 +911,48 @@ def insert_into_table_endpointsStatus(json_data, host, port, user, password, dat
         # Printing the last executed query can help in debugging
         print(cur.mogrify(sql, record))
 
+def insert_into_table_endpoints_page(endpoints_json, status_json, host, port, user, password, database):
+    """Write one page of endpoints and their status rows in a single transaction.
+
+    Returns True when the page was committed.
+    """
+    db_params = {
+        'host': host,
+        'port': port,
+        'user': user,
+        'password': password,
+        'database': database
+    }
+    ct = datetime.datetime.now()
+    conn = get_connection(db_params)
+    stored = False
+    try:
+        with conn:
+            cur = conn.cursor()
+            # execute_values sends the page as multi row INSERTs instead of one round trip per record
+            psycopg2.extras.execute_values(cur, """
+                INSERT INTO endpoints
+                (endpoint_id, endpoint_name, endpoint_hash, alive, operating_system_name, agent_version, substatus, connectedbyProxy, tokenGenTime, deployed, last_connected, deploymentDate, LastContactDate)
+                VALUES %s
+            """, endpoints_json,
+                template="(%(endpointId)s, %(endpointName)s, %(endpointHash)s, %(alive)s, %(operatingSystemName)s, %(agentVersion)s, %(substatus)s, %(connectedbyProxy)s, %(tokenGenTime)s, %(deployment_date)s, %(last_connected)s, %(deploymentDate)s, %(LastContact)s)",
+                page_size=1000)
+            psycopg2.extras.execute_values(cur, """
+                INSERT INTO endpoints_status
+                (endpoint_id, endpoint_name, endpoint_hash, alive, connectedbyProxy, LastContactDate, runtime)
+                VALUES %s
+            """, status_json,
+                template="(%(endpointId)s, %(endpointName)s, %(endpointHash)s, %(alive)s, %(connectedbyProxy)s, %(LastContact)s, %(runtime)s)",
+                page_size=1000)
+            cur.close()
+        stored = True
+        print(str(ct) + f"Records inserted into the tables 'endpoints' and 'endpoints_status' successfully:  {len (endpoints_json)}")
+    except psycopg2.Error as e:
+        print(str(ct) + "An error occurred while inserting data into the tables 'endpoints' and 'endpoints_status':", e)
+    finally:
+        conn.close()
+    return stored
+
 def check_create_table_endpointsAttribute(host, port, user, password, database):
     # Parâmetros de conexão
     db_params = {
@@ -646,7 +964,7 @@ def check_create_table_endpointsAttribute(host, port, user, password, database):
     }
 
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -690,7 +1008,7 @@ def insert_into_table_endpointsAttribute(json_data, host, port, user, password,
         'database': database  # Nome do banco de dados onde The table "endpoints" está localizada
     }
     ct = datetime.datetime.now()
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     cur = conn.cursor()
@@ -730,7 +1048,7 @@ def clean_table_endpointsAttribute(host, port, user, password, database):
     }
 
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -762,7 +1080,7 @@ def check_create_table_endpointsImpactFactors(host, port, user, password, databa
     }
 
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -805,7 +1123,7 @@ def insert_into_table_endpointsImpactFactors(json_data, host, port, user, passwo
         'database': database  # Nome do banco de dados onde The table "endpoints" está localizada
     }
     ct = datetime.datetime.now()
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     cur = conn.cursor()
@@ -845,7 +1163,7 @@ def clean_table_endpointsImpactFactors(host, port, user, password, database):
     }
 
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -877,7 +1195,7 @@ def check_create_table_endpointsExploitabilityRiskFactors(host, port, user, pass
     }
 
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -920,7 +1238,7 @@ def insert_into_table_endpointsExploitabilityRiskFactors(json_data, host, port,
         'database': database  # Nome do banco de dados onde The table "endpoints" está localizada
     }
     ct = datetime.datetime.now()
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     cur = conn.cursor()
@@ -960,7 +1278,7 @@ def clean_table_endpointsExploitabilityRiskFactors(host, port, user, password, d
     }
 
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -992,7 +1310,7 @@ def check_create_table_groupendpoints(host, port, user, password, database):
     }
 
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -1027,7 +1345,7 @@ def insert_into_table_groupendpoints(data_string, host, port, user, password, da
     }
     ct = datetime.datetime.now()
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -1066,7 +1384,7 @@ def clean_table_groupendpoints(host, port, user, password, database):
     }
 
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -1106,7 +1424,7 @@ def check_create_table_incident(host, port, user, password, database):
         'database': database  # Nome do banco de dados onde The table "incidente" deve ser verificada/criada
     }
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -1158,7 +1476,46 @@ def check_create_table_incident(host, port, user, password, database):
     cur.close()
     conn.close()
 
-def insert_into_table_incident(json_data, host, port, user, password, database):
+def insert_page_rows(cur, table, query, template, records, ct):
+    """Insert a page with one execute_values statement, row by row only when the batch fails.
+
+    query ends in VALUES %s, template is the row of one record. In the fallback a bad row only
+    rolls back its own savepoint. Returns the number of rows inserted.
+    """
+    if not records:
+        return 0
+    cur.execute("SAVEPOINT page_rows")
+    try:
+        psycopg2.extras.execute_values(cur, query, records, template=template, page_size=1000)
+        cur.execute("RELEASE SAVEPOINT page_rows")
+        return len(records)
+    except psycopg2.Error as e:
+        cur.execute("ROLLBACK TO SAVEPOINT page_rows")
+        print(str(ct) + f" The page could not be inserted into '{table}' at once, inserting row by row: {e}")
+    row_query = query.replace('%s', template)
+    inserted = 0
+    for record in records:
+        cur.execute("SAVEPOINT page_row")
+        try:
+            cur.execute(row_query, record)
+            cur.execute("RELEASE SAVEPOINT page_row")
+            inserted += 1
+        except psycopg2.Error as e:
+            cur.execute("ROLLBACK TO SAVEPOINT page_row")
+            print(str(ct) + f" An error occurred while inserting a row into '{table}': {e}")
+            print(cur.mogrify(row_query, record))
+    return inserted
+
+# Also used by replace_landed_rows
+INCIDENT_INSERT_SQL = """
+INSERT INTO incident (endpoint_id, endpoint_hash, asset, cve, cvss, event_type, publisher, product, threat_level_id,vulnerability_v3_exploitability_level, vulnerability_v3_base_score, patch_id, vulnerability_summary, created_at_milli, updated_at_milli, create_at_nano, h_created_at, h_updated_at, mitigated_event_detected_at)
+VALUES %s
+"""
+INCIDENT_INSERT_TEMPLATE = """(%(assetId)s, %(assetHash)s, %(asset)s, %(cve)s, %(cvss)s, %(eventType)s, %(publisher)s, %(product)s, 
+%(threatLevelId)s, %(vulnerabilityV3ExploitabilityLevel)s, %(vulnerabilityV3BaseScore)s, %(patchId)s, %(vulnerabilitySummary)s, %(created_at_milli)s, %(updated_at_milli)s, %(create_at_nano)s, %(created_at)s, %(updated_at)s, %(mitigated_event_detected_at)s)"""
+INCIDENT_NEW_COLUMNS = ["endpoint_hash text"]
+
+def insert_into_table_incident(json_data, host, port, user, password, database, watermark=None):
     # Connection parameters
     db_params = {
         'host': host,
@@ -1169,42 +1526,36 @@ def insert_into_table_incident(json_data, host, port, user, password, database):
     }
     ct = datetime.datetime.now()
     # Connect to PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Create cursor
     cur = conn.cursor()
     table = "incident"
-    columnNmae = [
-        "endpoint_hash text"
-    ]
-    add_column_to_table(cur,table,columnNmae)
+    add_column_to_table(cur,table,INCIDENT_NEW_COLUMNS)
+    # The page and its watermark are committed together, a bad row only rolls back its own savepoint
+    conn.autocommit = False
     # Insert data into the "incident" table
     try:
-        sql = """
-        INSERT INTO incident (endpoint_id, endpoint_hash, asset, cve, cvss, event_type, publisher, product, threat_level_id,vulnerability_v3_exploitability_level, vulnerability_v3_base_score, patch_id, vulnerability_summary, created_at_milli, updated_at_milli, create_at_nano, h_created_at, h_updated_at, mitigated_event_detected_at) VALUES (%(assetId)s, %(assetHash)s, %(asset)s, %(cve)s, %(cvss)s, %(eventType)s, %(publisher)s, %(product)s, 
-        %(threatLevelId)s, %(vulnerabilityV3ExploitabilityLevel)s, %(vulnerabilityV3BaseScore)s, %(patchId)s, %(vulnerabilitySummary)s, %(created_at_milli)s, %(updated_at_milli)s, %(create_at_nano)s, %(created_at)s, %(updated_at)s, %(mitigated_event_detected_at)s) 
-        """
-        inserted_records = 0
-        for record in json_data:
-            #print(record)
-            try:
-                cur.execute(sql, record)
-
-                inserted_records += 1
-
-            except psycopg2.Error as e:
-                print(str(ct) + "An error occurred while inserting data into the table 'incident':()", e)
-                # Printing the last executed query can help in debugging
-                print(cur.mogrify(sql, record))
+        if watermark and not claim_watermark(cur, watermark):
+            print(str(ct) + " - 'incidents' page already stored by another run, skipping it")
+            json_data = []
+        inserted_records = insert_page_rows(cur, table, INCIDENT_INSERT_SQL, INCIDENT_INSERT_TEMPLATE, json_data, ct)
+        if watermark:
+            advance_watermark(cur, watermark)
+        conn.commit()
+        stored = True
         print(str(ct) + f" - {inserted_records}  'incidents' inserted successfull at {str(ct)}")
         #print("Incidents Inserted")
     except Exception as e:
+        conn.rollback()
+        stored = False
         print(str(ct) + "An error occurred while inserting data into the table 'incident':()", e)
 
     # Close connection
     cur.close()
     conn.close()
+    return stored
 
 def load_task_to_df(host, port, user, password, database, maxDate):
     table = "tasks"
@@ -1216,9 +1567,8 @@ def load_task_to_df(host, port, user, password, database, maxDate):
         'password': password,
         'database': database
     }
-    enpassword = urllib.parse.quote_plus(password)
     # Create connection string
-    engine = sa.create_engine(f"postgresql://{user}:{enpassword}@{host}:{port}/{database}")
+    engine = get_engine(host, port, user, password, database)
     # Load table into DataFrame
     try:
         sql = (f"select {column} from {table} where {table}.{column} <= {maxDate} Order BY {column} DESC LIMIT 1")
@@ -1241,9 +1591,8 @@ def load_tasks_waiting_to_dfold(two_weeks_ago, host, port, user, password, datab
         'password': password,
         'database': database
     }
-    enpassword = urllib.parse.quote_plus(password)
     # Create connection string
-    engine = sa.create_engine(f"postgresql://{user}:{enpassword}@{host}:{port}/{database}")
+    engine = get_engine(host, port, user, password, database)
     # Load table into DataFrame
     try:
         #sql = (f"select * from {table} where {table}.{column} > {two_weeks_ago} and action_status = 'Waiting'")
@@ -1302,8 +1651,7 @@ def load_tasks_waiting_to_df(two_weeks_ago, host, port, user, password, database
     column = "hcreateat"
     
     # Create connection string
-    enpassword = urllib.parse.quote_plus(password)
-    engine = sa.create_engine(f"postgresql://{user}:{enpassword}@{host}:{port}/{database}")
+    engine = get_engine(host, port, user, password, database)
     
     # Load table into DataFrame
     try:
@@ -1323,6 +1671,12 @@ def load_tasks_waiting_to_df(two_weeks_ago, host, port, user, password, database
         print(f"Error loading table {table} into DataFrame: {e}")
         return None
 
+def iter_tasks_waiting(two_weeks_ago, host, port, user, password, database, itersize=ITER_SIZE):
+    """Stream the automation_id of the automations still Waiting, the iterator counterpart of load_tasks_waiting_to_df."""
+    condition = "hcreateat > %(two_weeks_ago)s AND action_status = 'Waiting'"
+    return iter_keyset(host, port, user, password, database, 'tasks', ['automation_id'], 'automation_id',
+                       condition, {'two_weeks_ago': two_weeks_ago}, itersize)
+
 def drop_tasks_waiting_to_dfold(two_weeks_ago, host, port, user, password, database):
     table = "tasks"
     column = "hcreateat"
@@ -1333,9 +1687,8 @@ def drop_tasks_waiting_to_dfold(two_weeks_ago, host, port, user, password, datab
         'password': password,
         'database': database
     }
-    enpassword = urllib.parse.quote_plus(password)
     # Create connection string
-    engine = sa.create_engine(f"postgresql://{user}:{enpassword}@{host}:{port}/{database}")
+    engine = get_engine(host, port, user, password, database)
     # Load table into DataFrame
     try:
         #sql = (f"select * from {table} where {table}.{column} > {two_weeks_ago} and action_status = 'Waiting'")
@@ -1394,10 +1747,9 @@ def drop_tasks_waiting_to_df(two_weeks_ago, host, port, user, password, database
     column = "hcreateat"
     
     # URL encode the password
-    enpassword = urllib.parse.quote_plus(password)
     
     # Create connection string using SQLAlchemy
-    engine = sa.create_engine(f"postgresql://{user}:{enpassword}@{host}:{port}/{database}")
+    engine = get_engine(host, port, user, password, database)
     
     # Ensure numpy types are cast to native Python types
     aID = int(aID) if isinstance(aID, np.integer) else aID
@@ -1429,7 +1781,7 @@ def load_last_task(host, port, user, password, database):
         'password': password,
         'database': database
     }
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     with conn.cursor() as cur:
         # Construct the query using psycopg2's SQL template language for safety
         query = sql.SQL("""
@@ -1452,9 +1804,8 @@ def load_incident_to_df(host, port, user, password, database, maxDate):
         'password': password,
         'database': database
     }
-    enpassword = urllib.parse.quote_plus(password)
     # Create connection string
-    engine = sa.create_engine(f"postgresql://{user}:{enpassword}@{host}:{port}/{database}")
+    engine = get_engine(host, port, user, password, database)
     # Load table into DataFrame
     try:
         sql = (f"select {column} from {table} where {table}.{column} <= {maxDate} Order BY {column} DESC LIMIT 1")
@@ -1477,7 +1828,7 @@ def check_create_table_activevulnerabilities(host, port, user, password, databas
     }
 
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -1539,7 +1890,7 @@ def insert_into_table_activevulnerabilities(json_data, host, port, user, passwor
     }
     ct = datetime.datetime.now()
     # Connect to PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Create cursor
@@ -1588,7 +1939,7 @@ def clean_table_activevulnerabilities(host, port, user, password, database):
     }
 
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -1618,7 +1969,7 @@ def check_create_table_tasks(host, port, user, password, database):
         'database': database
     }
 
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
     cur = conn.cursor()
 
@@ -1677,7 +2028,7 @@ def insert_into_table_tasksold(json_data, host, port, user, password, database):
     }
     ct = datetime.datetime.now()
     # Connect to PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Create cursor
@@ -1712,7 +2063,34 @@ def insert_into_table_tasksold(json_data, host, port, user, password, database):
     cur.close()
     conn.close()
 
-def insert_into_table_tasks(json_data, host, port, user, password, database):
+TASKS_INSERT_SQL = """
+INSERT INTO tasks (
+    endpoint_id, task_id, automation_id, automation_name, 
+    endpoint_hash, asset, task_type, publisher_name, 
+    path_or_product, path_or_product_desc, patch_name, 
+    patch_file_name, patch_package_file_name, patch_release_date, 
+    action_status, message_status, username, team, run_sequence, 
+    asset_status, createatnano, updateatnano, hcreateat, 
+    hupdateat, created_at, updated_at
+)
+VALUES %s
+"""
+TASKS_INSERT_TEMPLATE = """(
+    %(endpointId)s, %(taskid)s, %(automationId)s, %(automationName)s, 
+    %(assetHash)s, %(asset)s, %(taskType)s, %(publisherName)s, 
+    %(pathproduct)s, %(pathproductdesc)s, %(patchName)s, 
+    %(patchFileName)s, %(patchPackageFileName)s, %(patchReleaseDate)s, 
+    %(actionStatus)s, %(messageStatus)s, %(username)s, %(orgTeam)s, 
+    %(runSequence)s, %(assetStatus)s, %(createAtNano)s, %(updateAtNano)s, 
+    %(hcreateAt)s, %(hupdateAt)s, %(createAt)s, %(updateAt)s
+)"""
+TASKS_NEW_COLUMNS = ['endpoint_hash TEXT', 'patch_name TEXT', 'patch_file_name TEXT', 'patch_package_file_name TEXT', 'patch_release_date BIGINT']
+
+def insert_into_table_tasks(json_data, host, port, user, password, database, watermark=None):
+    """Insert a page of tasks in one transaction, together with the (tenant, stream, value) watermark when given.
+
+    Returns False when the page was rolled back.
+    """
     # DB connection parameters
     db_params = {
         'host': host,
@@ -1723,65 +2101,44 @@ def insert_into_table_tasks(json_data, host, port, user, password, database):
     }
     ct = datetime.datetime.now()
     
+    # The pooled connection goes back in the finally, psycopg2's "with conn" never closes it
+    conn = get_connection(db_params)
     try:
-        # Connect to PostgreSQL using a context manager
-        with psycopg2.connect(**db_params) as conn:
-            # Disable autocommit for transaction management
-            conn.autocommit = False
+        # Disable autocommit for transaction management
+        conn.autocommit = False
+
+        # Create cursor, closed with its block
+        with conn.cursor() as cur:
+            table = "tasks"
             
-            # Create cursor within the connection context
-            with conn.cursor() as cur:
-                table = "tasks"
-                
-                # Columns to add dynamically if not already present
-                columnName = [
-                    'endpoint_hash TEXT',
-                    'patch_name TEXT',
-                    'patch_file_name TEXT',
-                    'patch_package_file_name TEXT',
-                    'patch_release_date BIGINT'
-                ]
-                
-                # Dynamically add columns (assuming add_column_to_table handles this safely)
-                add_column_to_table(cur, table, columnName)
-
-                # Define the SQL query with parameterized placeholders
-                sql_query = """
-                    INSERT INTO tasks (
-                        endpoint_id, task_id, automation_id, automation_name, 
-                        endpoint_hash, asset, task_type, publisher_name, 
-                        path_or_product, path_or_product_desc, patch_name, 
-                        patch_file_name, patch_package_file_name, patch_release_date, 
-                        action_status, message_status, username, team, run_sequence, 
-                        asset_status, createatnano, updateatnano, hcreateat, 
-                        hupdateat, created_at, updated_at
-                    ) 
-                    VALUES (
-                        %(endpointId)s, %(taskid)s, %(automationId)s, %(automationName)s, 
-                        %(assetHash)s, %(asset)s, %(taskType)s, %(publisherName)s, 
-                        %(pathproduct)s, %(pathproductdesc)s, %(patchName)s, 
-                        %(patchFileName)s, %(patchPackageFileName)s, %(patchReleaseDate)s, 
-                        %(actionStatus)s, %(messageStatus)s, %(username)s, %(orgTeam)s, 
-                        %(runSequence)s, %(assetStatus)s, %(createAtNano)s, %(updateAtNano)s, 
-                        %(hcreateAt)s, %(hupdateAt)s, %(createAt)s, %(updateAt)s
-                    )
-                """
-                
-                # Insert records using executemany for batch processing
-                cur.executemany(sql_query, json_data)
-                
-                # Commit the transaction
-                conn.commit()
-                
-                print(f"{ct} The data was inserted into the 'tasks' table successfully!")
-    
+            # Dynamically add columns (assuming add_column_to_table handles this safely)
+            add_column_to_table(cur, table, TASKS_NEW_COLUMNS)
+
+            if watermark and not claim_watermark(cur, watermark):
+                print(f"{ct} 'tasks' page already stored by another run, skipping it")
+                json_data = []
+
+            # A bad row only rolls back its own savepoint, the page and watermark still commit
+            inserted_records = insert_page_rows(cur, table, TASKS_INSERT_SQL, TASKS_INSERT_TEMPLATE, json_data, ct)
+            if watermark:
+                advance_watermark(cur, watermark)
+            
+            # Commit the transaction
+            conn.commit()
+            
+            print(f"{ct} {inserted_records} rows were inserted into the 'tasks' table successfully!")
+            return True
+
     except psycopg2.Error as e:
         # Rollback the transaction if an error occurs
-        if conn:
-            conn.rollback()
+        conn.rollback()
         print(f"{ct} An error occurred when inserting data into the 'tasks' table: {e}")
     except Exception as e:
+        conn.rollback()
         print(f"{ct} General error: {e}")
+    finally:
+        conn.close()
+    return False
 
 def update_table_tasks(json_data, host, port, user, password, database):
     # DB connection parameters
@@ -1794,58 +2151,60 @@ def update_table_tasks(json_data, host, port, user, password, database):
     }
     ct = datetime.datetime.now()
     
+    # The pooled connection goes back in the finally, psycopg2's "with conn" never closes it
+    conn = get_connection(db_params)
     try:
-        # Connect to PostgreSQL using a context manager
-        with psycopg2.connect(**db_params) as conn:
-            # Disable autocommit for transaction management
-            conn.autocommit = False
+        # Disable autocommit for transaction management
+        conn.autocommit = False
+
+        # Create cursor, closed with its block
+        with conn.cursor() as cur:
+            table = "tasks"
             
-            # Create cursor within the connection context
-            with conn.cursor() as cur:
-                table = "tasks"
-                
-                # Define the SQL UPDATE query with parameterized placeholders
-                sql_query = """
-                    UPDATE tasks
-                    SET
-                        automation_name = %(automationName)s,
-                        endpoint_hash = %(assetHash)s,
-                        asset = %(asset)s,
-                        task_type = %(taskType)s,
-                        publisher_name = %(publisherName)s,
-                        path_or_product = %(pathproduct)s,
-                        path_or_product_desc = %(pathproductdesc)s,
-                        patch_name = %(patchName)s,
-                        patch_file_name = %(patchFileName)s,
-                        patch_package_file_name = %(patchPackageFileName)s,
-                        patch_release_date = %(patchReleaseDate)s,
-                        action_status = %(actionStatus)s,
-                        message_status = %(messageStatus)s,
-                        username = %(username)s,
-                        team = %(orgTeam)s,
-                        run_sequence = %(runSequence)s,
-                        asset_status = %(assetStatus)s,
-                        updateatnano = %(updateAtNano)s,
-                        hupdateat = %(hupdateAt)s,
-                        updated_at = %(updateAt)s
-                    WHERE createatnano = %(createAtNano)s
-                """
-                
-                # Update records using executemany for batch processing
-                cur.executemany(sql_query, json_data)
-                
-                # Commit the transaction
-                conn.commit()
-                
-                print(f"{ct} The data was updated in the 'tasks' table successfully!")
-    
+            # Define the SQL UPDATE query with parameterized placeholders
+            sql_query = """
+                UPDATE tasks
+                SET
+                    automation_name = %(automationName)s,
+                    endpoint_hash = %(assetHash)s,
+                    asset = %(asset)s,
+                    task_type = %(taskType)s,
+                    publisher_name = %(publisherName)s,
+                    path_or_product = %(pathproduct)s,
+                    path_or_product_desc = %(pathproductdesc)s,
+                    patch_name = %(patchName)s,
+                    patch_file_name = %(patchFileName)s,
+                    patch_package_file_name = %(patchPackageFileName)s,
+                    patch_release_date = %(patchReleaseDate)s,
+                    action_status = %(actionStatus)s,
+                    message_status = %(messageStatus)s,
+                    username = %(username)s,
+                    team = %(orgTeam)s,
+                    run_sequence = %(runSequence)s,
+                    asset_status = %(assetStatus)s,
+                    updateatnano = %(updateAtNano)s,
+                    hupdateat = %(hupdateAt)s,
+                    updated_at = %(updateAt)s
+                WHERE createatnano = %(createAtNano)s
+            """
+            
+            # Update records using executemany for batch processing
+            cur.executemany(sql_query, json_data)
+            
+            # Commit the transaction
+            conn.commit()
+            
+            print(f"{ct} The data was updated in the 'tasks' table successfully!")
+
     except psycopg2.Error as e:
         # Rollback the transaction if an error occurs
-        if conn:
-            conn.rollback()
+        conn.rollback()
         print(f"{ct} An error occurred when updating data in the 'tasks' table: {e}")
     except Exception as e:
+        conn.rollback()
         print(f"{ct} General error: {e}")
+    finally:
+        conn.close()
 
 def clean_table_tasks(host, port, user, password, database):
     db_params = {
@@ -1856,7 +2215,7 @@ def clean_table_tasks(host, port, user, password, database):
         'database': database
     }
 
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
     cur = conn.cursor()
 
@@ -1890,7 +2249,7 @@ def check_create_table_assetspatchs(host, port, user, password, database):
         'database': database
     }
 
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
     cur = conn.cursor()
 
@@ -1932,7 +2291,7 @@ def insert_into_table_assetspatchs(json_data, host, port, user, password, databa
     }
     ct = datetime.datetime.now()
     # Connect to PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
     cur = conn.cursor()
 
@@ -1975,7 +2334,7 @@ def clean_table_assetspatchs(host, port, user, password, database):
         'database': database
     }
     ct = datetime.datetime.now()
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
     cur = conn.cursor()
 
@@ -2004,7 +2363,7 @@ def check_create_table_apps(host,port,user,password,database):
         'database': database
     }
 
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
     cur = conn.cursor()
 
@@ -2045,7 +2404,7 @@ def insert_into_table_apps(json_data,host,port,user,password,database):
     }
     ct = datetime.datetime.now()
     # Connect to PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
     cur = conn.cursor()
 
@@ -2073,6 +2432,41 @@ def insert_into_table_apps(json_data,host,port,user,password,database):
     cur.close()
     conn.close()
 
+def replace_table_apps(apps, host, port, user, password, database):
+    """Replace every row of apps in one transaction, readers never see a half loaded table.
+
+    Returns True when the new rows were committed, on failure the previous rows are kept.
+    """
+    db_params = {
+        'host': host,
+        'port': port,
+        'user': user,
+        'password': password,
+        'database': database
+    }
+    ct = datetime.datetime.now()
+    conn = get_connection(db_params)
+    stored = False
+    try:
+        with conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM apps;")
+            psycopg2.extras.execute_values(cur, """
+                INSERT INTO apps
+                (appName, productID, publisherHash, riskLevel, riskScore, vulRiskFactor, predictedAttackSurface, patch, vulExploit, ProductUpdatedAt)
+                VALUES %s
+            """, apps,
+                template="(%(appName)s, %(productID)s, %(publisherHash)s, %(riskLevel)s, %(riskScore)s, %(vulRiskFactor)s, %(predictedAttackSurface)s, %(patch)s, %(vulExploit)s, %(ProductUpdatedAt)s)",
+                page_size=1000)
+            cur.close()
+        stored = True
+        print(str(ct) + f"Records inserted into the table 'apps' successfully:  {len(apps)}")
+    except psycopg2.Error as e:
+        print(str(ct) + "An error occurred while replacing the rows of the table 'apps':", e)
+    finally:
+        conn.close()
+    return stored
+
 def clean_table_apps(host, port, user, password, database):
     db_params = {
         'host': host,
@@ -2082,7 +2476,7 @@ def clean_table_apps(host, port, user, password, database):
         'database': database
     }
     ct = datetime.datetime.now()
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
     cur = conn.cursor()
 
@@ -2107,7 +2501,7 @@ def check_create_table_scriptActivity(host,port,user,password,database):
         'database': database
     }
 
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
     cur = conn.cursor()
 
@@ -2144,7 +2538,7 @@ def insert_into_table_scriptActivity(json_data,host,port,user,password,database)
     }
     ct = datetime.datetime.now()
     # Connect to PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
     cur = conn.cursor()
 
@@ -2172,6 +2566,348 @@ def insert_into_table_scriptActivity(json_data,host,port,user,password,database)
     cur.close()
     conn.close()
 
+def check_create_table_run_metrics(host,port,user,password,database):
+    db_params = {
+        'host': host,
+        'port': port,
+        'user': user,
+        'password': password,
+        'database': database
+    }
+
+    conn = get_connection(db_params)
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    # One row per report stage of a CLI run, scriptactivity keeps the one row per run summary
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS run_metrics (
+            run_id TEXT,
+            stage TEXT,
+            reports TEXT,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            wall_seconds DOUBLE PRECISION,
+            api_requests INTEGER,
+            api_bytes BIGINT,
+            api_throttled INTEGER,
+            api_retries INTEGER,
+            api_errors INTEGER,
+            rows_inserted BIGINT,
+            rows_updated BIGINT,
+            rows_deleted BIGINT,
+            peak_rss_mb DOUBLE PRECISION,
+            status TEXT,
+            error TEXT,
+            PRIMARY KEY (run_id, stage, started_at)
+        );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS run_metrics_started_at_idx ON run_metrics (started_at);")
+    print("The table 'run_metrics' is ready!")
+    cur.close()
+    conn.close()
+
+def insert_into_table_run_metrics(run_id,reports,records,host,port,user,password,database):
+    db_params = {
+        'host': host,
+        'port': port,
+        'user': user,
+        'password': password,
+        'database': database
+    }
+    ct = datetime.datetime.now()
+    if not records:
+        return
+    conn = get_connection(db_params)
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    columns = ('stage', 'started_at', 'finished_at', 'wall_seconds') + runmetrics.COUNTERS + ('peak_rss_mb', 'status', 'error')
+    try:
+        psycopg2.extras.execute_values(cur, sql.SQL("""
+            INSERT INTO run_metrics (run_id, reports, {}) VALUES %s
+            ON CONFLICT (run_id, stage, started_at) DO NOTHING
+        """).format(sql.SQL(', ').join(map(sql.Identifier, columns))),
+            [(run_id, reports) + tuple(record[column] for column in columns) for record in records])
+        print(str(ct) + f"Records inserted into the table 'run_metrics' successfully:  {len(records)}")
+    except psycopg2.Error as e:
+        print(str(ct) + "An error occurred while inserting data into the table 'run_metrics':", e)
+
+    cur.close()
+    conn.close()
+
+def check_create_table_mitigation_time(host, port, user, password, database):
+    db_params = {
+        'host': host,
+        'port': port,
+        'user': user,
+        'password': password,
+        'database': database
+    }
+    conn = get_connection(db_params)
+    conn.autocommit = True
+    cur = conn.cursor()
+    # One row per MitigatedVulnerability event, keyed by its incident create_at_nano
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS mitigation_time (
+            mitigation_nano NUMERIC PRIMARY KEY,
+            endpoint_id INTEGER,
+            endpoint_hash TEXT,
+            asset TEXT,
+            cve TEXT,
+            cvss TEXT,
+            threat_level_id INTEGER,
+            detected_at_milli NUMERIC,
+            mitigated_at_milli NUMERIC,
+            mitigation_time_hours DOUBLE PRECISION
+        );
+        CREATE INDEX IF NOT EXISTS mitigation_time_endpoint_cve_idx ON mitigation_time (endpoint_id, cve);
+        CREATE INDEX IF NOT EXISTS mitigation_time_mitigated_idx ON mitigation_time (mitigated_at_milli);
+        CREATE INDEX IF NOT EXISTS incident_detected_asof_idx ON incident (endpoint_id, cve, created_at_milli)
+            WHERE event_type = 'DetectedVulnerability';
+    """)
+    print("The table 'mitigation_time' was created or already exists")
+    cur.close()
+    conn.close()
+
+def update_mitigation_time(host, port, user, password, database, full=False):
+    """Pair new MitigatedVulnerability incidents with their nearest preceding detection.
+
+    Only mitigations newer than the last stored one are read unless full is set,
+    which rebuilds the table from the whole incident table. Returns the rows added.
+    """
+    db_params = {
+        'host': host,
+        'port': port,
+        'user': user,
+        'password': password,
+        'database': database
+    }
+    ct = datetime.datetime.now()
+    conn = get_connection(db_params)
+    try:
+        with conn:
+            cur = conn.cursor()
+            if full:
+                cur.execute("TRUNCATE mitigation_time;")
+            cur.execute("SELECT COALESCE(max(mitigation_nano), 0) FROM mitigation_time;")
+            since = cur.fetchone()[0]
+            # As-of join: the latest detection of the same endpoint and CVE at or before the mitigation
+            cur.execute("""
+                INSERT INTO mitigation_time (mitigation_nano, endpoint_id, endpoint_hash, asset, cve, cvss, threat_level_id,
+                                             detected_at_milli, mitigated_at_milli, mitigation_time_hours)
+                SELECT m.create_at_nano, m.endpoint_id, m.endpoint_hash, m.asset, m.cve, m.cvss, m.threat_level_id,
+                       d.created_at_milli, m.created_at_milli, (m.created_at_milli - d.created_at_milli) / 1000.0 / 60 / 60
+                FROM incident m
+                CROSS JOIN LATERAL (
+                    SELECT i.created_at_milli FROM incident i
+                    WHERE i.event_type = 'DetectedVulnerability' AND i.endpoint_id = m.endpoint_id AND i.cve = m.cve
+                        AND i.created_at_milli <= m.created_at_milli
+                    ORDER BY i.created_at_milli DESC
+                    LIMIT 1
+                ) d
+                WHERE m.event_type = 'MitigatedVulnerability' AND m.create_at_nano > %s
+                ON CONFLICT (mitigation_nano) DO NOTHING;
+            """, (since,))
+            added = cur.rowcount
+            cur.close()
+        print(str(ct) + f" Records inserted into the table 'mitigation_time' successfully:  {added}")
+        return added
+    except psycopg2.Error as e:
+        print(str(ct) + " An error occurred while updating the table 'mitigation_time':", e)
+        return 0
+    finally:
+        conn.close()
+
+def check_create_table_sync_watermark(host, port, user, password, database):
+    db_params = {
+        'host': host,
+        'port': port,
+        'user': user,
+        'password': password,
+        'database': database
+    }
+
+    conn = get_connection(db_params)
+    conn.autocommit = True
+    cur = conn.cursor()
+    # High water mark of each incremental stream (tasks, incidents, xProtectEvents) per dashboard,
+    # in the API nanosecond timestamps of the rows already stored
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS sync_watermark (
+            tenant TEXT NOT NULL,
+            stream TEXT NOT NULL,
+            watermark BIGINT NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT now(),
+            PRIMARY KEY (tenant, stream)
+        );
+    """)
+    cur.close()
+    conn.close()
+
+def get_watermark(tenant, stream, host, port, user, password, database):
+    """Return the stored watermark of a stream, or None when the stream was never synced.
+
+    Only where a sync starts, every page write checks it again under the row lock (claim_watermark).
+    """
+    db_params = {
+        'host': host,
+        'port': port,
+        'user': user,
+        'password': password,
+        'database': database
+    }
+    conn = get_connection(db_params)
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT watermark FROM sync_watermark WHERE tenant = %s AND stream = %s;", (tenant, stream))
+        row = cur.fetchone()
+        return row[0] if row else None
+    finally:
+        cur.close()
+        conn.close()
+
+def claim_watermark(cur, watermark):
+    """Lock the watermark row of a page write inside the caller's transaction.
+
+    Returns False when the stored watermark already covers the page, an overlapping
+    run stored it while this one was fetching, and the page must not be inserted again.
+    """
+    tenant, stream, value = watermark
+    cur.execute("SELECT watermark FROM sync_watermark WHERE tenant = %s AND stream = %s FOR UPDATE;", (tenant, stream))
+    row = cur.fetchone()
+    return row is None or row[0] < int(value)
+
+def advance_watermark(cur, watermark):
+    """Move a (tenant, stream, value) watermark forward inside the caller's transaction.
+
+    The upsert locks the row until the caller commits, and GREATEST keeps two
+    overlapping runs from moving it back.
+    """
+    tenant, stream, value = watermark
+    cur.execute("""
+        INSERT INTO sync_watermark (tenant, stream, watermark, updated_at) VALUES (%s, %s, %s, now())
+        ON CONFLICT (tenant, stream)
+        DO UPDATE SET watermark = GREATEST(sync_watermark.watermark, EXCLUDED.watermark), updated_at = EXCLUDED.updated_at;
+    """, (tenant, stream, int(value)))
+
+def set_watermark(tenant, stream, value, host, port, user, password, database):
+    """Overwrite a watermark, used to bootstrap a stream and by --updatestate."""
+    db_params = {
+        'host': host,
+        'port': port,
+        'user': user,
+        'password': password,
+        'database': database
+    }
+    conn = get_connection(db_params)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO sync_watermark (tenant, stream, watermark, updated_at) VALUES (%s, %s, %s, now())
+        ON CONFLICT (tenant, stream) DO UPDATE SET watermark = EXCLUDED.watermark, updated_at = EXCLUDED.updated_at;
+    """, (tenant, stream, int(value)))
+    cur.close()
+    conn.close()
+
+def check_create_table_sync_checkpoint(host, port, user, password, database):
+    db_params = {
+        'host': host,
+        'port': port,
+        'user': user,
+        'password': password,
+        'database': database
+    }
+
+    conn = get_connection(db_params)
+    conn.autocommit = True
+    cur = conn.cursor()
+    # One row per endpoint of a long per endpoint sync (activevulnerabilities, assetspatchs).
+    # page_offset is the next page to pull, done marks endpoints that are fully synced.
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS sync_checkpoint (
+            report TEXT NOT NULL,
+            endpoint_hash TEXT NOT NULL,
+            page_offset INTEGER NOT NULL DEFAULT 0,
+            done BOOLEAN NOT NULL DEFAULT FALSE,
+            updated_at TIMESTAMP NOT NULL DEFAULT now(),
+            PRIMARY KEY (report, endpoint_hash)
+        );
+    """)
+    cur.close()
+    conn.close()
+
+def load_sync_checkpoint(report, max_age_hours, host, port, user, password, database):
+    """Return {endpoint_hash: (page_offset, done)} of the unfinished run of a report.
+
+    Checkpoints older than max_age_hours belong to a run that is too old to resume
+    and are dropped, so the report starts over.
+    """
+    db_params = {
+        'host': host,
+        'port': port,
+        'user': user,
+        'password': password,
+        'database': database
+    }
+    ct = datetime.datetime.now()
+    conn = get_connection(db_params)
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT max(updated_at) < now() - make_interval(hours => %s) FROM sync_checkpoint WHERE report = %s;",
+                    (max_age_hours, report))
+        stale = cur.fetchone()[0]
+        if stale:
+            print(str(ct) + f" Checkpoint of {report} is older than {max_age_hours} hours, starting over")
+            cur.execute("DELETE FROM sync_checkpoint WHERE report = %s;", (report,))
+            return {}
+        cur.execute("SELECT endpoint_hash, page_offset, done FROM sync_checkpoint WHERE report = %s;", (report,))
+        return {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+    finally:
+        cur.close()
+        conn.close()
+
+def save_sync_checkpoint(report, endpoint_hash, page_offset, done, host, port, user, password, database):
+    db_params = {
+        'host': host,
+        'port': port,
+        'user': user,
+        'password': password,
+        'database': database
+    }
+    conn = get_connection(db_params)
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            INSERT INTO sync_checkpoint (report, endpoint_hash, page_offset, done, updated_at)
+            VALUES (%s, %s, %s, %s, now())
+            ON CONFLICT (report, endpoint_hash)
+            DO UPDATE SET page_offset = EXCLUDED.page_offset, done = EXCLUDED.done, updated_at = EXCLUDED.updated_at;
+        """, (report, endpoint_hash, int(page_offset), done))
+    except psycopg2.Error as e:
+        print(f"An error occurred while saving the checkpoint of {report} for {endpoint_hash}:", e)
+    finally:
+        cur.close()
+        conn.close()
+
+def clear_sync_checkpoint(report, host, port, user, password, database):
+    db_params = {
+        'host': host,
+        'port': port,
+        'user': user,
+        'password': password,
+        'database': database
+    }
+    conn = get_connection(db_params)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("DELETE FROM sync_checkpoint WHERE report = %s;", (report,))
+    cur.close()
+    conn.close()
+
 def print_first_row(host, port, user, password, database):
     # Parâmetros de conexão
     db_params = {
@@ -2183,7 +2919,7 @@ def print_first_row(host, port, user, password, database):
     }
 
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -2213,7 +2949,7 @@ def display_all_entries(host, port, user, password, database,table):
     }
 
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -2250,8 +2986,7 @@ def load_table_to_df(host, port, user, password, database, table):
         'password': password,
         'database': database
     }
-    enpassword = urllib.parse.quote_plus(password)
-    engine = sa.create_engine(f"postgresql://{user}:{enpassword}@{host}:{port}/{database}")
+    engine = get_engine(host, port, user, password, database)
     # Create connection string
     # Load table into DataFrame
     try:
@@ -2271,7 +3006,7 @@ def check_create_table_Events(host, port, user, password, database):
         'database': database  # Nome do banco de dados onde The table "incidente" deve ser verificada/criada
     }
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -2324,7 +3059,7 @@ def insert_into_table_events(json_data, host, port, user, password, database):
     }
     ct = datetime.datetime.now()
     # Connect to PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Create cursor
@@ -2362,9 +3097,8 @@ def load_Event_to_df(host, port, user, password, database, minDate):
         'password': password,
         'database': database
     }
-    enpassword = urllib.parse.quote_plus(password)
     # Create connection string
-    engine = sa.create_engine(f"postgresql://{user}:{enpassword}@{host}:{port}/{database}")
+    engine = get_engine(host, port, user, password, database)
     # Load table into DataFrame
     try:
         sql = (f"select {column} from {table} where {table}.{column} > {minDate} Order BY {column} DESC LIMIT 1")
@@ -2386,7 +3120,7 @@ def check_create_table_xProtectEvents(host, port, user, password, database):
         'database': database  # Nome do banco de dados onde The table "incidente" deve ser verificada/criada
     }
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -2431,7 +3165,14 @@ def check_create_table_xProtectEvents(host, port, user, password, database):
     cur.close()
     conn.close()
 
-def insert_into_table_xProtectEvents(json_data, host, port, user, password, database):
+XPROTECT_INSERT_SQL = """
+INSERT INTO xprotectevents (endpoint_id, asset, event_type, victim_process, src_parent_process, src_process, src_user, status, created_at_milli, updated_at_milli, create_at_nano, h_created_at, h_updated_at)
+VALUES %s
+"""
+XPROTECT_INSERT_TEMPLATE = """(%(assetId)s, %(asset)s, %(eventType)s, %(victimprocess)s, %(srcparentprocessName)s, 
+%(srcprocessName)s,%(srcuser)s,%(status)s,%(created_at_milli)s, %(updated_at_milli)s, %(create_at_nano)s, %(created_at)s, %(updated_at)s)"""
+
+def insert_into_table_xProtectEvents(json_data, host, port, user, password, database, watermark=None):
     # Connection parameters
     db_params = {
         'host': host,
@@ -2442,33 +3183,36 @@ def insert_into_table_xProtectEvents(json_data, host, port, user, password, data
     }
     ct = datetime.datetime.now()
     # Connect to PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Create cursor
     cur = conn.cursor()
 
+    # The page and its watermark are committed together, a bad row only rolls back its own savepoint
+    conn.autocommit = False
     # Insert data into the "incident" table
     try:
-        sql = """
-        INSERT INTO xprotectevents (endpoint_id, asset, event_type, victim_process, src_parent_process, src_process, src_user, status, created_at_milli, updated_at_milli, create_at_nano, h_created_at, h_updated_at) VALUES (%(assetId)s, %(asset)s, %(eventType)s, %(victimprocess)s, %(srcparentprocessName)s, 
-        %(srcprocessName)s,%(srcuser)s,%(status)s,%(created_at_milli)s, %(updated_at_milli)s, %(create_at_nano)s, %(created_at)s, %(updated_at)s)
-        """
-
-        for record in json_data:
-            #print(record)
-            cur.execute(sql, record)
+        if watermark and not claim_watermark(cur, watermark):
+            print(str(ct) + " - 'xprotectevents' page already stored by another run, skipping it")
+            json_data = []
+        insert_page_rows(cur, 'xprotectevents', XPROTECT_INSERT_SQL, XPROTECT_INSERT_TEMPLATE, json_data, ct)
+        if watermark:
+            advance_watermark(cur, watermark)
+        conn.commit()
+        stored = True
 
         print(str(ct) + "The data was inserted to the table 'xprotectevents' quite successfully!")
 
     except psycopg2.Error as e:
+        conn.rollback()
+        stored = False
         print(str(ct) + "An error occurred while inserting data into the table 'xprotectevents':()", e)
-        # Printing the last executed query can help in debugging
-        print(cur.mogrify(sql, record))
 
     # Close connection
     cur.close()
     conn.close()
+    return stored
 
 def load_xProtectEvents_to_df(host, port, user, password, database, minDate):
     table = "xprotectevents"
@@ -2480,9 +3224,8 @@ def load_xProtectEvents_to_df(host, port, user, password, database, minDate):
         'password': password,
         'database': database
     }
-    enpassword = urllib.parse.quote_plus(password)
     # Create connection string
-    engine = sa.create_engine(f"postgresql://{user}:{enpassword}@{host}:{port}/{database}")
+    engine = get_engine(host, port, user, password, database)
     # Load table into DataFrame
     try:
         sql = (f"select {column} from {table} where {table}.{column} > {minDate} Order BY {column} DESC LIMIT 1")
@@ -2494,6 +3237,42 @@ def load_xProtectEvents_to_df(host, port, user, password, database, minDate):
         print(f"Error loading table {table} into DataFrame: {e}")
         return None
 
+def list_relations(db_params):
+    """Names of the tables and views in the public schema."""
+    conn = get_connection(db_params)
+    try:
+        with conn:
+            cur = conn.cursor()
+            cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public';")
+            names = {row[0] for row in cur.fetchall()}
+            cur.close()
+    finally:
+        conn.close()
+    return names
+
+def export_relation_csv_gz(db_params, relation, path, compresslevel=6):
+    """Stream a table or view to a gzip csv with a header, rows go from COPY straight to the file.
+
+    The file is written next to path and renamed when complete, readers never see a partial export.
+    Returns the number of rows exported.
+    """
+    query = sql.SQL("COPY (SELECT * FROM {}) TO STDOUT WITH (FORMAT csv, HEADER true)").format(sql.Identifier(relation))
+    tmp_path = path + '.tmp'
+    conn = get_connection(db_params)
+    try:
+        with conn:
+            cur = conn.cursor()
+            with gzip.open(tmp_path, 'wb', compresslevel=compresslevel) as out:
+                cur.copy_expert(query, out)
+            rows = cur.rowcount
+            cur.close()
+        os.replace(tmp_path, path)
+    finally:
+        conn.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return rows
+
 def drop_all_tables(host, port, user, password, database):
     db_params = {
         'host': host,
@@ -2503,13 +3282,13 @@ def drop_all_tables(host, port, user, password, database):
         'database': database  # Nome do banco de dados onde The table "incidente" deve ser verificada/criada
     } 
 
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
     cur = conn.cursor()
     views = ["endpoint_groups_view","incident_view", "mitigation_time_view", "mitigation_performance_view", "incidents_group_view","mitigation_detection_active"]
     for view in views:
         drop_view(cur, view)
-    tables = ['incident','activevulnerabilities','tasks','assetspatchs','apps','endpoints','endpointgroups','xprotectevents','events']
+    tables = ['incident','activevulnerabilities','tasks','assetspatchs','apps','endpoints','endpointgroups','xprotectevents','events','sync_watermark','sync_checkpoint','asset_identity','mitigation_time']
     for table in tables:
         drop_table(cur, table)
     
@@ -2527,7 +3306,7 @@ def get_cve_count_by_endpoint_hash(host, port, user, password, database, specifi
     }
 
     # Connect to PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Create cursor
@@ -2571,6 +3350,51 @@ def get_cve_count_by_endpoint_hash(host, port, user, password, database, specifi
         cur.close()
         conn.close()
 
+# Tables a landing zone rebuild can reload: insert statement, row template and the columns it may add
+LANDED_TABLES = {
+    'incident': (INCIDENT_INSERT_SQL, INCIDENT_INSERT_TEMPLATE, INCIDENT_NEW_COLUMNS),
+    'xprotectevents': (XPROTECT_INSERT_SQL, XPROTECT_INSERT_TEMPLATE, []),
+    'tasks': (TASKS_INSERT_SQL, TASKS_INSERT_TEMPLATE, TASKS_NEW_COLUMNS),
+}
+
+def replace_landed_rows(table, column, pages, host, port, user, password, database):
+    """Replace the rows of landed pages in table, all in one transaction.
+
+    pages yields (low, high, records): the rows with low <= column <= high, the span of one
+    landed page, are deleted and the records of the page inserted in their place. Rows outside
+    every page span are kept. A bad record is skipped under its savepoint, any other error rolls
+    the whole rebuild back. Returns (deleted, inserted), None when rolled back.
+    """
+    db_params = {
+        'host': host,
+        'port': port,
+        'user': user,
+        'password': password,
+        'database': database
+    }
+    insert, template, new_columns = LANDED_TABLES[table]
+    delete = sql.SQL("DELETE FROM {} WHERE {} BETWEEN %s AND %s").format(sql.Identifier(table), sql.Identifier(column))
+    ct = datetime.datetime.now()
+    conn = get_connection(db_params)
+    conn.autocommit = False
+    cur = conn.cursor()
+    deleted = inserted = 0
+    try:
+        add_column_to_table(cur, table, new_columns)
+        for low, high, records in pages:
+            cur.execute(delete, (low, high))
+            deleted += cur.rowcount
+            inserted += insert_page_rows(cur, table, insert, template, records, ct)
+        conn.commit()
+        return deleted, inserted
+    except Exception as e:
+        conn.rollback()
+        print(str(ct) + f" Rebuild of '{table}' rolled back: {e}")
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
 def delete_activevulnerabilities_by_endpoint_hash(host, port, user, password, database, endpoint_hash):
     # Connection parameters
     db_params = {
@@ -2582,7 +3406,7 @@ def delete_activevulnerabilities_by_endpoint_hash(host, port, user, password, da
     }
 
     # Connect to PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Create cursor
@@ -2632,7 +3456,7 @@ def get_patch_count_by_endpoint_hash(host, port, user, password, database, speci
     }
 
     # Connect to PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Create cursor
@@ -2687,7 +3511,7 @@ def delete_assetpatchs_by_endpoint_hash(host, port, user, password, database, en
     }
 
     # Connect to PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Create cursor
@@ -2735,7 +3559,7 @@ def check_create_table_groups(host,port,user,password,database):
         'database': database
     }
 
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
     cur = conn.cursor()
 
@@ -2757,6 +3581,7 @@ def check_create_table_groups(host,port,user,password,database):
         print("The table 'groups' was created successfully!")
     else:
         print("The table 'groups' already exists!")
+    add_column_to_table(cur, 'groups', ['groupupdatedat BIGINT'])
     cur.close()
     conn.close()
 
@@ -2772,7 +3597,7 @@ def insert_into_table_groups(json_data,host,port,user,password,database):
     }
     ct = datetime.datetime.now()
     # Connect to PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
     cur = conn.cursor()
 
@@ -2811,7 +3636,7 @@ def check_create_table_endpointgroups(host, port, user, password, database):
     }
 
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -2830,6 +3655,8 @@ def check_create_table_endpointgroups(host, port, user, password, database):
     #,
     #      PRIMARY KEY (groupname, hostname, endpoint_id, endpoint_hash)
     cur.execute(create_table_query)
+    # Membership diffs look rows up by group and endpoint
+    cur.execute("CREATE INDEX IF NOT EXISTS endpointgroups_group_endpoint_idx ON endpointgroups (groupid, endpoint_id);")
     print("The table 'endpointgroups' was created or already exists")
 
     # Fechar conexão
@@ -2847,7 +3674,7 @@ def insert_into_table_endpointgroups(json_data, host, port, user, password, data
     }
     ct = datetime.datetime.now()
     # Connect to PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
     cur = conn.cursor()
 
@@ -2875,6 +3702,96 @@ def insert_into_table_endpointgroups(json_data, host, port, user, password, data
     cur.close()
     conn.close()
 
+def load_groups_updatedat(host, port, user, password, database):
+    """Return {groupid: groupupdatedat} for the groups stored by the last crawl."""
+    db_params = {
+        'host': host,
+        'port': port,
+        'user': user,
+        'password': password,
+        'database': database
+    }
+    conn = get_connection(db_params)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("SELECT groupid, groupupdatedat FROM groups;")
+    updated = {groupid: updatedat for groupid, updatedat in cur.fetchall()}
+    cur.close()
+    conn.close()
+    return updated
+
+def sync_groups(groups_json, members_by_group, host, port, user, password, database):
+    """Apply one groups crawl to 'groups' and 'endpointgroups' in a single transaction.
+
+    groups_json lists every group currently in the API, members_by_group maps the
+    groupId of each re-crawled group to its full member list. Groups missing from
+    members_by_group keep their rows, re-crawled groups only get their added and
+    removed memberships. Returns (added, removed) or None when nothing was written.
+    """
+    db_params = {
+        'host': host,
+        'port': port,
+        'user': user,
+        'password': password,
+        'database': database
+    }
+    ct = datetime.datetime.now()
+    group_ids = [group['groupId'] for group in groups_json]
+    changed = [group for group in groups_json if group['groupId'] in members_by_group]
+    changed_ids = [group['groupId'] for group in changed]
+    members = [member for groupId in changed_ids for member in members_by_group[groupId]]
+
+    conn = get_connection(db_params)
+    try:
+        with conn:
+            cur = conn.cursor()
+            # Groups deleted in the dashboard
+            cur.execute("DELETE FROM endpointgroups WHERE NOT (groupid = ANY(%s));", (group_ids,))
+            cur.execute("DELETE FROM groups WHERE NOT (groupid = ANY(%s));", (group_ids,))
+
+            cur.execute("DELETE FROM groups WHERE groupid = ANY(%s);", (changed_ids,))
+            psycopg2.extras.execute_values(cur, """
+                INSERT INTO groups (groupid, groupname, groupteamname, groupteamid, groupassetcount, groupupdatedat) VALUES %s
+            """, changed,
+                template="(%(groupId)s, %(groupName)s, %(groupTeamName)s, %(groupTeamId)s, %(groupAssetCount)s, %(groupUpdatedAt)s)")
+            psycopg2.extras.execute_values(cur, """
+                UPDATE endpointgroups SET groupname = renamed.groupname
+                FROM (VALUES %s) AS renamed (groupid, groupname)
+                WHERE endpointgroups.groupid = renamed.groupid AND endpointgroups.groupname IS DISTINCT FROM renamed.groupname
+            """, [(group['groupId'], group['groupName']) for group in changed])
+
+            cur.execute("""
+                CREATE TEMP TABLE endpointgroups_crawl (
+                    groupid INT, groupname TEXT, endpointname TEXT, endpoint_id BIGINT, endpoint_hash TEXT
+                ) ON COMMIT DROP;
+            """)
+            psycopg2.extras.execute_values(cur, """
+                INSERT INTO endpointgroups_crawl (groupid, groupname, endpointname, endpoint_id, endpoint_hash) VALUES %s
+            """, members,
+                template="(%(groupId)s, %(groupName)s, %(endpointName)s, %(endpointId)s, %(endpointHash)s)",
+                page_size=1000)
+            cur.execute("""
+                DELETE FROM endpointgroups e
+                WHERE e.groupid = ANY(%s)
+                  AND NOT EXISTS (SELECT 1 FROM endpointgroups_crawl c WHERE c.groupid = e.groupid AND c.endpoint_id = e.endpoint_id);
+            """, (changed_ids,))
+            removed = cur.rowcount
+            cur.execute("""
+                INSERT INTO endpointgroups (groupid, groupname, endpointname, endpoint_id, endpoint_hash)
+                SELECT DISTINCT ON (c.groupid, c.endpoint_id) c.groupid, c.groupname, c.endpointname, c.endpoint_id, c.endpoint_hash
+                FROM endpointgroups_crawl c
+                WHERE NOT EXISTS (SELECT 1 FROM endpointgroups e WHERE e.groupid = c.groupid AND e.endpoint_id = c.endpoint_id);
+            """)
+            added = cur.rowcount
+            cur.close()
+        print(str(ct) + f" Groups synced: {len(changed)} changed, {added} memberships added, {removed} removed")
+        return added, removed
+    except psycopg2.Error as e:
+        print(str(ct) + " An error occurred while syncing the tables 'groups' and 'endpointgroups':", e)
+        return None
+    finally:
+        conn.close()
+
 def clean_table_endpointgroups(host, port, user, password, database):
     # Parâmetros de conexão
     db_params = {
@@ -2886,7 +3803,7 @@ def clean_table_endpointgroups(host, port, user, password, database):
     }
 
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -2927,7 +3844,7 @@ def clean_table_groups(host, port, user, password, database):
     }
 
     # Conectar ao PostgreSQL
-    conn = psycopg2.connect(**db_params)
+    conn = get_connection(db_params)
     conn.autocommit = True
 
     # Criar cursor
@@ -2967,13 +3884,7 @@ def check_create_table_tenable_assets(host, port, user, password, database):
     Almacena información de activos/endpoints desde Tenable.io
     """
     try:
-        conn = psycopg2.connect(
-            host=host,
-            port=port,
-            user=user,
-            password=password,
-            database=database
-        )
+        conn = get_connection({'host': host, 'port': port, 'user': user, 'password': password, 'database': database})
         cur = conn.cursor()
         
         # Crear tabla si no existe
@@ -2987,7 +3898,8 @@ def check_create_table_tenable_assets(host, port, user, password, database):
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
-        
+        ALTER TABLE tenable_assets ADD COLUMN IF NOT EXISTS fqdn VARCHAR(255);
+
         -- Crear índices para mejorar el rendimiento
         CREATE INDEX IF NOT EXISTS idx_tenable_assets_hostname 
             ON tenable_assets(hostname);
@@ -3017,13 +3929,7 @@ def check_create_table_tenable_vulnerabilities(host, port, user, password, datab
     Almacena vulnerabilidades detectadas por Tenable.io
     """
     try:
-        conn = psycopg2.connect(
-            host=host,
-            port=port,
-            user=user,
-            password=password,
-            database=database
-        )
+        conn = get_connection({'host': host, 'port': port, 'user': user, 'password': password, 'database': database})
         cur = conn.cursor()
         
         # Crear tabla si no existe
@@ -3085,24 +3991,19 @@ def insert_into_table_tenable_assets(assets_data, host, port, user, password, da
         return
     
     try:
-        conn = psycopg2.connect(
-            host=host,
-            port=port,
-            user=user,
-            password=password,
-            database=database
-        )
+        conn = get_connection({'host': host, 'port': port, 'user': user, 'password': password, 'database': database})
         cur = conn.cursor()
         
         # Query con UPSERT para actualizar si ya existe
         insert_query = """
-        INSERT INTO tenable_assets 
-            (asset_uuid, hostname, ip_address, operating_system, last_seen, updated_at)
-        VALUES 
-            (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-        ON CONFLICT (asset_uuid) 
+        INSERT INTO tenable_assets
+            (asset_uuid, hostname, fqdn, ip_address, operating_system, last_seen, updated_at)
+        VALUES
+            (%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (asset_uuid)
         DO UPDATE SET
             hostname = EXCLUDED.hostname,
+            fqdn = EXCLUDED.fqdn,
             ip_address = EXCLUDED.ip_address,
             operating_system = EXCLUDED.operating_system,
             last_seen = EXCLUDED.last_seen,
@@ -3115,6 +4016,7 @@ def insert_into_table_tenable_assets(assets_data, host, port, user, password, da
                 cur.execute(insert_query, (
                     asset.get('asset_uuid'),
                     asset.get('hostname'),
+                    asset.get('fqdn'),
                     asset.get('ip_address'),
                     asset.get('operating_system'),
                     asset.get('last_seen')
@@ -3148,13 +4050,7 @@ def insert_into_table_tenable_vulnerabilities(vulns_data, host, port, user, pass
         return
     
     try:
-        conn = psycopg2.connect(
-            host=host,
-            port=port,
-            user=user,
-            password=password,
-            database=database
-        )
+        conn = get_connection({'host': host, 'port': port, 'user': user, 'password': password, 'database': database})
         cur = conn.cursor()
         
         # Query con UPSERT
@@ -3207,60 +4103,199 @@ def insert_into_table_tenable_vulnerabilities(vulns_data, host, port, user, pass
         raise
 
 
+def check_create_table_asset_identity(host, port, user, password, database):
+    """
+    Crea la tabla asset_identity, el cruce entre endpoints de Vicarius y activos de Tenable.
+    Una fila por activo de cada fuente, los activos que son el mismo equipo comparten unified_asset_id.
+    """
+    try:
+        conn = get_connection({'host': host, 'port': port, 'user': user, 'password': password, 'database': database})
+        cur = conn.cursor()
+
+        create_table_query = r"""
+        -- Misma regla que normalize_hostname() de etl_orchestrator.py: nombre corto en mayúsculas, las IPs se dejan enteras
+        CREATE OR REPLACE FUNCTION normalize_hostname(name TEXT) RETURNS TEXT AS $$
+            SELECT CASE
+                WHEN trim(name) ~ '^\d{1,3}(\.\d{1,3}){3}$' THEN trim(name)
+                ELSE NULLIF(upper(split_part(trim(name), '.', 1)), '')
+            END
+        $$ LANGUAGE SQL IMMUTABLE;
+
+        CREATE TABLE IF NOT EXISTS asset_identity (
+            source TEXT NOT NULL,             -- 'Vicarius' o 'Tenable'
+            source_id TEXT NOT NULL,          -- endpoint_id o asset_uuid
+            hostname TEXT,
+            fqdn TEXT,
+            ipv4 TEXT,
+            identity_key TEXT,                -- normalize_hostname(hostname)
+            unified_asset_id TEXT,
+            match_rule TEXT,                  -- self, fqdn, hostname, ipv4, unmatched
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (source, source_id)
+        );
+
+        -- Índices para el cruce de Tenable contra Vicarius y para las vistas
+        CREATE INDEX IF NOT EXISTS idx_asset_identity_vicarius_key
+            ON asset_identity(identity_key) WHERE source = 'Vicarius';
+        CREATE INDEX IF NOT EXISTS idx_asset_identity_vicarius_fqdn
+            ON asset_identity(fqdn) WHERE source = 'Vicarius';
+        CREATE INDEX IF NOT EXISTS idx_asset_identity_vicarius_ipv4
+            ON asset_identity(ipv4) WHERE source = 'Vicarius';
+        CREATE INDEX IF NOT EXISTS idx_asset_identity_unified
+            ON asset_identity(unified_asset_id);
+        """
+
+        cur.execute(create_table_query)
+        conn.commit()
+
+        print("✅ Tabla 'asset_identity' verificada/creada exitosamente")
+
+        cur.close()
+        conn.close()
+
+    except Exception as e:
+        print(f"❌ Error al crear tabla asset_identity: {e}")
+        if conn:
+            conn.rollback()
+            conn.close()
+        raise
+
+
+def refresh_asset_identity(host, port, user, password, database):
+    """
+    Actualiza asset_identity con los cambios de endpoints y tenable_assets.
+    Solo se escriben las filas cuyo nombre, FQDN o IP cambió, y los activos de Tenable
+    se cruzan con Vicarius por FQDN, luego nombre normalizado y luego IPv4.
+    """
+    check_create_table_asset_identity(host, port, user, password, database)
+    conn = get_connection({'host': host, 'port': port, 'user': user, 'password': password, 'database': database})
+    try:
+        with conn:
+            cur = conn.cursor()
+            cur.execute("SELECT to_regclass('endpoints') IS NOT NULL, to_regclass('tenable_assets') IS NOT NULL;")
+            has_endpoints, has_tenable = cur.fetchone()
+            sources = ["SELECT NULL::text AS source, NULL::text AS source_id, NULL::text AS hostname, NULL::text AS fqdn, NULL::text AS ipv4 WHERE false"]
+            if has_endpoints:
+                sources.append("""
+                    SELECT DISTINCT ON (endpoint_id) 'Vicarius', endpoint_id::text, endpoint_name,
+                        CASE WHEN position('.' in trim(endpoint_name)) > 0 THEN lower(trim(endpoint_name)) END, NULL
+                    FROM endpoints WHERE endpoint_id IS NOT NULL
+                """)
+            if has_tenable:
+                sources.append("""
+                    SELECT 'Tenable', asset_uuid, hostname, lower(trim(fqdn)), NULLIF(trim(ip_address), '')
+                    FROM tenable_assets
+                """)
+            cur.execute("CREATE TEMP TABLE asset_identity_source ON COMMIT DROP AS " + " UNION ALL ".join(sources) + ";")
+
+            cur.execute("""
+                INSERT INTO asset_identity (source, source_id, hostname, fqdn, ipv4, identity_key, updated_at)
+                SELECT source, source_id, hostname, fqdn, ipv4, normalize_hostname(hostname), CURRENT_TIMESTAMP
+                FROM asset_identity_source
+                ON CONFLICT (source, source_id) DO UPDATE SET
+                    hostname = EXCLUDED.hostname,
+                    fqdn = EXCLUDED.fqdn,
+                    ipv4 = EXCLUDED.ipv4,
+                    identity_key = EXCLUDED.identity_key,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE (asset_identity.hostname, asset_identity.fqdn, asset_identity.ipv4)
+                    IS DISTINCT FROM (EXCLUDED.hostname, EXCLUDED.fqdn, EXCLUDED.ipv4);
+            """)
+            changed = cur.rowcount
+            cur.execute("""
+                DELETE FROM asset_identity a
+                WHERE NOT EXISTS (SELECT 1 FROM asset_identity_source s WHERE s.source = a.source AND s.source_id = a.source_id);
+            """)
+            removed = cur.rowcount
+
+            # Los endpoints de Vicarius son la identidad de referencia
+            cur.execute("""
+                UPDATE asset_identity
+                SET unified_asset_id = COALESCE(identity_key, 'UNKNOWN'), match_rule = 'self', updated_at = CURRENT_TIMESTAMP
+                WHERE source = 'Vicarius'
+                    AND (unified_asset_id, match_rule) IS DISTINCT FROM (COALESCE(identity_key, 'UNKNOWN'), 'self');
+            """)
+            cur.execute("""
+                WITH resolved AS (
+                    SELECT t.source_id, m.unified_asset_id, m.match_rule
+                    FROM asset_identity t
+                    CROSS JOIN LATERAL (
+                        SELECT unified_asset_id, match_rule FROM (
+                            SELECT v.unified_asset_id, 'fqdn' AS match_rule, 1 AS rank
+                            FROM asset_identity v WHERE v.source = 'Vicarius' AND v.fqdn = t.fqdn
+                            UNION ALL
+                            SELECT v.unified_asset_id, 'hostname', 2
+                            FROM asset_identity v WHERE v.source = 'Vicarius' AND v.identity_key = t.identity_key
+                            UNION ALL
+                            SELECT v.unified_asset_id, 'ipv4', 3
+                            FROM asset_identity v WHERE v.source = 'Vicarius' AND v.ipv4 = t.ipv4
+                            UNION ALL
+                            SELECT COALESCE(t.identity_key, t.ipv4, 'UNKNOWN'), 'unmatched', 4
+                        ) candidates
+                        ORDER BY rank, unified_asset_id
+                        LIMIT 1
+                    ) m
+                    WHERE t.source = 'Tenable'
+                )
+                UPDATE asset_identity a
+                SET unified_asset_id = r.unified_asset_id, match_rule = r.match_rule, updated_at = CURRENT_TIMESTAMP
+                FROM resolved r
+                WHERE a.source = 'Tenable' AND a.source_id = r.source_id
+                    AND (a.unified_asset_id, a.match_rule) IS DISTINCT FROM (r.unified_asset_id, r.match_rule);
+            """)
+            rematched = cur.rowcount
+            cur.close()
+        print(f"✅ asset_identity actualizada: {changed} activos cambiados, {removed} eliminados, {rematched} cruces de Tenable actualizados")
+    except Exception as e:
+        print(f"❌ Error al actualizar asset_identity: {e}")
+        raise
+    finally:
+        conn.close()
+
+
 def create_view_unified_assets(host, port, user, password, database):
     """
     Crea o reemplaza la vista unified_assets_view que combina activos
     de Vicarius y Tenable en una sola vista.
     """
+    refresh_asset_identity(host, port, user, password, database)
     try:
-        conn = psycopg2.connect(
-            host=host,
-            port=port,
-            user=user,
-            password=password,
-            database=database
-        )
+        conn = get_connection({'host': host, 'port': port, 'user': user, 'password': password, 'database': database})
         cur = conn.cursor()
         
-        # Crear o reemplazar la vista
+        # Crear o reemplazar la vista, la clave de unión sale de asset_identity
         create_view_query = """
         CREATE OR REPLACE VIEW unified_assets_view AS
-        SELECT 
-            COALESCE(
-                LOWER(TRIM(endpoint_name)), 
-                LOWER(TRIM(endpoint_hash)), 
-                'unknown'
-            ) AS unified_asset_id,
+        SELECT
+            i.unified_asset_id,
             'Vicarius' AS source,
-            endpoint_hash AS source_id,
-            endpoint_name AS hostname,
+            e.endpoint_hash AS source_id,
+            e.endpoint_name AS hostname,
             NULL AS ip_address,
-            operating_system_name AS operating_system,
+            e.operating_system_name AS operating_system,
             NULL AS last_seen,
             CURRENT_TIMESTAMP AS created_at,
             CURRENT_TIMESTAMP AS updated_at
-        FROM endpoints
+        FROM endpoints e
+        LEFT JOIN asset_identity i ON i.source = 'Vicarius' AND i.source_id = e.endpoint_id::text
+
 
-        
         UNION ALL
-        
-        SELECT 
-            COALESCE(
-                LOWER(TRIM(hostname)), 
-                LOWER(TRIM(ip_address)), 
-                'unknown'
-            ) AS unified_asset_id,
+
+        SELECT
+            i.unified_asset_id,
             'Tenable' AS source,
-            asset_uuid AS source_id,
-            hostname,
-            ip_address,
-            operating_system,
-            last_seen,
-            created_at,
-            updated_at
-        FROM tenable_assets;
+            t.asset_uuid AS source_id,
+            t.hostname,
+            t.ip_address,
+            t.operating_system,
+            t.last_seen,
+            t.created_at,
+            t.updated_at
+        FROM tenable_assets t
+        LEFT JOIN asset_identity i ON i.source = 'Tenable' AND i.source_id = t.asset_uuid;
         """
-        
+
         cur.execute(create_view_query)
         conn.commit()
         
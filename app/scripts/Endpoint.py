@@ -1,5 +1,6 @@
 #Author: Joaldir Rani
 import requests
+import httpclient
 import json
 from datetime import datetime
 import time
@@ -18,7 +19,7 @@ def getCountEndpoints(apikey,urldashboard):
     }
 
     try:
-        response = requests.get(urldashboard + '/vicarius-external-data-api/endpoint/search', params=params, headers=headers)
+        response = httpclient.get(urldashboard + '/vicarius-external-data-api/endpoint/search', params=params, headers=headers)
         jsonresponse = json.loads(response.text)
         responsecount = jsonresponse['serverResponseCount']
         firstID = jsonresponse['serverResponseObject'][0]['endpointId']
@@ -43,17 +44,22 @@ def getEndpoints(apikey,urldashboard,fr0m,siz3,lastEID):
     }
     print("gettingEndpoints -> Endpoints.py")
     try:
-        response = requests.get(urldashboard + '/vicarius-external-data-api/endpoint/search', params=params, headers=headers)
+        response = httpclient.get(urldashboard + '/vicarius-external-data-api/endpoint/search', params=params, headers=headers)
         parsed = json.loads(response.text)    
         if response.status_code == 429:
             print("API Rate Limit exceeded ... Waiting and Trying again")
             time.sleep(60)
-            getEndpoints(apikey,urldashboard,fr0m,siz3)
+            return getEndpoints(apikey,urldashboard,fr0m,siz3,lastEID)
         
     except:
+        # Let the crawler decide, a silently empty page would end the crawl early
         print("something is wrong, will try again....")
+        raise
     print("Status Code: " + str(response.status_code))
     #print(parsed)
+    return parseEndpoints(parsed)
+
+def parseEndpoints(parsed):
     strEndpoints = ""
     strEPStatus = ""
     jsonEndpoints = []
@@ -128,7 +134,7 @@ def getEndpoitsExternalAttributesCount(apikey,urldashboard):
     }
 
     try:
-        response = requests.get(urldashboard + '/vicarius-external-data-api/endpointAttributes/search', params=params, headers=headers)
+        response = httpclient.get(urldashboard + '/vicarius-external-data-api/endpointAttributes/search', params=params, headers=headers, cache='endpoint_attributes')
         if response.status_code == 429:
             print("API Rate Limit exceeded ... Waiting and Trying again")
             time.sleep(60)
@@ -154,7 +160,7 @@ def getEndpoitsExternalAttributes(apikey,urldashboard,fr0m,siz3):
     }
 
     try:
-        response = requests.get(urldashboard + '/vicarius-external-data-api/endpointAttributes/search', params=params, headers=headers)
+        response = httpclient.get(urldashboard + '/vicarius-external-data-api/endpointAttributes/search', params=params, headers=headers, cache='endpoint_attributes')
         if response.status_code == 429:
             print("API Rate Limit exceeded ... Waiting and Trying again")
             time.sleep(60)
@@ -205,7 +211,7 @@ def getEndpointScoresExploitabilityRiskFactors(apikey,urldashboard,fr0m,siz3):
     }
 
     try:
-        response = requests.get(urldashboard + '/vicarius-external-data-api/endpoint/search', params=params, headers=headers)
+        response = httpclient.get(urldashboard + '/vicarius-external-data-api/endpoint/search', params=params, headers=headers, cache='endpoint_scores')
         if response.status_code == 429:
             print("API Rate Limit exceeded ... Waiting and Trying again")
             time.sleep(60)
@@ -248,7 +254,7 @@ def getEndpointScoresImpactRiskFactors(apikey,urldashboard,fr0m,siz3):
     }
 
     try:
-        response = requests.get(urldashboard + '/vicarius-external-data-api/endpoint/search', params=params, headers=headers)
+        response = httpclient.get(urldashboard + '/vicarius-external-data-api/endpoint/search', params=params, headers=headers, cache='endpoint_scores')
         if response.status_code == 429:
             print("API Rate Limit exceeded ... Waiting and Trying again")
             time.sleep(60)
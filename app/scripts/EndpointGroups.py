@@ -1,6 +1,7 @@
 #Author: Joaldir Rani
 
 import requests
+import httpclient
 import json
 import time
 
@@ -31,41 +32,36 @@ def getAssetsbyGroupID(apikey,urldashboard,groupName,groupId,fr0m,siz3,trycount=
     ])
 
     try: 
-        response = requests.get(
+        response = httpclient.get(
             urldashboard + '/vicarius-external-data-api/endpoint/search',
             params=params,
             headers=headers,
             data=payload,
+            cache='group_members',
         )
         while response.status_code == 429 and trycount < 2:
-            ("API Rate Limit exceeded ... Waiting and Trying again")
+            print("API Rate Limit exceeded ... Waiting and Trying again")
             
             time.sleep(60)
-            response = requests.get(
+            response = httpclient.get(
                 urldashboard + '/vicarius-external-data-api/endpoint/search',
                 params=params,
                 headers=headers,
                 data=payload,
+                cache='group_members',
             )
             trycount += 1
-            jresponse = json.loads(response.text)
-            src = jresponse['serverResponseCount']
-            
-        if trycount >= 2:
-            print("API Rate Limit exceeded .")
-            src = 0 
-        else: 
-            jresponse = json.loads(response.text)
-            src = jresponse['serverResponseCount']
 
+        response.raise_for_status()
         #(f'params:{params}, body:{payload}, url:{urldashboard}/vicarius-external-data-api/endpoint/search')
         jresponse = json.loads(response.text)
-        #responsecount = jresponse['serverResponseCount']
+        src = jresponse['serverResponseCount']
         #print(json.dumps(jresponse,indent=2))
 
     except:
         print('Something is wrong to obtain assets in group')
-        src = 0 
+        # None tells the crawler the group could not be read, an empty group is 0
+        return None,[]
 
     return src,[{'groupId': groupId, 'groupName': groupName,'endpointName': i['endpointName'], 'endpointId': i['endpointId'], 'endpointHash': i['endpointHash']}
             for i in jresponse.get('serverResponseObject', [])]
@@ -84,20 +80,22 @@ def getEndpointGroupsID(apikey, urldashboard, fr0m, siz3, trycount=0):
     }
 
     try:
-        response = requests.get(
+        response = httpclient.get(
             urldashboard + '/vicarius-external-data-api/organizationEndpointGroup/search', 
             params=params, 
-            headers=headers
+            headers=headers,
+            cache='groups',
         )
         #print(response.text)
         while response.status_code == 429 and trycount < 2:
             ("API Rate Limit exceeded ... Waiting and Trying again")
             
             time.sleep(60)
-            response = requests.get(
+            response = httpclient.get(
                 urldashboard + '/vicarius-external-data-api/organizationEndpointGroup/search', 
                 params=params, 
-                headers=headers
+                headers=headers,
+                cache='groups',
             )
             trycount += 1
             jresponse = json.loads(response.text)
@@ -118,5 +116,5 @@ def getEndpointGroupsID(apikey, urldashboard, fr0m, siz3, trycount=0):
         src = 0 
         return []
 
-    return src,[{'groupName': i['organizationEndpointGroupName'], 'groupID': i['organizationEndpointGroupId'], 'groupTeam': i['organizationEndpointGroupOrganizationTeam']['organizationTeamName'], 'groupTeamId': i['organizationEndpointGroupOrganizationTeam']['organizationTeamId']}
+    return src,[{'groupName': i['organizationEndpointGroupName'], 'groupID': i['organizationEndpointGroupId'], 'groupTeam': i['organizationEndpointGroupOrganizationTeam']['organizationTeamName'], 'groupTeamId': i['organizationEndpointGroupOrganizationTeam']['organizationTeamId'], 'groupUpdatedAt': i.get('organizationEndpointGroupUpdatedAt')}
             for i in jresponse.get('serverResponseObject', [])]
@@ -1,5 +1,6 @@
 #Author: Joaldir Rani
 import requests
+import httpclient
 import json
 
 def getCountEndpointPublisherProductVersions(apikey,urldashboard):
@@ -12,7 +13,7 @@ def getCountEndpointPublisherProductVersions(apikey,urldashboard):
         'from': 0,
         'size': 1,
     }
-    response = requests.get(urldashboard + '/vicarius-external-data-api/organizationEndpointPublisherProductVersions/search', params=params, headers=headers)
+    response = httpclient.get(urldashboard + '/vicarius-external-data-api/organizationEndpointPublisherProductVersions/search', params=params, headers=headers)
     try:
         jsonresponse = json.loads(response.text)
         responsecount = jsonresponse['serverResponseCount']
@@ -34,7 +35,7 @@ def getEndpointPublisherProductVersions(apikey,urldashboard,fr0m,siz3):
     }
     
     try:
-        response = requests.get(urldashboard + '/vicarius-external-data-api/organizationEndpointPublisherProductVersions/search', params=params, headers=headers)
+        response = httpclient.get(urldashboard + '/vicarius-external-data-api/organizationEndpointPublisherProductVersions/search', params=params, headers=headers)
         parsed = json.loads(response.text)
 
     except:
@@ -1,6 +1,7 @@
 #Author: Joaldir Rani
 
 import requests
+import httpclient
 import json
 import time
 import datetime
@@ -46,7 +47,7 @@ def getCountEvents(apikey,urldashboard,lastdate):
         'size': 1,
         'q' : 'organizationEndpointVulnerabilitiesEndpoint.endpointCreatedAt>' + str(lastdate)
     }
-    response = requests.get(urldashboard + '/vicarius-external-data-api/organizationEndpointVulnerabilities/search', params=params, headers=headers)
+    response = httpclient.get(urldashboard + '/vicarius-external-data-api/organizationEndpointVulnerabilities/search', params=params, headers=headers)
 
     jsonresponse = json.loads(response.text)
         
@@ -72,7 +73,7 @@ def getCountEventsPerAsset(apikey,urldashboard,endpointHash,trycount=0):
     }
     if (trycount < 2):
         try:
-            response = requests.get(urldashboard + '/vicarius-external-data-api/organizationEndpointVulnerabilities/search', params=params, headers=headers)
+            response = httpclient.get(urldashboard + '/vicarius-external-data-api/organizationEndpointVulnerabilities/search', params=params, headers=headers)
             if response.status_code == 429:
                 print("API Rate Limit exceeded ... Waiting and Trying again")
                 errors.append("API Rate Limit")
@@ -117,7 +118,7 @@ def getEndpointVulnerabilities(apikey,urldashboard,fr0m,siz3,minDate,maxDate,end
     #jresponse = []
     try:
         time.sleep(0.5)
-        response = requests.get(urldashboard + '/vicarius-external-data-api/organizationEndpointVulnerabilities/search', params=params, headers=headers)
+        response = httpclient.get(urldashboard + '/vicarius-external-data-api/organizationEndpointVulnerabilities/search', params=params, headers=headers)
         if response.status_code == 429:
             print("API Rate Limit exceeded ... Waiting and Trying again")
             time.sleep(60)
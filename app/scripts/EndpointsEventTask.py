@@ -1,7 +1,9 @@
 #Author: Joaldir Rani
 
 import requests
+import httpclient
 import json
+import landing
 import utils
 import time
 from datetime import datetime
@@ -19,7 +21,7 @@ def getCountEvents(apikey,urldashboard,lastdate):
         'q':'analyticsEventCreatedAt>' + str(lastdate),
     }
 
-    response = requests.get(urldashboard + '/vicarius-external-data-api/taskEndpointsEvent/count', params=params, headers=headers)
+    response = httpclient.get(urldashboard + '/vicarius-external-data-api/taskEndpointsEvent/count', params=params, headers=headers)
     jsonresponse = json.loads(response.text)
     responsecount = jsonresponse['serverResponseCount']
 
@@ -50,20 +52,25 @@ def getTasksEndopintsEvents(apikey,urldashboard,fr0m,siz3,maxdate,mindate):
         #'includeFields': 'taskEndpointsEventOrganizationEndpointPatchPatchPackages;taskEndpointsEventEndpoint.endpointName;taskEndpointsEventTask;analyticsEventCreatedAt;analyticsEventUpdatedAt',
         'from': fr0m,
         'size': siz3,
-        'sort' : '-analyticsEventUpdatedAtNano',
+        'sort' : '+analyticsEventUpdatedAtNano',
         'q':'analyticsEventUpdatedAtNano>' + mindate + ';analyticsEventUpdatedAtNano<' + maxdate,
     }
     #print(params)    
-    response = requests.get(urldashboard + '/vicarius-external-data-api/taskEndpointsEvent/filter', params=params, headers=headers)
+    response = httpclient.get(urldashboard + '/vicarius-external-data-api/taskEndpointsEvent/filter', params=params, headers=headers)
     parsed = json.loads(response.text)
     #print(parsed)
-    #strTasks = ""
-    tasks_list = []
     if response.status_code == 429:
         print("API Rate Limit exceeded ... Waiting and Trying again")
         time.sleep(60)
         getTasksEndopintsEvents(apikey,urldashboard,fr0m,siz3,maxdate,mindate)
+    elif response.status_code == 200:
+        landing.write_page('tasks', parsed, {'minDate': mindate, 'maxDate': maxdate})
     #print (maxdate, mindate)
+    return parseTasksEndpointsEvents(parsed,maxdate)
+
+def parseTasksEndpointsEvents(parsed,maxdate):
+    #strTasks = ""
+    tasks_list = []
     #print (parsed)
     src = len(parsed['serverResponseObject'])
     #print("length of taskEndpointsEvents/filter Response")
@@ -274,7 +281,7 @@ def getTasksEndopintsEventsWaiting(apikey,urldashboard,fr0m,siz3,maxdate,mindate
     # 
     print(aID)
     print(params)   
-    response = requests.get(urldashboard + '/vicarius-external-data-api/taskEndpointsEvent/filter', params=params, headers=headers)
+    response = httpclient.get(urldashboard + '/vicarius-external-data-api/taskEndpointsEvent/filter', params=params, headers=headers)
     parsed = json.loads(response.text)
     print(response.status_code)
     #print(parsed)
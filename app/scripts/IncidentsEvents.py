@@ -1,4 +1,5 @@
 import requests
+import httpclient
 import json
 import utils
 import time
@@ -18,7 +19,7 @@ def getIncidentesEventsCount(apikey,urldashboard):
     }
 
     try:
-        response = requests.get(urldashboard + '/vicarius-external-data-api/incidentEvent/count', params=params, headers=headers)
+        response = httpclient.get(urldashboard + '/vicarius-external-data-api/incidentEvent/count', params=params, headers=headers)
         jsonresponse = json.loads(response.text)
         responsecount = jsonresponse['serverResponseCount']
 
@@ -40,7 +41,7 @@ def getIncidentEvents(apikey,urldashboard,fr0m,siz3):
     }
 
     try:
-        response = requests.get(urldashboard + '/vicarius-external-data-api/incidentEvent/filter', params=params, headers=headers)
+        response = httpclient.get(urldashboard + '/vicarius-external-data-api/incidentEvent/filter', params=params, headers=headers)
         parsed = json.loads(response.text)
 
     except:
@@ -89,7 +90,7 @@ def getIncidentesEventsCountbyType(apikey,urldashboard,incidenttype,minDate,maxD
     }
     
     try:
-        response = requests.get(urldashboard + '/vicarius-external-data-api/incidentEvent/count', params=params, headers=headers)
+        response = httpclient.get(urldashboard + '/vicarius-external-data-api/incidentEvent/count', params=params, headers=headers)
         jsonresponse = json.loads(response.text)
         responsecount = jsonresponse['serverResponseCount']
 
@@ -117,7 +118,7 @@ def getIncidentEventsbyType(apikey,urldashboard,fr0m,siz3,incidenttype,minDate,m
 
     while jresponse is None and attempts < 3:
         try:
-            response = requests.get(urldashboard + '/vicarius-external-data-api/incidentEvent/filter', params=params, headers=headers)
+            response = httpclient.get(urldashboard + '/vicarius-external-data-api/incidentEvent/filter', params=params, headers=headers)
             jresponse = json.loads(response.text)
         except Exception as e:
             print(f"Erro ao obter resposta: {e}. Tentando novamente em 5 segundos...")
@@ -295,7 +296,7 @@ def getEventsCountbyType(apikey,urldashboard,incidenttype,minDate,maxDate):
     }
     
     try:
-        response = requests.get(urldashboard + '/vicarius-external-data-api/incidentEvent/count', params=params, headers=headers)
+        response = httpclient.get(urldashboard + '/vicarius-external-data-api/incidentEvent/count', params=params, headers=headers)
         jsonresponse = json.loads(response.text)
         responsecount = jsonresponse['serverResponseCount']
 
@@ -323,7 +324,7 @@ def getEventsbyType(apikey,urldashboard,fr0m,siz3,incidenttype,minDate,maxDate):
 
     while jresponse is None and attempts < 3:
         try:
-            response = requests.get(urldashboard + '/vicarius-external-data-api/incidentEvent/filter', params=params, headers=headers)
+            response = httpclient.get(urldashboard + '/vicarius-external-data-api/incidentEvent/filter', params=params, headers=headers)
             jresponse = json.loads(response.text)
         except Exception as e:
             print(f"Erro ao obter resposta: {e}. Tentando novamente em 5 segundos...")
@@ -470,7 +471,7 @@ def getxProtectEventsCountbyType(apikey,urldashboard,incidenttype,minDate,maxDat
     }
     
     try:
-        response = requests.get(urldashboard + '/vicarius-external-data-api/incidentEvent/count', params=params, headers=headers)
+        response = httpclient.get(urldashboard + '/vicarius-external-data-api/incidentEvent/count', params=params, headers=headers)
         jsonresponse = json.loads(response.text)
         responsecount = jsonresponse['serverResponseCount']
 
@@ -490,7 +491,7 @@ def getxProtectEventsbyType(apikey,urldashboard,fr0m,siz3,incidenttype,minDate,m
         'size': siz3,
         'group': 'incidentEventIncidentEventType&metricActionName=IncidentEvent',
         'q': 'analyticsEventCreatedAtNano>'+minDate+';analyticsEventCreatedAtNano<'+maxDate+';incidentEventIncidentEventType=in=('+incidenttype+')',
-        'sort': '-analyticsEventCreatedAtNano',
+        'sort': '+analyticsEventCreatedAtNano',
     }
     
     jresponse = None
@@ -498,7 +499,7 @@ def getxProtectEventsbyType(apikey,urldashboard,fr0m,siz3,incidenttype,minDate,m
 
     while jresponse is None and attempts < 3:
         try:
-            response = requests.get(urldashboard + '/vicarius-external-data-api/incidentEvent/filter', params=params, headers=headers)
+            response = httpclient.get(urldashboard + '/vicarius-external-data-api/incidentEvent/filter', params=params, headers=headers)
             jresponse = json.loads(response.text)
         except Exception as e:
             print(f"Erro ao obter resposta: {e}. Tentando novamente em 5 segundos...")
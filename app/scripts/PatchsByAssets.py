@@ -1,4 +1,5 @@
 import requests
+import httpclient
 import json
 from datetime import datetime
 import time
@@ -24,7 +25,7 @@ def getCountEndpointsPatchs(apikey,urldashboard,endpointHash,trycount=0):
     }
     if (trycount < 2):
         try:
-            response = requests.get(urldashboard + '/vicarius-external-data-api/aggregation/searchGroup?', params=params, headers=headers)
+            response = httpclient.get(urldashboard + '/vicarius-external-data-api/aggregation/searchGroup?', params=params, headers=headers)
             if response.status_code == 429:
                 print("API Rate Limit exceeded ... Waiting and Trying again")
                 errors.append("API Rate Limit")
@@ -72,7 +73,7 @@ def getCountEndpointsPatchsApps(apikey,urldashboard,endpointHash):
     }
 
     try:
-        response = requests.get(urldashboard + '/vicarius-external-data-api/aggregation/searchGroup?', params=params, headers=headers)
+        response = httpclient.get(urldashboard + '/vicarius-external-data-api/aggregation/searchGroup?', params=params, headers=headers)
         if response.status_code == 429:
             print("API Rate Limit exceeded ... Waiting and Trying again")
             time.sleep(60)
@@ -109,7 +110,7 @@ def getEndpointsPatchsold(apikey,urldashboard,fr0m,siz3,endpointName,endpointSO,
     }
 
     try:
-        response = requests.get(urldashboard + '/vicarius-external-data-api/aggregation/searchGroup?', params=params, headers=headers)
+        response = httpclient.get(urldashboard + '/vicarius-external-data-api/aggregation/searchGroup?', params=params, headers=headers)
         if response.status_code == 429:
             print("API Rate Limit exceeded ... Waiting and Trying again")
             time.sleep(60)
@@ -203,7 +204,7 @@ def getEndpointsPatchs(apikey, urldashboard, fr0m, siz3, min_date, max_date, end
     }
 
     try:
-        response = requests.get(urldashboard + '/vicarius-external-data-api/aggregation/searchGroup?', params=params, headers=headers)
+        response = httpclient.get(urldashboard + '/vicarius-external-data-api/aggregation/searchGroup?', params=params, headers=headers)
         if response.status_code == 429:
             print("API Rate Limit exceeded ... Waiting and Trying again")
             time.sleep(60)
@@ -1,13 +1,18 @@
 import requests
+import httpclient
 import json
+import os
 import time
 from datetime import datetime
 
+# TENABLE_API_URL points the client at another API, e.g. app/benchmarks/mock_tenable.py
+TENABLE_API_URL = os.environ.get('TENABLE_API_URL', "https://cloud.tenable.com")
+
 class TenableClient:
-    def __init__(self, api_key, secret_key):
+    def __init__(self, api_key, secret_key, base_url=None):
         self.api_key = api_key
         self.secret_key = secret_key
-        self.base_url = "https://cloud.tenable.com"
+        self.base_url = (base_url or TENABLE_API_URL).rstrip('/')
         self.headers = {
             "X-ApiKeys": f"accessKey={self.api_key};secretKey={self.secret_key}",
             "Content-Type": "application/json",
@@ -23,7 +28,7 @@ class TenableClient:
             "date_range": 30  # Last 30 days
         }
         try:
-            response = requests.get(url, headers=self.headers, params=params)
+            response = httpclient.get(url, headers=self.headers, params=params)
             response.raise_for_status()
             assets = response.json().get('assets', [])
             return self._parse_assets(assets)
@@ -43,6 +48,7 @@ class TenableClient:
             else:
                 hostname = "Unknown Host"
 
+            fqdn = (asset.get('fqdn') or [None])[0]
             ip_addr = asset.get('ipv4', [None])[0]
             os_name = asset.get('operating_system', [None])[0]
             
@@ -52,6 +58,7 @@ class TenableClient:
             parsed_assets.append({
                 "asset_uuid": asset.get('id'),
                 "hostname": hostname,
+                "fqdn": fqdn,
                 "ip_address": ip_addr,
                 "operating_system": os_name,
                 "last_seen": last_seen_str
@@ -74,7 +81,7 @@ class TenableClient:
             try:
                 # We need to be careful with rate limits here.
                 time.sleep(0.5) 
-                response = requests.get(url, headers=self.headers)
+                response = httpclient.get(url, headers=self.headers)
                 if response.status_code == 200:
                     vulns = response.json().get('vulnerabilities', [])
                     for v in vulns:
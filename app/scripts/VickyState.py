@@ -1,11 +1,23 @@
+import copy
+import fcntl
 import json
+import os
+
+STATE_PATH = '/usr/src/app/reports/state.json'
+# Serialises the read-merge-write of setState between report processes
+LOCK_PATH = STATE_PATH + '.lock'
+
+# Values of the caller's state as last read or written, setState only writes the keys changed since
+_seen = {}
 
 def getState():
     try:
-        with open('/usr/src/app/reports/state.json') as f:
+        with open(STATE_PATH) as f:
             data = f.read()  
         
         dictState = json.loads(data)    
+        _seen.clear()
+        _seen.update(copy.deepcopy(dictState))
         return dictState
 
     except:
@@ -13,8 +25,23 @@ def getState():
 
 
 def setState(dictState):
-
-    with open('/usr/src/app/reports/state.json', 'w') as convert_file:
-        convert_file.write(json.dumps(dictState, indent=2))
+    # Report jobs run at the same time, each one only writes the keys it changed so it
+    # does not put back the old values of keys another job updated in the meantime
+    with open(LOCK_PATH, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(STATE_PATH) as f:
+                current = json.loads(f.read())
+        except (IOError, ValueError):
+            current = {}
+        for key, value in dictState.items():
+            if key not in _seen or _seen[key] != value:
+                current[key] = value
+        tmppath = STATE_PATH + '.tmp'
+        with open(tmppath, 'w') as convert_file:
+            convert_file.write(json.dumps(current, indent=2))
+        os.replace(tmppath, STATE_PATH)
+        _seen.clear()
+        _seen.update(copy.deepcopy(dictState))
     
-    #print(dictState)
\ No newline at end of file
+    #print(dictState)
@@ -1,37 +1,52 @@
 #Author: Joaldir Rani
 #changed
 import argparse
-from tqdm import tqdm
 import time
-import pandas as pd
-import MitigationTime as mt
-import cleanData as cd
-import numpy as np
 import os 
 import shutil
 import gc
-from crontab import CronTab
 
 import json
 
 import VickyState as state
-import EndpointsEventTask as tasks
-import EndpointVulnerabilities as vuln
-import Endpoint as assets
-import PatchsByAssets as patchs
-import EndpointPublisherProductVersions as products
-import IncidentsEvents as incidents
-import EndpointGroups as groups
-import DatabaseConnector as db
-import updateExternalScore as updExSc
-import apprisk as apprisk
-from TenableClient import TenableClient
-import gc
+import landing
+import runmetrics
+from utils import LazyModule
+
+# Heavy and report specific modules are imported on first use, so --version,
+# argument errors and short incremental runs do not pay for pandas and every API module.
+pd = LazyModule('pandas')
+np = LazyModule('numpy')
+mt = LazyModule('MitigationTime')
+cd = LazyModule('cleanData')
+tasks = LazyModule('EndpointsEventTask')
+vuln = LazyModule('EndpointVulnerabilities')
+assets = LazyModule('Endpoint')
+patchs = LazyModule('PatchsByAssets')
+products = LazyModule('EndpointPublisherProductVersions')
+incidents = LazyModule('IncidentsEvents')
+groups = LazyModule('EndpointGroups')
+db = LazyModule('DatabaseConnector')
+updExSc = LazyModule('updateExternalScore')
+apprisk = LazyModule('apprisk')
+exporter = LazyModule('reportExport')
+profiling = LazyModule('profiling')
+httpclient = LazyModule('httpclient')
+LAZY_MODULES = [pd, np, mt, cd, tasks, vuln, assets, patchs, products, incidents, groups, db, updExSc, apprisk, exporter, profiling, httpclient]
 
 #from urllib.request import urlopen
 
 from datetime import datetime, timedelta
-from dateutil.relativedelta import relativedelta
+from concurrent.futures import ThreadPoolExecutor
+
+def tqdm(*args, **kwargs):
+    from tqdm import tqdm as progress_bar
+    return progress_bar(*args, **kwargs)
+
+def preload_modules():
+    """Import every lazily loaded module up front instead of on first use."""
+    for module in LAZY_MODULES:
+        module.load()
 
 errorList = [] 
 
@@ -61,6 +76,13 @@ def read_secret(secret_name):
 
 DEFAULT_QUERY_LIMIT_PER_MINUTE = 55
 
+# Groups whose members are fetched at the same time, all of them still draw from the shared API quota
+GROUP_CRAWL_WORKERS = int(os.environ.get('GROUP_CRAWL_WORKERS', 4))
+
+# Risk levels of the has_patch apps report, each level is paged by its own worker
+APP_RISK_LEVELS = ('Low', 'Medium', 'High')
+APPS_PAGE_SIZE = 500
+
 # Track the last time a query was made
 last_query_time = 0
 
@@ -83,22 +105,31 @@ def control_rateold(query_limit=None):
     # Update the last query time
     last_query_time = time.time()
 
-def control_rate(query_limit=50):
-    global last_query_time
+# One API quota ledger shared with every other report process, see ratelimit.py
+quota = None
 
-    # Calculate time since the last query and impose sleep if needed
-    elapsed_time = time.time() - last_query_time
-    if elapsed_time < (60 / query_limit):
-        time.sleep((60 / query_limit) - elapsed_time)
-
-    # Update the last query time
-    last_query_time = time.time()
+def control_rate(query_limit=50):
+    global quota
+    if quota is None:
+        import ratelimit
+        quota = ratelimit.QuotaLedger(db_params={'host': host, 'port': port, 'user': user, 'password': password, 'database': database} if user else None)
+    # A call site limited to query_limit calls per minute pays for its share of the overall quota,
+    # so it keeps its own pace when alone and slows down when other jobs are querying too
+    quota.acquire(quota.per_minute / max(1, query_limit))
+
+def cached_call(query_limit, function, *args):
+    # A call served from the response cache does not pay control_rate, see httpclient.quota
+    with httpclient.quota(lambda: control_rate(query_limit)):
+        return function(*args)
 
 parser = argparse.ArgumentParser(description='Args for VikyTopiaReport')
 parser.add_argument('-k', '--api-key', dest='apiKey', action='store', required=False, help='Topia API key')
 parser.add_argument('-d', '--dashboard', dest='dashboard', action='store', required=False, help='Url dashboard ex. https://xxxx.vicarius.cloud')
 parser.add_argument('--allreports', dest='allreports', action='store_true', help='All Reports')
 parser.add_argument('-a', '--assetsreport', dest='assetsreport', action='store_true', help='Assets Reports')
+parser.add_argument('--endpointsreport', dest='endpointsreport', action='store_true', help='Endpoints Report')
+parser.add_argument('--setup', dest='setup', action='store_true', help='Create the database and clear old report files, the first job of the report graph')
+parser.add_argument('--groupsreport', dest='groupsreport', action='store_true', help='Endpoint Groups Report')
 parser.add_argument('-t', '--taskreport', dest='tasksreport', action='store_true', help='Task Reports')
 parser.add_argument('-v', '--vulnerabilitiesreport', dest='vulnreport', action='store_true', help='Vulnerabilities Reports')
 parser.add_argument('-p', '--patchsreport', dest='patchsreport', action='store_true', help='Patchs Versions Reports')
@@ -122,53 +153,68 @@ parser.add_argument('--difTables', dest='difTables', action='store_true', help='
 parser.add_argument('--activeVulnsTable', dest='activeVulnsTable', action='store_true', help='activeVulnsTable')
 parser.add_argument('--tenableReport', dest='tenableReport', action='store_true', help='Tenable Reports')
 parser.add_argument('-tw', '--taskWaiting', dest='tasksWaitingreport', action='store_true', help='Task Waiting Reports')
-
-args = parser.parse_args()
-
-# Get the Credentials
-
-apikey = get_config('VICARIUS_API_KEY', 'api_key')
-organization_domain = get_config('VICARIUS_DASHBOARD_ID', 'dashboard_id')
-urldashboard = f"https://{organization_domain}.vicarius.cloud"
-
-# Tenable Credentials (Placeholder for future implementation)
-tenable_api_key = get_config('TENABLE_API_KEY')
-tenable_secret_key = get_config('TENABLE_SECRET_KEY')
-
-#Initialization Postgresql
+parser.add_argument('--resume', dest='resume', action='store_true', help='Resume the vulnerabilities and patchs reports from the checkpoint of an interrupted run')
+parser.add_argument('--epss-file', dest='epssFile', type=str, help='Load the EPSS scores from this .csv or .csv.gz file instead of downloading them', default=None)
+parser.add_argument('--export', dest='export', nargs='*', metavar='TABLE', default=None, help='Export tables or views to gzip csv, the main reporting tables when none is given')
+parser.add_argument('--export-dir', dest='exportDir', type=str, help='Directory for the --export files', default='/usr/src/app/reports/exports')
+parser.add_argument('--land', dest='land', action='store_true', help='Keep the raw API pages of the incidents, xProtect and tasks syncs in the landing zone')
+parser.add_argument('--rebuild-from-landing', dest='rebuildFromLanding', nargs='*', metavar='STREAM', default=None, help='Reload the tables of the landed streams from the landing zone, every stream when none is given')
+parser.add_argument('--landing-dir', dest='landingDir', type=str, help='Landing zone directory', default=None)
+parser.add_argument('--no-cache', dest='noCache', action='store_true', help='Fetch groups, app risk, endpoint attributes and scores from the API even when the response cache is fresh')
+parser.add_argument('--profile', dest='profile', nargs='?', const='full', choices=['full', 'sample'], default=None, help='Profile every report stage, full is cProfile and tracemalloc, sample is the low overhead stack sampler')
+parser.add_argument('--profile-dir', dest='profileDir', type=str, help='Directory for the --profile files', default='/var/log/vickytopia')
+
+# Credentials and settings, filled in by load_config() when a report runs
+apikey = None
+organization_domain = None
+urldashboard = None
+tenable_api_key = None
+tenable_secret_key = None
 host = "appdb"
 port = "5432"
-user = get_config('POSTGRES_USER', 'postgres_user')
-password = get_config('POSTGRES_PASSWORD', 'postgres_password')
-database = get_config('POSTGRES_DB', 'postgres_db')
-optionalTools = get_config('OPTIONAL_TOOLS', 'optional_tools', default="")
-
-substring = ","
-if substring in optionalTools:
-    tools = optionalTools.split(',')
-else:
-    tools = optionalTools
-print("####################################")
-print("####################################")
-print("####################################")
-print("Beginning a new Run")
-print("####################################")
-print("####################################")
-print("####################################")
-
-print (f"Dashboard URL is ", {urldashboard})
-
+user = None
+password = None
+database = None
+optionalTools = ""
+tools = ""
 
 statepath = "/usr/src/app/reports/state.json"
-if os.path.exists(statepath):
-    print("Reading state.json from reports")
-    dictState = state.getState()
-else:
-    print("copying state.json to reports ")
-    srcpath = "/usr/src/app/scripts/state.json"
-    shutil.copyfile(srcpath,statepath)
-    print("Reading state.json from reports")
-    dictState = state.getState()
+srcpath = "/usr/src/app/scripts/state.json"
+dictState = {}
+
+def load_config():
+    global apikey, organization_domain, urldashboard, tenable_api_key, tenable_secret_key
+    global user, password, database, optionalTools, tools
+    # Get the Credentials
+    apikey = get_config('VICARIUS_API_KEY', 'api_key')
+    organization_domain = get_config('VICARIUS_DASHBOARD_ID', 'dashboard_id')
+    # VICARIUS_API_URL points the reports at another API, e.g. app/benchmarks/mock_vicarius.py
+    urldashboard = get_config('VICARIUS_API_URL', default=f"https://{organization_domain}.vicarius.cloud")
+
+    # Tenable Credentials (Placeholder for future implementation)
+    tenable_api_key = get_config('TENABLE_API_KEY')
+    tenable_secret_key = get_config('TENABLE_SECRET_KEY')
+
+    #Initialization Postgresql
+    user = get_config('POSTGRES_USER', 'postgres_user')
+    password = get_config('POSTGRES_PASSWORD', 'postgres_password')
+    database = get_config('POSTGRES_DB', 'postgres_db')
+    optionalTools = get_config('OPTIONAL_TOOLS', 'optional_tools', default="")
+
+    substring = ","
+    if substring in optionalTools:
+        tools = optionalTools.split(',')
+    else:
+        tools = optionalTools
+
+def load_state():
+    if os.path.exists(statepath):
+        print("Reading state.json from reports")
+    else:
+        print("copying state.json to reports ")
+        shutil.copyfile(srcpath,statepath)
+        print("Reading state.json from reports")
+    return state.getState()
 
 #Version Check 
 ##get latest version 
@@ -176,7 +222,7 @@ else:
 #text = str(textpage.read(), 'utf-8')
 #Get the Stats and Reports Names
 
-def getAllEndpoitsTasks(fr0m,siz3,maxDate,minDate):
+def getAllEndpoitsTasks(fr0m,siz3,maxDate,minDate,stream=None):
     #print(minDate)
     #print(maxDate)
     if len(str(minDate)) == 19:
@@ -207,43 +253,32 @@ def getAllEndpoitsTasks(fr0m,siz3,maxDate,minDate):
     print("maxDate->" + hmaxdate)
 
     
-    control_rate (50)
-    if maxDate is None:
-        print("last date quireid")
-
-    else:
+    # Pages come oldest first, each stored page moves the stream watermark forward in the same transaction
+    while True:
+        control_rate (50)
         try:
             tasks_list,lastdate = tasks.getTasksEndopintsEvents(apikey,urldashboard,fr0m,siz3,maxDate,minDate)
         except Exception as e:
-            #print("lastdate= " + str(lastdate))
             print (f"An exception occurred: {e}")
-            print(tasks_list)
-            print(lastdate)
-            
-            tasks_list = ""
-            #maxDate = str(lastdate)
-            
-    try:
-        if tasks_list == 0:
-            print("No More Events")
+            return
 
-        elif len(tasks_list) > 0:
-            #writeReport(dictState['reportNameEventsTasks'],strTasks)
-            print("Inserting tasks into the DB: " + str(len(tasks_list)))
-            db.insert_into_table_tasks(tasks_list, host, port, user, password, database)
-            
-            maxDate = str(lastdate)
-            del tasks_list
-            #dictState.update({'lastEndpointsEventTask': lastdate})
-            
-            #state.setState(dictState)
+        if tasks_list == 0 or len(tasks_list) == 0:
+            print("No More Events")
+            return
 
-            getAllEndpoitsTasks(fr0m,siz3,maxDate,minDate)
-        else:
+        #writeReport(dictState['reportNameEventsTasks'],strTasks)
+        print("Inserting tasks into the DB: " + str(len(tasks_list)))
+        watermark = (organization_domain, stream, lastdate) if stream else None
+        if not db.insert_into_table_tasks(tasks_list, host, port, user, password, database, watermark):
+            print("Stopping the tasks sync, the next run continues from the last stored page")
+            return
+        del tasks_list
+        if str(lastdate) == str(minDate):
             print("No More Events")
-    except:
-        print("Cannot determine task_list value")
+            return
+        minDate = str(lastdate)
 
+@runmetrics.timed_stage
 def getWaitingEndpoitnTasks():
     two_weeks_ago = datetime.now() - timedelta(days=7)
     timenow = datetime.now()
@@ -253,57 +288,54 @@ def getWaitingEndpoitnTasks():
     timestamp_in_nanoseconds = int(timestamp_in_seconds * 1e9)
     timestamp_now_in_nanoseconds = int(timestamp_now_in_seconds * 1e9)
     print(f"between {two_weeks_ago} and {timenow} ")
-    waitingdf = db.load_tasks_waiting_to_df(two_weeks_ago, host, port, user, password, database)
+    # Read in keyset batches (iter_keyset), no connection is held during the API calls and no DataFrame is built
+    waiting = 0
     print("obtained Waiting Automations")
-    #print(waitingdf)
-    if len(waitingdf) > 0:
-
-        #print(waitingdf)
-        for index, row in waitingdf.iterrows():
-            lastdate = timestamp_in_nanoseconds
-            #print(row)
-            aID = row['automation_id']
-            print(f"querying automation: {aID}")
-            #dropwaiting tasks
-            #db.drop_tasks_waiting_to_df(two_weeks_ago, host, port, user, password, database, aID)
-            print("Dropped Waiting Automations")
-            query = 0 
-            src = 1 
-            fr0m = 0 
-            siz3 = 500
-            while src > 0: 
-                try:
-                    query += 1
-                    print(f"query: {query}")
-                    tasks_list, lastdate = tasks.getTasksEndopintsEventsWaiting(apikey,urldashboard,fr0m,siz3,str(timestamp_now_in_nanoseconds),str(lastdate),str(aID))
-                    print(lastdate)
-                except Exception as e:
-                    #print("lastdate= " + str(lastdate))
-                    print (f"An exception occurred: {e}")
-                    print(tasks_list)
-                    print(lastdate)
-                    src = 0 
-                    tasks_list = ""
-                    #maxDate = str(lastdate)
-                try:
-                    if tasks_list == 0:
-                        print("No More Events")
-                        src = 0 
-
-                    elif len(tasks_list) > 0:
-                        #writeReport(dictState['reportNameEventsTasks'],strTasks)
-                        print("Inserting tasks into the DB: " + str(len(tasks_list)))
-                        db.update_table_tasks(tasks_list, host, port, user, password, database)
-                        
-                        timestamp_in_nanoseconds = str(lastdate)
-                        del tasks_list
-                    else:
-                        print("No More Events")
-                        src = 0
-                except:
-                    print("Cannot determine task_list value")
+    for row in db.iter_tasks_waiting(two_weeks_ago, host, port, user, password, database):
+        lastdate = timestamp_in_nanoseconds
+        waiting += 1
+        aID = row.automation_id
+        print(f"querying automation: {aID}")
+        #dropwaiting tasks
+        #db.drop_tasks_waiting_to_df(two_weeks_ago, host, port, user, password, database, aID)
+        print("Dropped Waiting Automations")
+        query = 0 
+        src = 1 
+        fr0m = 0 
+        siz3 = 500
+        while src > 0: 
+            try:
+                query += 1
+                print(f"query: {query}")
+                tasks_list, lastdate = tasks.getTasksEndopintsEventsWaiting(apikey,urldashboard,fr0m,siz3,str(timestamp_now_in_nanoseconds),str(lastdate),str(aID))
+                print(lastdate)
+            except Exception as e:
+                #print("lastdate= " + str(lastdate))
+                print (f"An exception occurred: {e}")
+                print(tasks_list)
+                print(lastdate)
+                src = 0 
+                tasks_list = ""
+                #maxDate = str(lastdate)
+            try:
+                if tasks_list == 0:
+                    print("No More Events")
                     src = 0 
-    else: 
+
+                elif len(tasks_list) > 0:
+                    #writeReport(dictState['reportNameEventsTasks'],strTasks)
+                    print("Inserting tasks into the DB: " + str(len(tasks_list)))
+                    db.update_table_tasks(tasks_list, host, port, user, password, database)
+                    
+                    timestamp_in_nanoseconds = str(lastdate)
+                    del tasks_list
+                else:
+                    print("No More Events")
+                    src = 0
+            except:
+                print("Cannot determine task_list value")
+                src = 0 
+    if waiting == 0:
         print("No Tasks in Waiting")
 
 def getAllEndpoitsold(fr0m,siz3,count,pbar):
@@ -342,48 +374,55 @@ def getAllEndpoitsold(fr0m,siz3,count,pbar):
         pbar.close()
         print("Done!")
 
-def getAllEndpoits(fr0m,siz3,count,firstEID):
-    queryCount = 0 
-    all_assets = []
-    all_assets_status = []
-    lastEID = firstEID - 1
-    #print(str(firstEID))
-    #print(str(lastEID))
-
-    while queryCount < count:
+def fetchEndpointsPage(siz3,lastEID,retries=3):
+    for attempt in range(retries):
         control_rate(20)
         try:
-            
-            jsonEndpoints,jsonEPStatus = assets.getEndpoints(apikey,urldashboard,fr0m,siz3,lastEID)
-            #print(len(jsonEndpoints))
-            #print(jsonEndpoints)
-            queryCount += len(jsonEndpoints)
-
-            #all_assets.append(jsonEndpoints)
-            #all_assets_status.extend(jsonEPStatus)
-            #print("endpoints returned")
-            print("Adding Endpoints Table")
-            db.insert_into_table_endpoints(jsonEndpoints,host,port,user,password,database)
-            #writeReport(dictState['reportAssets'],strEndpoints)
-            print("Adding Endpoints Status Table")
-            db.insert_into_table_endpointsStatus(jsonEPStatus,host,port,user,password,database)
-            lastEID = db.load_endpoints_LEID(host,port,user,password,database)
-            print(lastEID)
+            return assets.getEndpoints(apikey,urldashboard,0,siz3,lastEID)
         except Exception as e:
-            strEndpoints = ""
             print (f"An exception occurred: {e}")
-        
-        print(f"queryCount: {queryCount} < count: {count}")
+            if attempt == retries - 1:
+                raise
+            time.sleep(10)
+
+def iterEndpointsPages(siz3,lastEID):
+    """Yield (endpoints, status) pages ordered by endpointId, starting after lastEID.
+
+    The cursor for the next page is the endpointId of the last record, and that
+    page is fetched in the background while the caller writes the current one.
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = executor.submit(fetchEndpointsPage,siz3,lastEID)
+        while True:
+            jsonEndpoints,jsonEPStatus = pending.result()
+            if len(jsonEndpoints) == 0:
+                return
+            lastEID = jsonEndpoints[-1]['endpointId']
+            pending = executor.submit(fetchEndpointsPage,siz3,lastEID) if len(jsonEndpoints) == siz3 else None
+            yield jsonEndpoints,jsonEPStatus
+            if pending is None:
+                return
+
+def getAllEndpoits(fr0m,siz3,count,firstEID):
+    queryCount = 0 
+    for jsonEndpoints,jsonEPStatus in iterEndpointsPages(siz3,firstEID - 1):
+        print("Adding Endpoints and Endpoints Status Tables")
+        if not db.insert_into_table_endpoints_page(jsonEndpoints,jsonEPStatus,host,port,user,password,database):
+            print("Stopping the endpoints sync at endpointId " + str(jsonEndpoints[0]['endpointId']))
+            break
+        queryCount += len(jsonEndpoints)
+        print(f"queryCount: {queryCount} of count: {count}")
+    return queryCount
     
 def getAllEndpointsGroup(fr0m,siz3,count,groupName,groupId,assetgroupSRO):
     all_group_assets = []
     all_group_assets.extend(assetgroupSRO)
     while fr0m < count:
-        control_rate (50)
-        disCount, assets_batch = groups.getAssetsbyGroupID(apikey,urldashboard,groupName,groupId,fr0m,siz3)
+        disCount, assets_batch = cached_call(50, groups.getAssetsbyGroupID, apikey, urldashboard, groupName, groupId, fr0m, siz3)
+        if disCount is None:
+            return None
         all_group_assets.extend(assets_batch)
         fr0m += siz3
-        time.sleep(0.25)  # Optional extra rate-limiting
     return all_group_assets
  
 def getAllGroupsSearchs(apikey, urldashboard, siz3, groupscount, initresponse): 
@@ -392,8 +431,7 @@ def getAllGroupsSearchs(apikey, urldashboard, siz3, groupscount, initresponse):
     all_groups.extend(initresponse)
 
     while fr0m < groupscount:
-        control_rate(50)
-        disCount, groups_batch = groups.getEndpointGroupsID(apikey, urldashboard, fr0m, siz3)
+        disCount, groups_batch = cached_call(50, groups.getEndpointGroupsID, apikey, urldashboard, fr0m, siz3)
         all_groups.extend(groups_batch)
         fr0m += siz3
         time.sleep(0.25)  # Optional extra rate-limiting
@@ -405,8 +443,7 @@ def getAllEndpoitsExternalAttributes(fr0m,siz3,count,pbar):
         #head = "id,asset,attribute,value\n"
         #writeReport(dictState['reportAssetsAttrributes'],head)
     
-    control_rate()
-    strEndpointsAttributes,epAttributeOBJ = assets.getEndpoitsExternalAttributes(apikey,urldashboard,fr0m,siz3)
+    strEndpointsAttributes,epAttributeOBJ = cached_call(50, assets.getEndpoitsExternalAttributes, apikey, urldashboard, fr0m, siz3)
     #writeReport(dictState['reportAssetsAttrributes'],strEndpointsAttributes)
     db.insert_into_table_endpointsAttribute(epAttributeOBJ, host, port, user, password, database)
     pbar.update(siz3)
@@ -473,7 +510,7 @@ def getAllEndpoitsScoresImpactRiskFactors(fr0m,siz3,count,pbar):
         pbar.close()
         print("Done!")
 
-def getAllIncidentEventVulnerabilities(fr0m,siz3,incidenttype,minDate,maxDate):
+def getAllIncidentEventVulnerabilities(fr0m,siz3,incidenttype,minDate,maxDate,stream=None):
     gc.collect ()
     print(minDate)
     print(maxDate)
@@ -491,27 +528,31 @@ def getAllIncidentEventVulnerabilities(fr0m,siz3,incidenttype,minDate,maxDate):
         print("jresponse is none, trying again...")
         time.sleep(60)
         del jresponse
-        getAllIncidentEventVulnerabilities(fr0m,siz3,incidenttype,minDate,maxDate)
+        getAllIncidentEventVulnerabilities(fr0m,siz3,incidenttype,minDate,maxDate,stream)
 
     elif len(jresponse['serverResponseObject']) > 0:
 
+        landing.write_page('incidents', jresponse, {'minDate': minDate, 'maxDate': maxDate, 'incidentType': incidenttype})
         strEventsVuln,minDate = incidents.parseIncidentEventsbyType(jresponse)
 
         minDate = str(minDate)
         
-        db.insert_into_table_incident(strEventsVuln, host, port, user, password, database)
+        # Events come oldest first, the page and the new watermark are stored together
+        watermark = (organization_domain, stream, minDate) if stream else None
+        if not db.insert_into_table_incident(strEventsVuln, host, port, user, password, database, watermark):
+            raise Exception("Incident page was not stored, stopping at minDate " + minDate)
 
         print("foi->" + str(len(jresponse['serverResponseObject'])))
         del strEventsVuln
         del jresponse
-        getAllIncidentEventVulnerabilities(fr0m,siz3,incidenttype,minDate,maxDate)
+        getAllIncidentEventVulnerabilities(fr0m,siz3,incidenttype,minDate,maxDate,stream)
         
     else:
         print("No event")
         del jresponse
     gc.collect()
     
-def getAllxProtectEvents(fr0m,siz3,incidenttype,minDate,maxDate,table):
+def getAllxProtectEvents(fr0m,siz3,incidenttype,minDate,maxDate,table,stream=None):
     print(minDate)
     print(maxDate)
     hmindate = datetime.fromtimestamp(int(minDate) / 1000000000).isoformat()
@@ -527,25 +568,32 @@ def getAllxProtectEvents(fr0m,siz3,incidenttype,minDate,maxDate,table):
     if jresponse is None:
         print("jresponse é None, tentando novamente em 10 segundos...")
         time.sleep(10)
-        getAllxProtectEvents(fr0m,siz3,incidenttype,minDate,maxDate,table)
+        getAllxProtectEvents(fr0m,siz3,incidenttype,minDate,maxDate,table,stream)
         
     elif len(jresponse['serverResponseObject']) > 0:
 
-        strEventsVuln,maxDate = incidents.parsexProtectEventsbyType(jresponse)
+        landing.write_page(table, jresponse, {'minDate': minDate, 'maxDate': maxDate, 'incidentType': incidenttype})
+        # Events come oldest first, the last one of the page is where the next page starts
+        strEventsVuln,minDate = incidents.parsexProtectEventsbyType(jresponse)
 
-        maxDate = str(maxDate)
+        minDate = str(minDate)
+        watermark = (organization_domain, stream, minDate) if stream else None
         if table == "incident":
-            db.insert_into_table_incident(strEventsVuln, host, port, user, password, database)
+            stored = db.insert_into_table_incident(strEventsVuln, host, port, user, password, database, watermark)
         elif table == "events":
-            db.insert_into_table_events(strEventsVuln, host, port, user, password, database)
+            stored = db.insert_into_table_events(strEventsVuln, host, port, user, password, database)
         elif table == "xProtectEvents":
-            db.insert_into_table_xProtectEvents(strEventsVuln, host, port, user, password, database)
+            stored = db.insert_into_table_xProtectEvents(strEventsVuln, host, port, user, password, database, watermark)
         else:
             print("Table not found: getAllxProtectEvents")
+            return
 
         print("foi->" + str(len(jresponse['serverResponseObject'])))
+        if stored is False:
+            print("Stopping the " + table + " sync, the next run continues from the last stored page")
+            return
 
-        getAllxProtectEvents(fr0m,siz3,incidenttype,minDate,maxDate,table)
+        getAllxProtectEvents(fr0m,siz3,incidenttype,minDate,maxDate,table,stream)
         
     else:
         print("No event")
@@ -573,56 +621,38 @@ def getAllEndpointsProductsVersions(fr0m,siz3,count,pbar):
         pbar.close()
         print("Done!")
 
-def getAppsPerRisk(fr0m,siz3):
+def fetchAppsByRisk(riskLevel, count):
+    """All has_patch apps of one risk level, paged by offset until a short page."""
+    apps = []
+    fr0m = 0
+    while fr0m < count:
+        page = cached_call(20, apprisk.getAppswithRiskandPatch, apikey, urldashboard, riskLevel, fr0m, APPS_PAGE_SIZE)
+        apps.extend(page)
+        print(f"{riskLevel} Risk Apps: {len(apps)}/{count}")
+        if len(page) < APPS_PAGE_SIZE:
+            break
+        fr0m += APPS_PAGE_SIZE
+    return apps
+
+def getAppsPerRisk():
     db.check_create_table_apps(host, port, user, password, database)
-    db.clean_table_apps(host, port, user, password, database)
-
-    lowRiskAppsCount,mediumRiskAppsCount,highRiskAppsCount = apprisk.getallApp(apikey,urldashboard)
-    lrac = lowRiskAppsCount
-    mrac = mediumRiskAppsCount
-    hrac = highRiskAppsCount
-    print(lowRiskAppsCount,mediumRiskAppsCount,highRiskAppsCount)
-    # Sort counts 
-    while lowRiskAppsCount > 500:
-        siz3 = 500
-        lowriskApps  = apprisk.getAppswithRisk(apikey,urldashboard,"Low",fr0m,siz3)
-        db.insert_into_table_apps(lowriskApps, host, port, user, password, database)
-        print("500 Low Risk Apps Inserted")
-        lowRiskAppsCount = lowRiskAppsCount - siz3
-    siz3 = lowRiskAppsCount
-    lowriskApps  = apprisk.getAppswithRisk(apikey,urldashboard,"Low",fr0m,siz3)
-    db.insert_into_table_apps(lowriskApps, host, port, user, password, database)
-    print(str(lowRiskAppsCount) + " Low Risk Apps Inserted")
-
-    while mediumRiskAppsCount > 500:
-        siz3 = 500
-        medriskApps  = apprisk.getAppswithRisk(apikey,urldashboard,"Medium",fr0m,siz3)
-        print("500 Medium Risk Apps Inserted")
-        db.insert_into_table_apps(medriskApps, host, port, user, password, database)
-        mediumRiskAppsCount = mediumRiskAppsCount - 500
-    siz3 = mediumRiskAppsCount
-    medriskApps  = apprisk.getAppswithRisk(apikey,urldashboard,"Medium",fr0m,siz3)
-    db.insert_into_table_apps(medriskApps, host, port, user, password, database)
-    print(str(mediumRiskAppsCount) + " Medium Risk Apps Inserted")
-
-    while highRiskAppsCount > 500:
-        siz3 = 500
-        highriskApps  = apprisk.getAppswithRisk(apikey,urldashboard,"High",fr0m,siz3)
-        db.insert_into_table_apps(highriskApps, host, port, user, password, database)
-        print("500 High Risk Apps Inserted")
-        highRiskAppsCount = highRiskAppsCount - 500
-    siz3 = highRiskAppsCount
-    highriskApps  = apprisk.getAppswithRisk(apikey,urldashboard,"High",fr0m,siz3)
-    db.insert_into_table_apps(highriskApps, host, port, user, password, database)
-    print(str(highRiskAppsCount) + " High Risk Apps Inserted")
 
-    totalAC = lrac + mrac + hrac
-    print (str(totalAC) + " Apps inserted")
+    counts = dict(zip(APP_RISK_LEVELS, apprisk.getallApp(apikey,urldashboard)))
+    print(counts)
+    apps = {}
+    with ThreadPoolExecutor(max_workers=len(APP_RISK_LEVELS)) as executor:
+        for riskApps in executor.map(lambda riskLevel: fetchAppsByRisk(riskLevel, counts[riskLevel]), APP_RISK_LEVELS):
+            for app in riskApps:
+                # An app whose score changes during the crawl can show up on two pages, keep it once
+                apps.setdefault(app['publisherHash'], app)
 
-    #db.insert_into_table_apps
+    if not db.replace_table_apps(list(apps.values()), host, port, user, password, database):
+        raise RuntimeError("The apps were not stored, the previous rows are kept")
+    print(str(len(apps)) + " Apps inserted")
 
+@runmetrics.timed_stage
 def ReportHasPatchApps():
-    getAppsPerRisk(0,10)
+    getAppsPerRisk()
 
 def writeReport(reportName,strText):
     try:
@@ -632,12 +662,15 @@ def writeReport(reportName,strText):
     except:
         print("Somthing wrong with file")
 
+@runmetrics.timed_stage
 def ReportTaskEvents(start_date=None, end_date=None):
     INITIAL_MIN_DATE = int(datetime(2022, 1, 1).timestamp() * 1e9)  # Set the initial min date to January 1, 2022
     ONE_MONTH_NANOSECONDS = int(timedelta(days=30).total_seconds() * 1e9)  # Define the duration of one month in nanoseconds
     dateNow = datetime.now()
     maxDate = str(int(dateNow.timestamp() * 1000000000))
     db.check_create_table_tasks(host, port, user, password, database)
+    db.check_create_table_sync_watermark(host, port, user, password, database)
+    stream = None
     
     time.sleep(3)
     if start_date and end_date:
@@ -649,23 +682,28 @@ def ReportTaskEvents(start_date=None, end_date=None):
             print(f"Invalid date format. Please use the format YYYY-MM-DD. Error: {e}")
             return
     else:
-        strMinDate = str(dictState['lastEndpointsEventTask']) 
-        df = db.load_task_to_df(host, port, user, password, database, maxDate)
-        #print(df)
-        if df is not None and not df.empty:
-            print("minDate set from DB")
-            minDate = df['updateatnano'].max()
-        elif strMinDate is not None:
-            print("minDate set from state.json")
-            minDate = strMinDate
+        stream = 'tasks'
+        minDate = db.get_watermark(organization_domain, stream, host, port, user, password, database)
+        if minDate is not None:
+            print("minDate set from watermark")
         else:
-            print("minDate set from INITIAL_MIN_DATE")
-            minDate = INITIAL_MIN_DATE
+            # First run against this table, seed the watermark from the stored rows or state.json
+            strMinDate = dictState.get('lastEndpointsEventTask')
+            df = db.load_task_to_df(host, port, user, password, database, maxDate)
+            #print(df)
+            if df is not None and not df.empty:
+                print("minDate set from DB")
+                minDate = df['updateatnano'].max()
+            elif strMinDate:
+                print("minDate set from state.json")
+                minDate = strMinDate
+            else:
+                print("minDate set from INITIAL_MIN_DATE")
+                minDate = INITIAL_MIN_DATE
+            db.set_watermark(organization_domain, stream, minDate, host, port, user, password, database)
         
         #print("maxDate: " + maxDate)
         #print("minDate: " + str(minDate))
-    dictState.update({'lastEndpointsEventTask': int(maxDate)})
-    state.setState(dictState)
 
     fr0m = 0
     siz3 = 500 #Changed by Jordan from 100 
@@ -675,7 +713,64 @@ def ReportTaskEvents(start_date=None, end_date=None):
     #maxDate = str(1678737605066)
     #minDate = str(1659312000000)
 
-    getAllEndpoitsTasks(fr0m,siz3,str(maxDate),str(minDate))
+    getAllEndpoitsTasks(fr0m,siz3,str(maxDate),str(minDate),stream)
+
+@runmetrics.timed_stage
+def ReportExport(relations=None, directory=None):
+    db_params = {'host': host, 'port': port, 'user': user, 'password': password, 'database': database}
+    results = exporter.export_reports(db_params, relations or None, directory or exporter.EXPORT_DIR)
+    failed = [name for name, rows in results.items() if isinstance(rows, str)]
+    if failed:
+        raise RuntimeError("Export failed for " + ",".join(failed))
+
+# Landed stream: (table, nanosecond column the API query filters on, field of the parsed records holding it,
+# check_create function, page parser)
+LANDING_STREAMS = {
+    'incidents': ('incident', 'create_at_nano', 'create_at_nano', 'check_create_table_incident',
+                  lambda page, context: incidents.parseIncidentEventsbyType(page)[0]),
+    'xProtectEvents': ('xprotectevents', 'create_at_nano', 'create_at_nano', 'check_create_table_xProtectEvents',
+                       lambda page, context: incidents.parsexProtectEventsbyType(page)[0]),
+    'tasks': ('tasks', 'updateatnano', 'updateAtNano', 'check_create_table_tasks',
+              lambda page, context: tasks.parseTasksEndpointsEvents(page, str(context['maxDate']))[0]),
+}
+
+def landed_windows(stream, field, parse, directory=None):
+    # (low, high, records) of every landed page, the window is what the page itself holds
+    for context, page in landing.iter_pages(stream, directory):
+        records = parse(page, context)
+        values = [int(record[field]) for record in records if record.get(field) is not None]
+        if values:
+            yield min(values), max(values), records
+
+@runmetrics.timed_stage
+def RebuildFromLanding(streams=None, directory=None):
+    """Reload the tables of streams from the landed pages with the current parsers, no API call is made.
+
+    Per landed page the rows inside the window of its records are deleted and replayed, rows
+    between or outside the pages are kept. A stream is rebuilt in one transaction, a failure
+    leaves its table as it was. Watermarks are left as they are.
+    """
+    unknown = [stream for stream in streams or [] if stream not in LANDING_STREAMS]
+    if unknown:
+        raise ValueError("Unknown landed streams " + ",".join(unknown) + ", use " + ",".join(LANDING_STREAMS))
+    failed = []
+    for stream in streams or list(LANDING_STREAMS):
+        table, column, field, create, parse = LANDING_STREAMS[stream]
+        files = landing.landed_files(stream, directory)
+        if not files:
+            print(f"No landed pages for {stream}")
+            continue
+        getattr(db, create)(host, port, user, password, database)
+        print(f"Rebuilding {table} from {len(files)} landed pages")
+        result = db.replace_landed_rows(table, column, landed_windows(stream, field, parse, directory),
+                                        host, port, user, password, database)
+        if result is None:
+            failed.append(stream)
+            continue
+        deleted, rows = result
+        print(f"{table}: {deleted} rows deleted, {rows} rows reloaded from the landing zone")
+    if failed:
+        raise RuntimeError("Rebuild from the landing zone failed for " + ",".join(failed))
 
 def ReportProdctsVersions():
     productscount = products.getCountEndpointPublisherProductVersions(apikey,urldashboard)
@@ -713,6 +808,7 @@ def ReportEndpointsold():
     else:
         print("Done!")
 
+@runmetrics.timed_stage
 def ReportEndpoints():
     db.check_create_table_endpoints(host, port, user, password, database)
     db.clean_table_endpoints(host, port, user, password, database)
@@ -723,6 +819,8 @@ def ReportEndpoints():
     print("Endpoints -> " + str(endpointcount))
     if endpointcount > 0:
         all_endpoitns = getAllEndpoits(fr0m,siz3,endpointcount,firstEID)
+    # Keep the Vicarius/Tenable crosswalk in step with the new endpoint list
+    db.refresh_asset_identity(host, port, user, password, database)
 
 def ReportEndpointsAttributes():
     db.check_create_table_endpointsAttribute(host, port, user, password, database)
@@ -766,6 +864,7 @@ def ReportEndpointScores():
     else:
         print("Done!")    
 
+@runmetrics.timed_stage
 def ReportIncident(start_date=None, end_date=None):
 
     # Constants
@@ -773,29 +872,33 @@ def ReportIncident(start_date=None, end_date=None):
     ONE_MONTH_NANOSECONDS = int(timedelta(days=30).total_seconds() * 1e9)  # Define the duration of one month in nanoseconds
     incident_type="MitigatedVulnerability,DetectedVulnerability"
 
-    def process_in_chunks(minDate, maxDate, db, incident_type):
+    def process_in_chunks(minDate, maxDate, db, incident_type, stream):
         current_min_date = minDate
         while current_min_date < maxDate:
             current_max_date = min(current_min_date + ONE_MONTH_NANOSECONDS, maxDate)
             try:
                 control_rate(20)
-                getAllIncidentEventVulnerabilities(0, 500, incident_type, str(current_min_date), str(current_max_date))
+                getAllIncidentEventVulnerabilities(0, 500, incident_type, str(current_min_date), str(current_max_date), stream)
             except Exception as e:
                 print("Incident Error 1")
                 print(f"Error processing incidents: {e}")
-                print
+                # Later chunks would move the watermark past the gap
+                return
             current_min_date = current_max_date
 
-    def process_all_at_once(minDate, maxDate, db, incident_type):
+    def process_all_at_once(minDate, maxDate, db, incident_type, stream):
         try:
             control_rate(20)
-            getAllIncidentEventVulnerabilities(0, 500, incident_type, str(minDate), str(maxDate))
+            getAllIncidentEventVulnerabilities(0, 500, incident_type, str(minDate), str(maxDate), stream)
         except Exception as e:
             print("Incident Error 2")
             print(f"Error processing incidents: {e}")
 
     # Ensure the incident table exists in the database
     db.check_create_table_incident(host, port, user, password, database)
+    db.check_create_table_sync_watermark(host, port, user, password, database)
+    # Runs with explicit dates are backfills and leave the watermark alone
+    stream = None if start_date or end_date else 'incidents'
     
     if end_date:
         # Get the end date from the arguments
@@ -819,40 +922,58 @@ def ReportIncident(start_date=None, end_date=None):
             print("Invalid start date format. Please use the format YYYY-MM-DD.")
             return
     else:
-        # Load the most recent incident date from the database or use the initial date
-        df = db.load_incident_to_df(host, port, user, password, database, maxDate)
-        minDate = df['create_at_nano'].max() if df is not None and not df.empty else INITIAL_MIN_DATE
-        print("minDate set from DB" if df is not df.empty else "minDate set from INITIAL_MIN_DATE")
+        minDate = db.get_watermark(organization_domain, 'incidents', host, port, user, password, database)
+        if minDate is not None:
+            print("minDate set from watermark")
+        else:
+            # First run against this table, seed the watermark from the most recent incident or use the initial date
+            df = db.load_incident_to_df(host, port, user, password, database, maxDate)
+            minDate = int(df['create_at_nano'].max()) if df is not None and not df.empty else INITIAL_MIN_DATE
+            print("minDate set from DB" if df is not None and not df.empty else "minDate set from INITIAL_MIN_DATE")
+            if stream:
+                db.set_watermark(organization_domain, stream, minDate, host, port, user, password, database)
 
     # Process incidents in monthly chunks if the interval is too large
     if (maxDate - minDate) > ONE_MONTH_NANOSECONDS:
-        process_in_chunks(minDate, maxDate, db, incident_type)
+        process_in_chunks(minDate, maxDate, db, incident_type, stream)
     else:
-        process_all_at_once(minDate, maxDate, db, incident_type)
+        process_all_at_once(minDate, maxDate, db, incident_type, stream)
+
+    # New mitigations are paired after every incidents sync, the scheduled graph has no separate step for it
+    with runmetrics.stage('MitigationTime'):
+        mt.get_mitigation_time(host, port, user, password, database)
 
+@runmetrics.timed_stage
 def ReportIncidientImpersontation():
     db.check_create_table_xProtectEvents(host, port, user, password, database)
+    db.check_create_table_sync_watermark(host, port, user, password, database)
     dateNow = datetime.now()
     maxDate = str(int(float(dateNow.timestamp())*1000000000))
-    minDate = str(dictState['minDatexProtectLog'])
+    stream = 'xProtectEvents'
     incidenttype = "ImpersonationAttempt" #Asset Events, App Events, User Events and System Events
 
-    df = db.load_xProtectEvents_to_df(host, port, user, password, database, minDate)
-    if df is not None:
-        if df.empty:
-            print("minDate Set from state.json")
-        else:
-            for ind in df.index:
-                dbMinDate = df['create_at_nano'][ind]
-            if dbMinDate > np.int64(minDate):
-                minDate = str(dbMinDate)
-                print("minDate Set from DB")
+    minDate = db.get_watermark(organization_domain, stream, host, port, user, password, database)
+    if minDate is not None:
+        minDate = str(minDate)
+        print("minDate set from watermark")
+    else:
+        # First run against this table, seed the watermark from state.json or the stored events
+        minDate = str(dictState.get('minDatexProtectLog', 0))
+        df = db.load_xProtectEvents_to_df(host, port, user, password, database, minDate)
+        if df is not None:
+            if df.empty:
+                print("minDate Set from state.json")
             else:
-                print("minDate set from state.json")
+                for ind in df.index:
+                    dbMinDate = df['create_at_nano'][ind]
+                if dbMinDate > np.int64(minDate):
+                    minDate = str(dbMinDate)
+                    print("minDate Set from DB")
+                else:
+                    print("minDate set from state.json")
+        db.set_watermark(organization_domain, stream, minDate, host, port, user, password, database)
     #print(maxDate)
     #print(type(maxDate))
-    dictState.update({'minDatexProtectLog': int(maxDate)})
-    state.setState(dictState)
     #print("Set max date")
     fr0m = 0
     siz3 = 500
@@ -862,8 +983,9 @@ def ReportIncidientImpersontation():
     #maxDate = str(1697227198691126350)
     #minDate = str(1698796800000000000)
 
-    getAllxProtectEvents(fr0m,siz3,incidenttype,minDate,maxDate,"xProtectEvents")
+    getAllxProtectEvents(fr0m,siz3,incidenttype,minDate,maxDate,"xProtectEvents",stream)
 
+@runmetrics.timed_stage
 def ReportEventLog():
     db.check_create_table_Events(host, port, user, password, database)
     dateNow = datetime.now()
@@ -914,25 +1036,58 @@ def SearchGroupsbyEndpoint(endpoint,dfg):
     
     return my_string
 
-def get_all_endpoints_vulnerabilities(offset, limit, min_date, max_date, endpoint_name, endpoint_hash, jsonresponse, apiCount):
+# Checkpoints older than this are from a run too old to resume
+CHECKPOINT_MAX_AGE_HOURS = 24
+
+def start_checkpoint(report, resume):
+    """Return the {endpoint_hash: (page_offset, done)} progress to resume from, or start a new checkpoint."""
+    db.check_create_table_sync_checkpoint(host, port, user, password, database)
+    if not resume:
+        db.clear_sync_checkpoint(report, host, port, user, password, database)
+        return {}
+    checkpoints = db.load_sync_checkpoint(report, CHECKPOINT_MAX_AGE_HOURS, host, port, user, password, database)
+    print(f"Resuming {report}: {sum(1 for offset, done in checkpoints.values() if done)} endpoints already synced")
+    return checkpoints
+
+def finish_checkpoint(report, complete):
+    # The checkpoint is only dropped once every endpoint is done, partial offsets stay for --resume
+    if complete:
+        db.clear_sync_checkpoint(report, host, port, user, password, database)
+    else:
+        print(f"{report}: some endpoints did not finish, run again with --resume to continue them")
+
+def endpoint_checkpoint(report, endpointHash):
+    def checkpoint(offset, done=False):
+        db.save_sync_checkpoint(report, endpointHash, offset, done, host, port, user, password, database)
+    return checkpoint
+
+def get_all_endpoints_vulnerabilities(offset, limit, min_date, max_date, endpoint_name, endpoint_hash, jsonresponse, apiCount, checkpoint=None):
+    """Pull the pages of an endpoint from offset on, jsonresponse is the already fetched first page or None when resuming.
+
+    apiCount is None when resuming, the pages are then pulled until the API returns an empty one.
+    checkpoint(offset) is called after every stored page. Returns False when the pull stopped on an error.
+    """
     #print(f"Date Range: {min_date} - {max_date}")
     control_rate(50)
-    jresponse = jsonresponse
-    try:
-        vulnerabilities = vuln.parseEndpointVulnerabilities(apikey, urldashboard, jresponse)
-    except Exception as e:
-        error_msg = f"Exception occurred while parsing vulnerabilities for {endpoint_name}: {e}"
-        print(error_msg)
-        errorList.append(error_msg)
-        
+    if jsonresponse is not None:
+        jresponse = jsonresponse
+        try:
+            vulnerabilities = vuln.parseEndpointVulnerabilities(apikey, urldashboard, jresponse)
+        except Exception as e:
+            error_msg = f"Exception occurred while parsing vulnerabilities for {endpoint_name}: {e}"
+            print(error_msg)
+            errorList.append(error_msg)
+            return False
 
-    print(f"Asset Name: {endpoint_name}. Server Response Count: {apiCount}")
-    
-    db.insert_into_table_activevulnerabilities(vulnerabilities, host, port, user, password, database)
-    del jresponse
-    del vulnerabilities
+        print(f"Asset Name: {endpoint_name}. Server Response Count: {apiCount}")
+        
+        db.insert_into_table_activevulnerabilities(vulnerabilities, host, port, user, password, database)
+        del jresponse
+        del vulnerabilities
+        if checkpoint:
+            checkpoint(offset)
     print(f"Pagination Offset: {offset}")
-    if offset >= apiCount:
+    if apiCount is not None and offset >= apiCount:
         print("Pull Complete")
     else:
         while True:
@@ -951,7 +1106,7 @@ def get_all_endpoints_vulnerabilities(offset, limit, min_date, max_date, endpoin
                     error_msg = f"Exception occurred while parsing vulnerabilities for {endpoint_name}: {e}"
                     print(error_msg)
                     errorList.append(error_msg)
-                    break
+                    return False
 
                 print(f"Asset Name: {endpoint_name}. Server Response Count: {server_response_count}")
                 
@@ -960,6 +1115,8 @@ def get_all_endpoints_vulnerabilities(offset, limit, min_date, max_date, endpoin
                 del vulnerabilities
 
                 offset += limit
+                if checkpoint:
+                    checkpoint(offset)
                 if offset >= server_response_count:
                     break
 
@@ -969,19 +1126,21 @@ def get_all_endpoints_vulnerabilities(offset, limit, min_date, max_date, endpoin
                 error_msg = f"Exception occurred while fetching vulnerabilities for {endpoint_name}: {e}"
                 print(error_msg)
                 errorList.append(error_msg)
-                break
+                return False
 
             # Rate control between pagination requests
             control_rate(30)
+    return True
 
-def ReportVunerabilities():
+@runmetrics.timed_stage
+def ReportVunerabilities(resume=False):
    
     #df = pd.read_csv(dictState['reportAssets'])
     #df = df.sort_values(by='last_connected', ascending=False)
     #df = df.drop_duplicates(subset=['hostname'], keep='first')
     #print("Total Assets: " + str(len(df.index)))
-    df = db.load_endpoints_to_df(host, port, user, password, database)
-    print("Checking Vulns on Assets: " + str(len(df.index)))
+    total = db.count_table(host, port, user, password, database, 'endpoints', distinct='endpoint_hash')
+    print("Checking Vulns on Assets: " + str(total))
     fr0m = 0
     siz3 = 500
     totalPatchs = 0    
@@ -991,17 +1150,34 @@ def ReportVunerabilities():
 
     db.check_create_table_activevulnerabilities(host, port, user, password, database)
     #db.clean_table_activevulnerabilities(host, port, user, password, database)
+    checkpoints = start_checkpoint('activevulnerabilities', resume)
+    # Set when an endpoint did not finish, its checkpoint is kept for --resume
+    complete = True
 
       
     dateNow = datetime.now()
     minDate = 0000000000000
     maxDate = str(int(float(dateNow.timestamp())*1000))
 
-    for ind in df.index:
+    # Only the needed columns are read, in keyset batches (iter_keyset) instead of loading the whole table
+    for ind, endpoint in enumerate(db.iter_endpoints(host, port, user, password, database)):
         
-        endpointName = df['endpoint_name'][ind]
-        endpointHash = df['endpoint_hash'][ind]
+        endpointName = endpoint.endpoint_name
+        endpointHash = endpoint.endpoint_hash
         #endpointSO = df['so'][ind]
+        pageOffset, done = checkpoints.get(endpointHash, (0, False))
+        checkpoint = endpoint_checkpoint('activevulnerabilities', endpointHash)
+        if done:
+            print(f'Asset {ind + 1}/{total} - {endpointName} - already synced, skipping')
+            continue
+        if pageOffset > 0:
+            # Killed in the middle of this endpoint, the pages before pageOffset are already stored
+            print(f'Asset {ind + 1}/{total} - {endpointName} - resuming at offset {pageOffset}')
+            if get_all_endpoints_vulnerabilities(pageOffset,siz3,minDate,maxDate,endpointName,endpointHash,None,None,checkpoint):
+                checkpoint(pageOffset, True)
+            else:
+                complete = False
+            continue
         control_rate (55)
         current_cve_count_api,jsonresponse,errors = vuln.getCountEventsPerAsset(apikey,urldashboard,endpointHash)
         current_cve_count_db = db.get_cve_count_by_endpoint_hash(host, port, user, password, database,endpointHash)
@@ -1012,7 +1188,7 @@ def ReportVunerabilities():
                 print("Appending errors to the errorList")
             if "API Rate Limit" or "Return Exception" in errors:
                 print("API Rate limit exceeded. Perhaps another api query is running")
-        print(f'Asset {ind + 1}/{len(df)} - {endpointName} - Current CVE Count - API: {current_cve_count_api} DB: {current_cve_count_db}')
+        print(f'Asset {ind + 1}/{total} - {endpointName} - Current CVE Count - API: {current_cve_count_api} DB: {current_cve_count_db}')
         
         if (current_cve_count_db != current_cve_count_api):
             print (f'Updating Vulnerabilities')
@@ -1020,9 +1196,16 @@ def ReportVunerabilities():
                 db.delete_activevulnerabilities_by_endpoint_hash (host, port, user, password, database,endpointHash)
             if (current_cve_count_api > 0):
                 fr0m = 500
-                get_all_endpoints_vulnerabilities(fr0m,siz3,minDate,maxDate,endpointName,endpointHash,jsonresponse,current_cve_count_api)
+                if not get_all_endpoints_vulnerabilities(fr0m,siz3,minDate,maxDate,endpointName,endpointHash,jsonresponse,current_cve_count_api,checkpoint):
+                    complete = False
+                    continue
             else:
                 print(f'API Count is 0 No queries needed')
+        if errors:
+            complete = False
+        else:
+            checkpoint(0, True)
+    finish_checkpoint('activevulnerabilities', complete)
 
 def getAllPatchsEndpoint(fr0m,siz3,endpointName,endpointSO,endpointHash):
 
@@ -1038,26 +1221,30 @@ def getAllPatchsEndpoint(fr0m,siz3,endpointName,endpointSO,endpointHash):
         fr0m += siz3
         getAllPatchsEndpoint(fr0m,siz3,endpointName,endpointSO,endpointHash)
 
-def get_all_endpoints_patches(offset, limit, min_date, max_date, endpoint_name, endpoint_hash, jsonresponse, apiCount):
+def get_all_endpoints_patches(offset, limit, min_date, max_date, endpoint_name, endpoint_hash, jsonresponse, apiCount, checkpoint=None):
+    """Same paging and checkpointing as get_all_endpoints_vulnerabilities, for assetspatchs."""
     #(fr0m,siz3,minDate,maxDate,endpointName,endpointHash)
     #print(f"Date Range: {min_date} - {max_date}")
     control_rate(50)
-    jresponse = jsonresponse
-    try:
-        assetPatches = patchs.parseEndpointpatches(jresponse,endpoint_name,endpoint_hash)
-    except Exception as e:
-        error_msg = f"Exception occurred while parsing vulnerabilities for {endpoint_name}: {e}"
-        print(error_msg)
-        errorList.append(error_msg)
-        
+    if jsonresponse is not None:
+        jresponse = jsonresponse
+        try:
+            assetPatches = patchs.parseEndpointpatches(jresponse,endpoint_name,endpoint_hash)
+        except Exception as e:
+            error_msg = f"Exception occurred while parsing vulnerabilities for {endpoint_name}: {e}"
+            print(error_msg)
+            errorList.append(error_msg)
+            return False
 
-    print(f"Asset Name: {endpoint_name}. Server Response Count: {apiCount}")
-    
-    db.insert_into_table_assetspatchs(assetPatches, host, port, user, password, database)
-    del jresponse
-    del assetPatches
+        print(f"Asset Name: {endpoint_name}. Server Response Count: {apiCount}")
+        
+        db.insert_into_table_assetspatchs(assetPatches, host, port, user, password, database)
+        del jresponse
+        del assetPatches
+        if checkpoint:
+            checkpoint(offset)
     print(f"Pagination Offset: {offset}")
-    if offset >= apiCount:
+    if apiCount is not None and offset >= apiCount:
         print("Pull Complete")
     else:
         while True:
@@ -1075,7 +1262,7 @@ def get_all_endpoints_patches(offset, limit, min_date, max_date, endpoint_name,
                     error_msg = f"Exception occurred while parsing patchs for {endpoint_name}: {e}"
                     print(error_msg)
                     errorList.append(error_msg)
-                    break
+                    return False
 
                 print(f"Asset Name: {endpoint_name}. Server Response Count: {server_response_count}")
                 
@@ -1085,6 +1272,8 @@ def get_all_endpoints_patches(offset, limit, min_date, max_date, endpoint_name,
                 del assetPatches
 
                 offset += limit
+                if checkpoint:
+                    checkpoint(offset)
                 if offset >= server_response_count:
                     break
 
@@ -1094,29 +1283,48 @@ def get_all_endpoints_patches(offset, limit, min_date, max_date, endpoint_name,
                 error_msg = f"Exception occurred while fetching patches for {endpoint_name}: {e}"
                 print(error_msg)
                 errorList.append(error_msg)
-                break
+                return False
 
             # Rate control between pagination requests
             control_rate(30)
+    return True
 
-def ReportEndpointPatchs():
-    df = db.load_endpoints_to_df(host, port, user, password, database)
-    print("Checking Vulns on Assets: " + str(len(df.index)))
+@runmetrics.timed_stage
+def ReportEndpointPatchs(resume=False):
+    total = db.count_table(host, port, user, password, database, 'endpoints', distinct='endpoint_hash')
+    print("Checking Vulns on Assets: " + str(total))
     fr0m = 0
     siz3 = 500
 
     db.check_create_table_assetspatchs(host, port, user, password, database)
     #db.clean_table_assetspatchs(host, port, user, password, database)
+    checkpoints = start_checkpoint('assetspatchs', resume)
+    # Set when an endpoint did not finish, its checkpoint is kept for --resume
+    complete = True
     dateNow = datetime.now()
     minDate = 0000000000000
     maxDate = str(int(float(dateNow.timestamp())*1000))
             
-    for ind in df.index:        
+    columns = ('endpoint_name', 'operating_system_name', 'endpoint_hash')
+    for ind, endpoint in enumerate(db.iter_endpoints(host, port, user, password, database, columns)):        
         
-        endpointName = df['endpoint_name'][ind]
-        endpointSO = df['operating_system_name'][ind]
-        endpointHash = df['endpoint_hash'][ind]
+        endpointName = endpoint.endpoint_name
+        endpointSO = endpoint.operating_system_name
+        endpointHash = endpoint.endpoint_hash
         #endpointGroups = SearchGroupsbyEndpoint(endpointName,dfg)
+        pageOffset, done = checkpoints.get(endpointHash, (0, False))
+        checkpoint = endpoint_checkpoint('assetspatchs', endpointHash)
+        if done:
+            print(f'Asset {ind + 1}/{total} - {endpointName} - already synced, skipping')
+            continue
+        if pageOffset > 0:
+            # Killed in the middle of this endpoint, the pages before pageOffset are already stored
+            print(f'Asset {ind + 1}/{total} - {endpointName} - resuming at offset {pageOffset}')
+            if get_all_endpoints_patches(pageOffset,siz3,minDate,maxDate,endpointName,endpointHash,None,None,checkpoint):
+                checkpoint(pageOffset, True)
+            else:
+                complete = False
+            continue
         control_rate(55)
         current_patch_count_api,jsonresponse,errors = patchs.getCountEndpointsPatchs(apikey, urldashboard,endpointHash) #vuln.getCountEventsPerAsset(apikey, urldashboard,endpointHash)
         current_patch_count_db = db.get_patch_count_by_endpoint_hash(host, port, user, password, database, endpointHash)#db.get_cve_count_by_endpoint_hash(host, port, user, password, database,endpointHash)
@@ -1128,7 +1336,7 @@ def ReportEndpointPatchs():
             if "API Rate Limit" or "Return Exception" in errors:
                 print("API Rate limit exceeded. Perhaps another api query is running")
 
-        print(f'Asset {ind + 1}/{len(df)} - {endpointName} - Current patch Count - API: {current_patch_count_api} DB: {current_patch_count_db}')
+        print(f'Asset {ind + 1}/{total} - {endpointName} - Current patch Count - API: {current_patch_count_api} DB: {current_patch_count_db}')
         if (current_patch_count_db != current_patch_count_api):
             print (f'Updating Patches')
             if (current_patch_count_db > 0):
@@ -1136,60 +1344,66 @@ def ReportEndpointPatchs():
             #get_all_endpoints_vulnerabilities(fr0m,siz3,minDate,maxDate,endpointName,endpointHash)
             if (current_patch_count_api > 0):
                 fr0m = 500
-                get_all_endpoints_patches(fr0m,siz3,minDate,maxDate,endpointName,endpointHash,jsonresponse,current_patch_count_api)
+                if not get_all_endpoints_patches(fr0m,siz3,minDate,maxDate,endpointName,endpointHash,jsonresponse,current_patch_count_api,checkpoint):
+                    complete = False
+                    continue
             else: 
                 print(f'API Patch count is 0, No patches to add')
+        if errors:
+            complete = False
+        else:
+            checkpoint(0, True)
+    finish_checkpoint('assetspatchs', complete)
+
+def fetchGroupMembers(group):
+    """Return (groupJson, members) for one group, members is None when the group could not be read."""
+    groupscount,assetgroupSRO = cached_call(50, groups.getAssetsbyGroupID, apikey, urldashboard, group['groupName'], group['groupID'], 0, 500)
+    if groupscount is None:
+        return None,None
+    print(f"Group: {group['groupName']}, Assets: {groupscount}")
+    groupJson = {
+        'groupId': group['groupID'],
+        'groupName': group['groupName'],
+        'groupTeamName': group['groupTeam'],
+        'groupTeamId': group['groupTeamId'],
+        'groupAssetCount': groupscount,
+        'groupUpdatedAt': group.get('groupUpdatedAt')
+    }
+    members = assetgroupSRO
+    if groupscount > len(assetgroupSRO):
+        members = getAllEndpointsGroup(500, 500, groupscount, group['groupName'], group['groupID'], assetgroupSRO)
+    return groupJson,members
 
 def processGroups(allgroups):
-    groupJsonObj = []
-    groupAssetsOject = []
-    groupcountSum = 0
-    for group in allgroups:
-        groupName = group['groupName']
-        groupId = group['groupID']
-        #searchQuery = group['searchQuery']
-        groupTeam = group['groupTeam']
-        groupTeamId = group['groupTeamId']
-
-        # Get the count of assets for each group
-        groupscount,assetgroupSRO= groups.getAssetsbyGroupID(apikey, urldashboard, groupName, groupId, 0, 500)
-        print(f"Group: {groupName}, Assets: {groupscount}")
-        groupcountSum += groupscount
-        GroupAssetCount = groupscount
-        groupJson = {
-            'groupId': groupId,
-            'groupName': groupName,
-            'groupTeamName': groupTeam,
-            'groupTeamId': groupTeamId,
-            'groupAssetCount': GroupAssetCount
-        }
-        #print(groupJson)
-        groupJsonObj.append(groupJson)
-        
-        if groupscount > 0:
-            control_rate(50)
-            all_group_assets = getAllEndpointsGroup(500, 500, groupscount, groupName, groupId, assetgroupSRO)
-            groupAssetsOject.extend(all_group_assets)
-            #print(all_group_assets)
-        else:
-            print(f"No assets found for group {groupName}")
-    #print(groupJsonObj)
-    #print(json.dumps(groupJsonObj))
-    #print(groupAssetsOject)
-    print("groups count sum: " + str(groupcountSum))
-    db.insert_into_table_groups(groupJsonObj,host,port,user,password,database)
-    db.insert_into_table_endpointgroups(groupAssetsOject,host,port,user,password,database)
-    del groupJson
-    del groupAssetsOject
+    # Only groups edited since the last run are crawled again, the rest keep their stored members
+    stored = db.load_groups_updatedat(host, port, user, password, database)
+    changed = [group for group in allgroups
+               if group.get('groupUpdatedAt') is None or stored.get(group['groupID']) != group.get('groupUpdatedAt')]
+    print(f"Groups changed since the last run: {len(changed)} of {len(allgroups)}")
+
+    groupJsonObj = {group['groupID']: {'groupId': group['groupID'], 'groupName': group['groupName']} for group in allgroups}
+    members_by_group = {}
+    with ThreadPoolExecutor(max_workers=GROUP_CRAWL_WORKERS) as executor:
+        for group,(groupJson,members) in zip(changed, executor.map(fetchGroupMembers, changed)):
+            if members is None:
+                # Keep the stored rows and the old UpdatedAt so the group is retried next run
+                print(f"Could not read the assets of group {group['groupName']}, keeping the stored members")
+                continue
+            groupJsonObj[group['groupID']] = groupJson
+            members_by_group[group['groupID']] = members
+
+    result = db.sync_groups(list(groupJsonObj.values()), members_by_group, host, port, user, password, database)
+    del members_by_group
+    if result is None:
+        raise Exception("Groups and memberships were not stored, the transaction was rolled back")
     gc.collect()
 
+@runmetrics.timed_stage
 def ReportGroupsSearchs():
     control_rate(20)
     db.check_create_table_groups(host,port,user,password,database)
     db.check_create_table_endpointgroups(host, port, user, password, database)
 
-    db.clean_table_groups(host, port, user, password, database)
-    db.clean_table_endpointgroups(host, port, user, password, database)
     fr0m = 0 
     siz3 = 500
     groupscount,initresponse = groups.getEndpointGroupsID(apikey, urldashboard, fr0m, siz3)
@@ -1235,6 +1449,10 @@ def updateState():
     dictState.update({'minDateIncidentEventVulnerabilities': minDateIncidentEventVulnerabilities}) #minDateIncidentEventVulnerabilities
     dictState.update({'lastIncidentEventVulnerabilities':0})    
     state.setState(dictState)
+    # The incremental syncs read their start point from the watermark table
+    db.check_create_table_sync_watermark(host, port, user, password, database)
+    db.set_watermark(organization_domain, 'tasks', lastEndpointsEventTask, host, port, user, password, database)
+    db.set_watermark(organization_domain, 'incidents', minDateIncidentEventVulnerabilities, host, port, user, password, database)
     print("Done!")
 
 def logscriptActivity(startTime,endTime,errorList,reports):
@@ -1263,6 +1481,14 @@ def logscriptActivity(startTime,endTime,errorList,reports):
         }
         db.insert_into_table_scriptActivity(recordjson,host,port,user,password,database) 
 
+def logRunMetrics(run,reports):
+    # Telemetry is best effort, a failure here never fails the run
+    try:
+        db.check_create_table_run_metrics(host, port, user, password, database)
+        db.insert_into_table_run_metrics(run.run_id, reports, run.stages, host, port, user, password, database)
+    except Exception as e:
+        print("Run metrics were not recorded: " + str(e))
+
 def configoptionalTools(host,port,user,password,tools):
     import optionalDBConnectors as optionalDB
     if "metabase" in tools:
@@ -1302,6 +1528,7 @@ def metabaseTempalateReplace(host,port,user,password,tools):
     configoptionalTools(host, port, user, password, tools)
 
 def removeCronJobs():
+    from crontab import CronTab
     cron = CronTab(user=True)  # Use 'user=True' for the current user or specify a username
 
     # Define the commands of the cron jobs you want to remove
@@ -1326,6 +1553,7 @@ def removeCronJobs():
     print("Cron jobs removed.")
 
 def createCronJobs():
+    from crontab import CronTab
     #Create the reoccuring Cron job
     cron = CronTab(user=True)
     #Run full sync 
@@ -1360,6 +1588,7 @@ def createCronJobs():
     print("Cron job created:")
 
 def listCronJobs():
+    from crontab import CronTab
     # Create a new cron object
     cron = CronTab(user=True)  # Use 'user=True' for the current user or specify a username
 
@@ -1368,10 +1597,29 @@ def listCronJobs():
     for job in cron:
         print(job)
 
-def main():
+def main(argv=None):
+    global dictState, errorList
     #args.dashboard
+    # Parsed per call so the report worker can run main() for many jobs in one process
+    args = parser.parse_args(argv)
+    load_config()
+    print("####################################")
+    print("####################################")
+    print("####################################")
+    print("Beginning a new Run")
+    print("####################################")
+    print("####################################")
+    print("####################################")
+
+    print (f"Dashboard URL is ", {urldashboard})
+    dictState = load_state()
     startTime = datetime.now()
+    run = runmetrics.start_run()
+    landing.configure(args.land or None, args.landingDir)
+    httpclient.configure_cache(reads=not args.noCache and httpclient.CACHE_READS_DEFAULT)
+    run.profiler = profiling.Profiler(args.profile, args.profileDir, run.run_id).stage if args.profile else None
     print("Script start time: " + str(startTime))    
+    # Module level so the errors the helpers append are reported with the run
     errorList = []
     print("Starting VickyTopia Report CLI")
     lastrun = dictState['vRxLastRun']
@@ -1391,6 +1639,7 @@ def main():
     if vRxSetup == 0:
         removeCronJobs()
         reports = "initSync"
+        from dateutil.relativedelta import relativedelta
         now = datetime.now()
         m1 = now - relativedelta(months=6)
         date_str = m1.strftime("%Y-%m-%d")
@@ -1424,7 +1673,6 @@ def main():
             print(str(e))
         print("Completed Pulling Groups")
         gc.collect()
-        time.sleep(60)
         try:
             ReportTaskEvents(start_date, end_date)   
             gc.collect()
@@ -1432,23 +1680,20 @@ def main():
             errorList.append("ReportTaskEvents:" + str(e))
             print(str(e))
         print("Completed Pulling Tasks")
-        time.sleep(60)
         try:
-            ReportVunerabilities()
+            ReportVunerabilities(resume=args.resume)
             gc.collect()
         except Exception as e:
             errorList.append("ReportVunerabilities:" + str(e))
             print(str(e))
         print("Completed Pulling Vulnerabilites")
-        time.sleep(60)
         try:
-            ReportEndpointPatchs()
+            ReportEndpointPatchs(resume=args.resume)
             gc.collect()
         except Exception as e:
             errorList.append("ReportEndpointPatchs:" + str(e))
             print(str(e))
         print("Completed Pulling Patches")
-        time.sleep(60)
         try:
             ReportIncident(start_date, end_date)
             gc.collect()
@@ -1456,7 +1701,6 @@ def main():
             errorList.append("ReportIncident:" + str(e))
             print(str(e)) 
         print("Completed Pulling Incidents")
-        time.sleep(60) 
         try:
             ReportHasPatchApps()
             gc.collect()       
@@ -1480,6 +1724,7 @@ def main():
     elif vRxSetup == 2:
         reports = "1monthinit"
         removeCronJobs()
+        from dateutil.relativedelta import relativedelta
         now = datetime.now()
         m1 = now - relativedelta(months=1)
         date_str = m1.strftime("%Y-%m-%d")
@@ -1513,7 +1758,6 @@ def main():
             errorList.append("ReportGroupsSearchs:" + str(e))
             print(str(e))
         print("Completed Pulling Groups")
-        time.sleep(60)
         try:
             ReportTaskEvents(start_date, end_date)
             gc.collect()
@@ -1521,23 +1765,20 @@ def main():
             errorList.append("ReportTaskEvents:" + str(e))
             print(str(e))
         print("Completed Pulling Tasks")
-        time.sleep(60)
         try:
-            ReportVunerabilities()
+            ReportVunerabilities(resume=args.resume)
             gc.collect()
         except Exception as e:
             errorList.append("ReportVunerabilities:" + str(e))
             print(str(e))
         print("Completed Pulling Vulnerabilites")
-        time.sleep(60)
         try:
-            ReportEndpointPatchs()
+            ReportEndpointPatchs(resume=args.resume)
             gc.collect()
         except Exception as e:
             errorList.append("ReportEndpointPatchs:" + str(e))
             print(str(e))
         print("Completed Pulling Patches")
-        time.sleep(60)
         try:
             ReportIncident(start_date, end_date)
             gc.collect()
@@ -1545,7 +1786,6 @@ def main():
             errorList.append("ReportIncident:" + str(e))
             print(str(e)) 
         print("Completed Pulling Incidents")
-        time.sleep(60) 
         try:
             ReportHasPatchApps()       
         except Exception as e:
@@ -1589,43 +1829,37 @@ def main():
             except Exception as e:
                 errorList.append("ReportGroupsSearchs:" + str(e))
                 print(str(e))
-            time.sleep(60)
             
             try:
-                ReportVunerabilities()
+                ReportVunerabilities(resume=args.resume)
             except Exception as e:
                 errorList.append("ReportVunerabilities:" + str(e))
                 print(str(e))
             
-            time.sleep(120)            
 
             try:
                 ReportTaskEvents()
             except Exception as e:
                 errorList.append("ReportTaskEvents:" + str(e))
                 print(str(e))
-            time.sleep(60)
 
 
             try:
-                ReportEndpointPatchs()
+                ReportEndpointPatchs(resume=args.resume)
             except Exception as e:
                 errorList.append("ReportEndpointPatchs:" + str(e))
                 print(str(e))
-            time.sleep(60)
 
             try:
                 ReportIncident()
             except Exception as e:
                 errorList.append("ReportIncident:" + str(e))
                 print(str(e))  
-            time.sleep(60)
             try:
                 ReportHasPatchApps()          
             except Exception as e:
                 errorList.append("ReportHasPatchApps:" + str(e))
                 print(str(e)) 
-            time.sleep(60)
             #cd.cleanData()
             #mt.get_mitigation_time()
             
@@ -1637,6 +1871,19 @@ def main():
             #ReportGroupsAtrributesTags()
             ReportGroupsSearchs()
 
+        elif args.setup:
+            reports = "setup"
+            db.check_create_database(host, port, user, password, database)
+            cd.remove_all_except()
+
+        elif args.endpointsreport:
+            reports = "endpointsreport"
+            ReportEndpoints()
+
+        elif args.groupsreport:
+            reports = "groupsreport"
+            ReportGroupsSearchs()
+
         elif args.tasksreport:
             reports = "tasksreport"    
             if args.start_date and args.end_date:
@@ -1654,11 +1901,11 @@ def main():
             
         elif args.vulnreport:
             reports = "vulnreport" 
-            ReportVunerabilities()        
+            ReportVunerabilities(resume=args.resume)        
 
         elif args.patchsreport:
             reports = "patchsreport" 
-            ReportEndpointPatchs()
+            ReportEndpointPatchs(resume=args.resume)
 
         elif args.incidentvulreport:
             reports = "incidentvulreport" 
@@ -1687,19 +1934,38 @@ def main():
    
         elif args.mitigationtime:
             reports = "mitigationtime"
-            mt.get_mitigation_time()
+            with runmetrics.stage('MitigationTime'):
+                mt.get_mitigation_time(host, port, user, password, database, full=True)
         
         elif args.cleandata:
             reports = "cleandata"
-            cd.cleanData()
+            with runmetrics.stage('cleanData'):
+                cd.cleanData()
         
         elif args.updatestate:
             reports = "updatestate"
             updateState ()
         
+        elif args.export is not None:
+            reports = "export"
+            try:
+                ReportExport(args.export, args.exportDir)
+            except Exception as e:
+                errorList.append("ReportExport:" + str(e))
+                print(str(e))
+
+        elif args.rebuildFromLanding is not None:
+            reports = "rebuildFromLanding"
+            try:
+                RebuildFromLanding(args.rebuildFromLanding, args.landingDir)
+            except Exception as e:
+                errorList.append("RebuildFromLanding:" + str(e))
+                print(str(e))
+
         elif args.updateExternalScore:
             reports = "updateExternalScore"
-            updExSc.download_and_load_epss_data (host, port, user, password, database)
+            with runmetrics.stage('updateExternalScore'):
+                updExSc.download_and_load_epss_data (host, port, user, password, database, args.epssFile)
         
         elif args.metabaseTempalateBackup:
             reports = "metabaseTempalateBackup"
@@ -1726,37 +1992,32 @@ def main():
             except Exception as e:           
                 errorList.append("ReportEndpoints:" + e)
                 print(str(e))
-            time.sleep(60)
             try:
                 ReportGroupsSearchs()
             except Exception as e:
                 errorList.append("ReportGroupsSearchs:" + str(e))
                 print(str(e))
-            time.sleep(60)
             #try:
-            #    ReportVunerabilities()
+            #    ReportVunerabilities(resume=args.resume)
             #except Exception as e:
             #    errorList.append("ReportVunerabilities:" + str(e))
             #    print(str(e))
             #time.sleep(120)            
             try:
-                ReportEndpointPatchs()
+                ReportEndpointPatchs(resume=args.resume)
             except Exception as e:
                 errorList.append("ReportEndpointPatchs:" + str(e))
                 print(str(e))
-            time.sleep(60)
             try:
                 ReportHasPatchApps()          
             except Exception as e:
                 errorList.append("ReportHasPatchApps:" + str(e))
                 print(str(e)) 
-            time.sleep(60)
             try:
                 getWaitingEndpoitnTasks()
             except Exception as e:
                 errorList.append("getWaitingEndpoitnTasks:" + str(e))
                 print(str(e)) 
-            time.sleep(60)
         
         elif args.activeVulnsTable:
             reports = "activeVulns"
@@ -1766,13 +2027,11 @@ def main():
             except Exception as e:           
                 errorList.append("ReportEndpoints:" + e)
                 print(str(e))
-            time.sleep(60)
             try:
-                ReportVunerabilities()
+                ReportVunerabilities(resume=args.resume)
             except Exception as e:
                 errorList.append("ReportVunerabilities:" + str(e))
                 print(str(e))
-            time.sleep(120) 
 
         elif args.difTables:
             reports = "difTables"
@@ -1784,8 +2043,7 @@ def main():
             except Exception as e:
                 errorList.append("ReportTaskEvents:" + str(e))
                 print(str(e))
-            time.sleep(60)
-            ##INCIDENTS
+            ##INCIDENTS, mitigation times are updated at the end of ReportIncident
             try:
                 ReportIncident()
             except Exception as e:
@@ -1816,11 +2074,13 @@ def main():
     print("Script Error List:" + str(errorList))
 
     logscriptActivity(startTime,endTime,errorList,reports)
+    logRunMetrics(run,reports)
 
     print("***********************************")
     print("End of Run ")
     print("***********************************")
 
+@runmetrics.timed_stage
 def ReportTenable():
     print("Starting Tenable Report...")
     
@@ -1833,6 +2093,7 @@ def ReportTenable():
     db.check_create_table_tenable_assets(host, port, user, password, database)
     db.check_create_table_tenable_vulnerabilities(host, port, user, password, database)
 
+    from TenableClient import TenableClient
     client = TenableClient(tenable_api_key, tenable_secret_key)
 
     # 1. Fetch Assets
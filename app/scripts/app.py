@@ -1,5 +1,6 @@
 from flask import Flask, request, render_template
-import subprocess
+import urllib.error
+import reportWorker
 
 app = Flask(__name__)
 
@@ -9,15 +10,15 @@ def index():
 
 @app.route('/run_script', methods=['POST'])
 def run_script():
+    # script_name is a report job name, the job runs in the report worker entrypoint.sh starts
     script_name = request.form['script_name']
     try:
-        script_path = f'scripts/{script_name}.py'
-        result = subprocess.run(['python', script_path], capture_output=True, text=True, check=True)
-        output = result.stdout
-    except subprocess.CalledProcessError as e:
-        output = f"An error occurred:\n{e.stderr}"
-    except FileNotFoundError:
-        output = f"Script {script_name} not found."
+        job = reportWorker.submit_remote({'job': script_name})
+        output = f"Queued job {job['id']}: {' '.join(job['flags'])}"
+    except urllib.error.HTTPError as e:
+        output = f"An error occurred:\n{e.read().decode()}"
+    except OSError as e:
+        output = f"Report worker not reachable: {e}"
     return render_template('index.html', output=output)
 
 if __name__ == '__main__':
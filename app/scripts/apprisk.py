@@ -1,5 +1,6 @@
 #Arthor Jordan Hamblen
 import requests
+import httpclient
 import json
 from datetime import datetime
 import time
@@ -32,7 +33,7 @@ def getallAppwithPatch(apikey,urldashboard):
       }
     ])
     url = '/vicarius-external-data-api/aggregation/searchGroup?'
-    response = requests.request("GET",urldashboard + url, params=params, headers=headers, data=payload)
+    response = httpclient.request("GET",urldashboard + url, params=params, headers=headers, data=payload, cache='app_risk')
     jsonresponse = json.loads(response.text)
     #print(jsonresponse)
     sro = jsonresponse['serverResponseObject']
@@ -77,7 +78,7 @@ def getallApp(apikey,urldashboard):
       }
     ])
     url = '/vicarius-external-data-api/aggregation/searchGroup?'
-    response = requests.request("GET",urldashboard + url, params=params, headers=headers)
+    response = httpclient.request("GET",urldashboard + url, params=params, headers=headers, cache='app_risk')
     jsonresponse = json.loads(response.text)
     if response.status_code == 429:
         print("API Rate Limit exceeded ... Waiting and Trying again")
@@ -129,7 +130,11 @@ def getAppswithRiskandPatch(apikey,urldashboard,riskLevel,fr0m,siz3):
       'Cookie': 'Vicarius-Token=' + apikey
     }
 
-    response = requests.request("GET", url, headers=headers, data=payload)
+    response = httpclient.request("GET", url, headers=headers, data=payload, cache='app_risk')
+    if response.status_code == 429:
+        print("API Rate Limit exceeded ... Waiting and Trying again")
+        time.sleep(60)
+        return getAppswithRiskandPatch(apikey,urldashboard,riskLevel,fr0m,siz3)
 
     #print(response.text)
     jsonresponse = json.loads(response.text)
@@ -201,7 +206,7 @@ def getAppswithRisk(apikey,urldashboard,riskLevel,fr0m,siz3):
       'Cookie': 'Vicarius-Token=' + apikey
     }
 
-    response = requests.request("GET", url, headers=headers)
+    response = httpclient.request("GET", url, headers=headers, cache='app_risk')
 
     #print(response.text)
     jsonresponse = json.loads(response.text)
@@ -1,4 +1,5 @@
 # %%
+import glob
 import pandas as pd
 
 
@@ -8,7 +9,7 @@ import os
 
 def remove_all_except():
     directory = '/usr/src/app/reports/'
-    files_to_keep = ['.gitignore','EndpointsEventTask.csv', 'EndpointIncidentesVulnerabilities.csv', 'state.json', 'organization-vrx-reports.pbix']
+    files_to_keep = ['.gitignore','EndpointsEventTask.csv', 'EndpointIncidentesVulnerabilities.csv', 'state.json', 'state.json.lock', 'job_history.json', 'organization-vrx-reports.pbix']
     # List all files in the directory
     all_files = os.listdir(directory)
 
@@ -27,46 +28,80 @@ def remove_all_except():
 
 
 
-def cleanData():
-
-    chunk_size = 10**6  # Adjust as needed
+REPORTS_DIR = '/usr/src/app/reports/'
+CHUNK_SIZE = 10**5
+# Size of one dedupe partition, a partition is the most that is held in memory at once
+PARTITION_BYTES = 256 * 1024**2
+
+INCIDENT_COLUMNS = ["assetid", "asset", "cve", "severity", "eventType", "publisher", "apporso", "threatLevelId", "vulV3exploitlevel", "vulv3basescore", "patchId", "vulsummary", "eventcreatedat", "eventupdatedat"]
+
+def dedupe_csv(source, target, subset, names=None, row_filter=None, chunk_size=CHUNK_SIZE):
+    """Write source to target without the rows that repeat an earlier row's subset columns.
+
+    Rows are hash partitioned on the subset into temporary files first, so
+    duplicates always land in the same partition and each partition is deduped
+    on its own. Memory use is bounded by the partition size, not the file size.
+    Rows keep their input order within a partition.
+    """
+    partitions = max(1, -(-os.path.getsize(source) // PARTITION_BYTES))
+    part_paths = [f"{target}.part{i}" for i in range(partitions)]
+    # Partitions are appended to, the ones left by a killed run would mix into this one
+    for path in glob.glob(glob.escape(target) + '.part*'):
+        os.remove(path)
+    written = set()
+    # Key columns are kept as the text of the file, an inferred dtype changes per chunk
+    # (5 in one, 5.0 in a chunk with a NaN) and the same key would hash to another partition
+    key_types = {column: str for column in subset}
+    try:
+        for chunk in pd.read_csv(source, chunksize=chunk_size, names=names, header=0 if names else 'infer', dtype=key_types):
+            if row_filter is not None:
+                chunk = chunk[row_filter(chunk)]
+            part_of_row = pd.util.hash_pandas_object(chunk[subset], index=False).to_numpy() % partitions
+            for part, rows in chunk.groupby(part_of_row):
+                rows.to_csv(part_paths[part], mode='a', index=False, header=part not in written)
+                written.add(part)
+
+        header = True
+        for part in range(partitions):
+            if part not in written:
+                continue
+            rows = pd.read_csv(part_paths[part], dtype=key_types).drop_duplicates(subset=subset, keep='first')
+            rows.to_csv(target, mode='w' if header else 'a', index=False, header=header)
+            header = False
+        if header:
+            pd.DataFrame(columns=names).to_csv(target, index=False)
+    finally:
+        for path in part_paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+def running_max(source, column, chunk_size=CHUNK_SIZE):
+    """Largest value of one column of a csv, read a chunk at a time. column is a name or a position."""
+    largest = None
+    for chunk in pd.read_csv(source, usecols=[column], chunksize=chunk_size):
+        value = chunk.iloc[:, 0].max()
+        if pd.notna(value) and (largest is None or value > largest):
+            largest = value
+    return largest
 
-    # load Vulnerabilties.csv file to dataframe 
-    vulnerabilties_df = pd.read_csv('/usr/src/app/reports/Vulnerabilities.csv')
+def cleanData():
     # delete duplicates rows based on assethas and cve
-    vulnerabilties_df.drop_duplicates(subset=['assethash', 'cve'], keep='first', inplace=True)
-    vulnerabilties_df.to_csv('/usr/src/app/reports/VulnerabilitiesND.csv', index=False)
-    # load EndpointIncidentesVulnerabilities.csv file to dataframe
-
-    chunk_size = 10**6  # Adjust as needed
-    
-    chunks = pd.read_csv('/usr/src/app/reports/EndpointIncidentesVulnerabilities.csv', iterator=True, chunksize=chunk_size, dtype={'column1': 'int64', 'column2': 'object', 'column3': 'object', 'column4': 'object', 'column5': 'object', 'column6': 'object', 'column7': 'object', 'column8': 'int64', 'column9': 'float64', 'column10': 'float64', 'column11': 'int64', 'column12': 'object', 'column13': 'int64', 'column14': 'int64'})
-
-    events_df = pd.concat(chunks, ignore_index=True)
-
-    events_df.head()
+    dedupe_csv(REPORTS_DIR + 'Vulnerabilities.csv', REPORTS_DIR + 'VulnerabilitiesND.csv', ['assethash', 'cve'])
 
     #load Endpoints.csv file to dataframe
-    endpoints_df = pd.read_csv('/usr/src/app/reports/Endpoints.csv')
-
-    # assing to events_df the following column names "assetid", "asset", "cve", "severity", "eventType", "publisher", "apporso", "threatLevelId", "vulV3exploitlevel", "vulv3basescore", "patchId", "vulsummary", "eventcreatedat", "eventupdatedat"
-    events_df.columns = ["assetid", "asset", "cve", "severity", "eventType", "publisher", "apporso", "threatLevelId", "vulV3exploitlevel", "vulv3basescore", "patchId", "vulsummary", "eventcreatedat", "eventupdatedat"]
-
-    # create a new events_df_nd dataframe and filter rows that have assetid that are contained in endpoints_df ID column
-    events_df_nd = events_df[events_df['assetid'].isin(endpoints_df['assetid'])]
-    events_df_nd.drop_duplicates(subset=["assetid", "asset", "cve", "eventType", "publisher", "apporso", "eventcreatedat", "eventupdatedat"], keep='first', inplace=True)
+    endpoints_df = pd.read_csv(REPORTS_DIR + 'Endpoints.csv', usecols=['assetid'], dtype={'assetid': str})
+    assetids = set(endpoints_df['assetid'])
 
-    events_df_nd.to_csv('/usr/src/app/reports/EndpointIncidentesVulnerabilitiesND.csv', index=False)
+    # keep the events of assetid that are contained in endpoints_df ID column, without duplicates
+    dedupe_csv(REPORTS_DIR + 'EndpointIncidentesVulnerabilities.csv', REPORTS_DIR + 'EndpointIncidentesVulnerabilitiesND.csv',
+               ["assetid", "asset", "cve", "eventType", "publisher", "apporso", "eventcreatedat", "eventupdatedat"],
+               names=INCIDENT_COLUMNS, row_filter=lambda chunk: chunk['assetid'].isin(assetids))
 
 
 def getLastIncidentEventVulnerabilities ():
   try :
-    chunk_size = 10**6  # Adjust as needed
-    chunks = pd.read_csv('/usr/src/app/reports/EndpointIncidentesVulnerabilities.csv', iterator=True, chunksize=chunk_size, dtype={'column1': 'int64', 'column2': 'object', 'column3': 'object', 'column4': 'object', 'column5': 'object', 'column6': 'object', 'column7': 'object', 'column8': 'int64', 'column9': 'float64', 'column10': 'float64', 'column11': 'int64', 'column12': 'object', 'column13': 'int64', 'column14': 'int64'})
-    events_df = pd.concat(chunks, ignore_index=True)
-      # assing to events_df the following column names "assetid", "asset", "cve", "severity", "eventType", "publisher", "apporso", "threatLevelId", "vulV3exploitlevel", "vulv3basescore", "patchId", "vulsummary", "eventcreatedat", "eventupdatedat"
-    events_df.columns = ["assetid", "asset", "cve", "severity", "eventType", "publisher", "apporso", "threatLevelId", "vulV3exploitlevel", "vulv3basescore", "patchId", "vulsummary", "eventcreatedat", "eventupdatedat"]
-    return int (events_df['eventcreatedat'].max() * 1000000)
+    # eventcreatedat is the 13th column, the file header names differ between versions
+    return int (running_max(REPORTS_DIR + 'EndpointIncidentesVulnerabilities.csv', INCIDENT_COLUMNS.index('eventcreatedat')) * 1000000)
 
   except:
     return 0
@@ -74,10 +109,7 @@ def getLastIncidentEventVulnerabilities ():
 
 def getLastEndpointsEventTask () :
     try :
-        chunk_size = 10**6  # Adjust as needed
-        chunks = pd.read_csv('/usr/src/app/reports/EndpointsEventTask.csv', iterator=True, chunksize=chunk_size, dtype={'column1': 'int64', 'column2': 'object', 'column3': 'object', 'column4': 'object', 'column5': 'object', 'column6': 'object', 'column7': 'object', 'column8': 'int64', 'column9': 'float64', 'column10': 'float64', 'column11': 'int64', 'column12': 'object', 'column13': 'int64', 'column14': 'int64'})
-        tasks_df = pd.concat(chunks, ignore_index=True)
-        return int (tasks_df['CreateAt'].max())
+        return int (running_max(REPORTS_DIR + 'EndpointsEventTask.csv', 'CreateAt'))
 
     except:
         return 0
@@ -1,7 +1,9 @@
 
 import os
+import re
 import time
 import requests
+import numpy as np
 import pandas as pd
 import sqlalchemy as sa
 from sqlalchemy.engine import Engine
@@ -23,28 +25,118 @@ DB_PASS = os.getenv('POSTGRES_PASSWORD', 'password')
 CONN_STR_TENABLE = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/tenable_source_db"
 CONN_STR_VICARIUS = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/vicarius_source_db"
 CONN_STR_INTEGRATION = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/integration_db"
+# Database written by VickyTopiaReportCLI, endpointgroups holds the Vicarius group membership
+CONN_STR_REPORTS = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{os.getenv('POSTGRES_DB', 'postgres')}"
+# Set to the mock in app/benchmarks/mock_tenable.py for offline runs
+TENABLE_API_URL = os.getenv('TENABLE_API_URL', 'https://cloud.tenable.com')
+
+# Group assignment rules, checked in priority order, the first match wins.
+# match_field is 'hostname' or 'vicarius_group' (the endpoint's Vicarius groups joined by '|')
+GROUP_RULES_DDL = """
+    CREATE TABLE IF NOT EXISTS "Integracion_Group_Rules" (
+        rule_id SERIAL PRIMARY KEY,
+        pattern TEXT NOT NULL,
+        group_name TEXT NOT NULL,
+        priority INTEGER DEFAULT 100,
+        match_field TEXT DEFAULT 'hostname',
+        is_regex BOOLEAN DEFAULT FALSE,
+        enabled BOOLEAN DEFAULT TRUE
+    );
+"""
+DEFAULT_GROUP_RULES = [
+    {'pattern': 'UNICON', 'group_name': 'UNICON', 'priority': 10, 'match_field': 'hostname', 'is_regex': False},
+    {'pattern': 'UNACEM', 'group_name': 'UNACEM', 'priority': 20, 'match_field': 'hostname', 'is_regex': False},
+    {'pattern': 'CONCREMAX', 'group_name': 'CONCREMAX', 'priority': 30, 'match_field': 'hostname', 'is_regex': False},
+    {'pattern': 'ARPL', 'group_name': 'ARPL', 'priority': 40, 'match_field': 'hostname', 'is_regex': False},
+]
+DEFAULT_GROUP = 'OTROS'
+MATCH_FIELDS = ('hostname', 'vicarius_group')
 
 def get_engine(conn_str: str) -> Engine:
     return sa.create_engine(conn_str)
 
+IPV4_PATTERN = re.compile(r'^\d{1,3}(\.\d{1,3}){3}$')
+
 def normalize_hostname(hostname):
+    # Same rule as the normalize_hostname() SQL function behind asset_identity
     if not hostname or pd.isna(hostname):
         return "UNKNOWN"
-    return str(hostname).upper().split('.')[0]
-
-def determine_group(hostname):
-    hostname = str(hostname).upper()
-    if 'UNICON' in hostname: return 'UNICON'
-    if 'UNACEM' in hostname: return 'UNACEM'
-    if 'CONCREMAX' in hostname: return 'CONCREMAX'
-    if 'ARPL' in hostname: return 'ARPL'
-    return 'OTROS'
+    hostname = str(hostname).strip()
+    if IPV4_PATTERN.match(hostname):
+        return hostname
+    return hostname.upper().split('.')[0] or "UNKNOWN"
+
+def load_asset_identity(engine):
+    """Return {(source, source_id): unified_asset_id} from the asset_identity crosswalk, empty when unavailable."""
+    try:
+        df = pd.read_sql('SELECT source, source_id, unified_asset_id FROM asset_identity WHERE unified_asset_id IS NOT NULL', engine)
+    except Exception as e:
+        logger.warning(f"asset_identity crosswalk unavailable, joining on hostname only: {e}")
+        return {}
+    return dict(zip(zip(df['source'], df['source_id']), df['unified_asset_id']))
+
+def unified_keys(df, source, id_column, identity):
+    """Join key of each row: the crosswalk identity of the asset, else its normalized hostname."""
+    fallback = df['hostname'].map(normalize_hostname)
+    return [identity.get((source, str(asset_id)), key) for asset_id, key in zip(df[id_column], fallback)]
+
+def load_group_rules(engine):
+    """Return the enabled group rules in priority order, seeding the defaults into an empty table."""
+    with engine.begin() as conn:
+        conn.execute(text(GROUP_RULES_DDL))
+        if conn.execute(text('SELECT COUNT(*) FROM "Integracion_Group_Rules"')).scalar() == 0:
+            conn.execute(text(
+                'INSERT INTO "Integracion_Group_Rules" (pattern, group_name, priority, match_field, is_regex) '
+                'VALUES (:pattern, :group_name, :priority, :match_field, :is_regex)'
+            ), DEFAULT_GROUP_RULES)
+        rows = conn.execute(text(
+            'SELECT pattern, group_name, match_field, is_regex FROM "Integracion_Group_Rules" '
+            'WHERE enabled ORDER BY priority, rule_id'
+        )).mappings().all()
+    return [dict(row) for row in rows]
+
+class GroupClassifier:
+    """Assigns a business group from the group rules.
+
+    The rules of each match field compile into one case insensitive regex, and
+    only the distinct values of a column are matched, so adding a rule does not
+    add another pass over the fact table.
+    """
+    def __init__(self, rules, default=DEFAULT_GROUP):
+        self.groups = np.array([rule['group_name'] for rule in rules] + [default], dtype=object)
+        self.no_match = len(rules)
+        self.matchers = {}
+        for field in MATCH_FIELDS:
+            positions = [i for i, rule in enumerate(rules) if rule['match_field'] == field]
+            if not positions:
+                continue
+            # Anchored alternation tries the rules in priority order rather than by match position
+            alternatives = '|'.join(
+                f".*?(?P<r{i}>{rules[i]['pattern'] if rules[i]['is_regex'] else re.escape(rules[i]['pattern'])})"
+                for i in positions
+            )
+            self.matchers[field] = (re.compile(f'^(?:{alternatives})', re.IGNORECASE | re.DOTALL), positions)
+
+    def _first_rule(self, values, regex, positions):
+        uniques = pd.Series(values.unique())
+        hits = uniques.str.extract(regex)[[f'r{i}' for i in positions]].notna().to_numpy()
+        first = np.where(hits.any(axis=1), np.array(positions)[hits.argmax(axis=1)], self.no_match)
+        return values.map(dict(zip(uniques, first))).to_numpy()
+
+    def classify(self, frame):
+        """Return the group of every row of frame, which has a column per match field."""
+        best = np.full(len(frame), self.no_match)
+        for field, (regex, positions) in self.matchers.items():
+            if field in frame.columns:
+                values = frame[field].fillna('').astype(str)
+                best = np.minimum(best, self._first_rule(values, regex, positions))
+        return pd.Series(self.groups[best], index=frame.index)
 
 class TenableIngestor:
     def __init__(self):
         self.api_key = os.getenv('TENABLE_API_KEY')
         self.secret_key = os.getenv('TENABLE_SECRET_KEY')
-        self.base_url = "https://cloud.tenable.com"
+        self.base_url = TENABLE_API_URL.rstrip('/')
         self.engine = get_engine(CONN_STR_TENABLE)
         self.headers = {
             "X-ApiKeys": f"accessKey={self.api_key};secretKey={self.secret_key}",
@@ -169,7 +261,9 @@ class VicariusIngestor:
                 'operatingSystemName': 'os',
                 'agentVersion': 'agent_version'
             })
-            df_eps['group_name'] = 'All Assets' # MVP, implement group fetching later
+            membership = self._get_group_membership()
+            # The membership is keyed by endpoint id as text, the API and the mocks return ints
+            df_eps['group_name'] = df_eps['asset_id'].astype(str).map(membership).fillna('All Assets')
             
             df_eps[['asset_id', 'hostname', 'group_name', 'os', 'agent_version']].to_sql(
                 'Vicarius_Endpoints_Raw', self.engine, if_exists='replace', index=False
@@ -213,6 +307,16 @@ class VicariusIngestor:
             logger.error(f"Vicarius Endpoint Fetch Error: {e}")
         return endpoint_list
 
+    def _get_group_membership(self):
+        """Return {endpoint_id: 'GroupA|GroupB'} from the endpointgroups table kept by the groups report."""
+        try:
+            df = pd.read_sql('SELECT endpoint_id, groupname FROM endpointgroups', get_engine(CONN_STR_REPORTS))
+        except Exception as e:
+            logger.warning(f"Vicarius group membership unavailable: {e}")
+            return {}
+        df['endpoint_id'] = df['endpoint_id'].astype(str)
+        return df.sort_values('groupname').groupby('endpoint_id')['groupname'].agg('|'.join).to_dict()
+
     def _get_incidents(self):
         incident_list = []
         try:
@@ -242,6 +346,7 @@ class DataLakehouseETL:
         self.engine_tenable = get_engine(CONN_STR_TENABLE)
         self.engine_vicarius = get_engine(CONN_STR_VICARIUS)
         self.engine_integration = get_engine(CONN_STR_INTEGRATION)
+        self.engine_reports = get_engine(CONN_STR_REPORTS)
 
     def run_full_etl(self):
         logger.info("Starting Full ETL Process...")
@@ -278,16 +383,17 @@ class DataLakehouseETL:
              df_tenable = df_tenable.assign(cve=df_tenable['cve'].str.split(',')).explode('cve')
              df_tenable['cve'] = df_tenable['cve'].str.strip()
         
-        # Normalize
+        # Normalize, assets matched in the asset_identity crosswalk share one key
+        identity = load_asset_identity(self.engine_reports)
         if not df_tenable.empty:
-            df_tenable['hostname_norm'] = df_tenable['hostname'].apply(normalize_hostname)
+            df_tenable['hostname_norm'] = unified_keys(df_tenable, 'Tenable', 'asset_uuid_fk', identity)
         else:
             df_tenable = pd.DataFrame(columns=['hostname_norm', 'cve', 'risk', 'status'])
         
         if not df_vicarius.empty:
-            df_vicarius['hostname_norm'] = df_vicarius['hostname'].apply(normalize_hostname)
+            df_vicarius['hostname_norm'] = unified_keys(df_vicarius, 'Vicarius', 'asset_id', identity)
         else:
-            df_vicarius = pd.DataFrame(columns=['hostname_norm', 'cve', 'severity', 'status'])
+            df_vicarius = pd.DataFrame(columns=['hostname_norm', 'cve', 'severity', 'status', 'group_name'])
 
         # Select key columns
         t_cols = df_tenable[['hostname_norm', 'cve', 'risk', 'status']]
@@ -305,19 +411,17 @@ class DataLakehouseETL:
             indicator=True
         )
 
-        def get_source_detection(row):
-            if row['_merge'] == 'both': return 'AMBAS'
-            if row['_merge'] == 'left_only': return 'TENABLE_ONLY'
-            if row['_merge'] == 'right_only': return 'VICARIUS_ONLY'
-            return 'UNKNOWN'
-
-        merged['source_detection'] = merged.apply(get_source_detection, axis=1)
+        source_detection = {'both': 'AMBAS', 'left_only': 'TENABLE_ONLY', 'right_only': 'VICARIUS_ONLY'}
+        merged['source_detection'] = merged['_merge'].astype(object).map(source_detection).fillna('UNKNOWN')
 
         final_df = merged.copy()
         final_df['severity'] = final_df['severity_tenable'].combine_first(final_df['severity_vicarius'])
         final_df['status'] = final_df['status_tenable'].combine_first(final_df['status_vicarius'])
         final_df = final_df.rename(columns={'hostname_norm': 'hostname', 'cve': 'cve_id'})
-        final_df['group_name'] = final_df['hostname'].apply(determine_group)
+        vicarius_groups = df_vicarius.drop_duplicates('hostname_norm').set_index('hostname_norm')['group_name']
+        final_df['vicarius_group'] = final_df['hostname'].map(vicarius_groups)
+        classifier = GroupClassifier(load_group_rules(self.engine_integration))
+        final_df['group_name'] = classifier.classify(final_df)
 
         final_df = final_df[['hostname', 'cve_id', 'severity', 'source_detection', 'status', 'group_name']]
         
@@ -0,0 +1,170 @@
+#Shared HTTP session and response cache for the API modules
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.cookiejar import DefaultCookiePolicy
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+import runmetrics
+
+# Keep-alive connections kept per host. The report worker runs several jobs in
+# one process, so the pool has to be large enough for all of them at once.
+POOL_SIZE = 10
+
+# Slow changing reference data is kept on disk and served again until its TTL runs out.
+# A call opts in with cache=<name>, the TTL of each name can be changed with HTTP_CACHE_TTL_<NAME> in seconds.
+CACHE_DIR = os.environ.get('HTTP_CACHE_DIR', '/usr/src/app/reports/http_cache')
+CACHE_MAX_BYTES = int(os.environ.get('HTTP_CACHE_MAX_MB', 256)) * 1024 * 1024
+CACHE_TTLS = {
+    'groups': 6 * 3600,
+    'group_members': 6 * 3600,
+    'app_risk': 12 * 3600,
+    'endpoint_attributes': 12 * 3600,
+    'endpoint_scores': 12 * 3600,
+}
+CACHE_TTLS.update({name: int(os.environ['HTTP_CACHE_TTL_' + name.upper()]) for name in CACHE_TTLS
+                   if os.environ.get('HTTP_CACHE_TTL_' + name.upper())})
+CACHE_READS_DEFAULT = os.environ.get('HTTP_CACHE_ENABLED', '1').lower() not in ('0', 'false', 'no')
+# Turned off per run by VickyTopiaReportCLI --no-cache, responses are still stored so the next run gets fresh ones
+cache_reads = CACHE_READS_DEFAULT
+
+_session = None
+_session_lock = threading.Lock()
+_cache_lock = threading.Lock()
+# Quota charge of the calls made on this thread, see quota()
+_quota = threading.local()
+
+def get_session():
+    """Return the process wide requests.Session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # Every call sends its own auth headers, never carry cookies from one job into another
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+@contextmanager
+def quota(charge):
+    """Calls made inside the block run charge() right before each network request, cache hits are free."""
+    previous = getattr(_quota, 'charge', None)
+    _quota.charge = charge
+    try:
+        yield
+    finally:
+        _quota.charge = previous
+
+def configure_cache(reads=True):
+    global cache_reads
+    cache_reads = reads
+
+def _cache_path(method, url, kwargs):
+    # The token is part of the key, two API keys never share a response
+    headers = {key.lower(): value for key, value in (kwargs.get('headers') or {}).items()}
+    key = json.dumps([method.upper(), url, sorted((str(k), str(v)) for k, v in (kwargs.get('params') or {}).items()),
+                      str(kwargs.get('json', kwargs.get('data'))), headers.get('vicarius-token'), headers.get('x-apikeys')])
+    return os.path.join(CACHE_DIR, hashlib.sha256(key.encode()).hexdigest() + '.gz')
+
+def _cache_load(path, ttl):
+    try:
+        with gzip.open(path, 'rb') as f:
+            meta = json.loads(f.readline())
+            if time.time() - meta['stored_at'] > ttl:
+                return None
+            content = f.read()
+        # The file time is the LRU recency, a hit moves it to the front
+        os.utime(path)
+    except (OSError, ValueError, KeyError):
+        return None
+    response = requests.Response()
+    response.status_code = meta['status']
+    response.headers = CaseInsensitiveDict(meta['headers'])
+    response.encoding = meta['encoding']
+    response.url = meta['url']
+    response._content = content
+    return response
+
+def _cache_store(path, response):
+    meta = {'stored_at': time.time(), 'status': response.status_code, 'url': response.url,
+            'encoding': response.encoding, 'headers': {'Content-Type': response.headers.get('Content-Type', '')}}
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp, 'wb', compresslevel=3) as f:
+            f.write(json.dumps(meta).encode() + b'\n')
+            f.write(response.content)
+        os.replace(tmp, path)
+        _cache_evict()
+    except OSError as e:
+        print(f"Response not cached: {e}")
+
+def _cache_evict():
+    # Least recently used files go first once the directory is over CACHE_MAX_BYTES
+    with _cache_lock:
+        files = []
+        for entry in os.scandir(CACHE_DIR):
+            if entry.name.endswith('.gz'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= CACHE_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+def request(method, url, cache=None, **kwargs):
+    """requests.request through the shared session. cache names a CACHE_TTLS entry to serve the call from disk while fresh."""
+    if cache and not kwargs.get('stream'):
+        path = _cache_path(method, url, kwargs)
+        response = _cache_load(path, CACHE_TTLS[cache]) if cache_reads else None
+        if response is None:
+            response = _fetch(method, url, **kwargs)
+            if response.status_code == 200:
+                _cache_store(path, response)
+        return response
+    return _fetch(method, url, **kwargs)
+
+def _fetch(method, url, **kwargs):
+    # The same call right after a failure counts as a retry in the run metrics
+    key = (method, url, str(kwargs.get('params')), str(kwargs.get('json', kwargs.get('data'))))
+    path = runmetrics.api_path(url)
+    charge = getattr(_quota, 'charge', None)
+    if charge is not None:
+        charge()
+    start = time.perf_counter()
+    try:
+        response = get_session().request(method, url, **kwargs)
+    except requests.RequestException:
+        runmetrics.record_request(key, failed=True, path=path, seconds=time.perf_counter() - start)
+        raise
+    seconds = time.perf_counter() - start
+    if kwargs.get('stream'):
+        # Reading content here would defeat streaming, the declared length is counted instead
+        size = int(response.headers.get('Content-Length') or 0)
+    else:
+        size = len(response.content)
+    runmetrics.record_request(key, response.status_code, size, path=path, seconds=seconds)
+    return response
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
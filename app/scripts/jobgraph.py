@@ -0,0 +1,176 @@
+#Dependency-aware runner for the scheduled report jobs
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+CLI_PATH = '/usr/src/app/scripts/VickyTopiaReportCLI.py'
+JOB_HISTORY_PATH = '/usr/src/app/reports/job_history.json'
+
+# How many report jobs may run at the same time. They all share one API key
+# and draw from the same quota ledger (ratelimit.py).
+MAX_PARALLEL_JOBS = int(os.environ.get('MAX_PARALLEL_JOBS', 3))
+
+# Durations kept per job and the estimate used before a job has any history
+HISTORY_SIZE = 10
+DEFAULT_DURATION = 600
+
+# Report DAG: setup -> endpoints -> groups -> vulns/patches, the other reports only need setup.
+# setup creates the database on a fresh install, as --refreshTables did before the graph.
+# 'after' lists the jobs that must finish successfully before the job can start.
+# --resume only skips work when the previous run was interrupted, a finished run clears its checkpoint.
+REPORT_JOBS = {
+    'setup': {'flags': ['--setup'], 'after': []},
+    'endpoints': {'flags': ['--endpointsreport'], 'after': ['setup']},
+    'groups': {'flags': ['--groupsreport'], 'after': ['endpoints']},
+    'vulnerabilities': {'flags': ['--vulnerabilitiesreport', '--resume'], 'after': ['groups']},
+    'patches': {'flags': ['--patchsreport', '--resume'], 'after': ['groups']},
+    'hasPatchApps': {'flags': ['--hasPatchAppsreport'], 'after': ['setup']},
+    'tasks': {'flags': ['--taskreport'], 'after': ['setup']},
+    'tasksWaiting': {'flags': ['--taskWaiting'], 'after': ['tasks']},
+    'incidents': {'flags': ['--incidentvulnerability'], 'after': ['setup']},
+}
+
+def load_history(path=JOB_HISTORY_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+def save_history(history, path=JOB_HISTORY_PATH):
+    tmppath = path + '.tmp'
+    with open(tmppath, 'w') as f:
+        f.write(json.dumps(history, indent=2))
+    os.replace(tmppath, path)
+
+def run_cli_job(name, job):
+    """Run one report job as a VickyTopiaReportCLI.py process, raising on a non zero exit."""
+    subprocess.run(['python3', CLI_PATH] + job['flags'], check=True, cwd='/usr/src/app')
+
+class JobGraph:
+    def __init__(self, jobs=None, runner=None, max_parallel=MAX_PARALLEL_JOBS, history_path=JOB_HISTORY_PATH):
+        self.jobs = jobs if jobs is not None else REPORT_JOBS
+        self.runner = runner if runner is not None else run_cli_job
+        self.max_parallel = max(1, int(max_parallel))
+        self.history_path = history_path
+        self.history = load_history(history_path)
+        self.lock = threading.Lock()
+        self.order = self.validate()
+
+    def validate(self):
+        """Return the jobs in dependency order, raising ValueError on unknown jobs or cycles."""
+        for name, job in self.jobs.items():
+            for dep in job['after']:
+                if dep not in self.jobs:
+                    raise ValueError(f"Job {name} depends on unknown job {dep}")
+        order = []
+        done = set()
+        remaining = dict(self.jobs)
+        while remaining:
+            ready = [name for name, job in remaining.items() if all(dep in done for dep in job['after'])]
+            if not ready:
+                raise ValueError(f"Dependency cycle between jobs: {sorted(remaining)}")
+            for name in ready:
+                order.append(name)
+                done.add(name)
+                del remaining[name]
+        return order
+
+    def dependents(self, name):
+        return [child for child, job in self.jobs.items() if name in job['after']]
+
+    def expected_duration(self, name):
+        durations = sorted(self.history.get(name, []))
+        if not durations:
+            return DEFAULT_DURATION
+        return durations[len(durations) // 2]
+
+    def critical_path(self, name, memo=None):
+        """Expected time from the start of a job until all of its dependents have finished."""
+        if memo is None:
+            memo = {}
+        if name not in memo:
+            tail = [self.critical_path(child, memo) for child in self.dependents(name)]
+            memo[name] = self.expected_duration(name) + max(tail, default=0)
+        return memo[name]
+
+    def plan(self):
+        """Expected wall time of a full run, assuming enough parallel slots for every branch."""
+        memo = {}
+        roots = [name for name, job in self.jobs.items() if not job['after']]
+        return max((self.critical_path(name, memo) for name in roots), default=0)
+
+    def record_duration(self, name, seconds):
+        with self.lock:
+            durations = self.history.get(name, [])
+            durations.append(round(seconds, 1))
+            self.history[name] = durations[-HISTORY_SIZE:]
+            try:
+                save_history(self.history, self.history_path)
+            except IOError as e:
+                logger.error(f"Unable to save job history: {e}")
+
+    def _run_job(self, name):
+        start = time.monotonic()
+        logger.info(f"Starting job {name} " + str(datetime.now()))
+        try:
+            self.runner(name, self.jobs[name])
+        finally:
+            elapsed = time.monotonic() - start
+            self.record_duration(name, elapsed)
+            logger.info(f"Finished job {name} in {elapsed:.1f}s " + str(datetime.now()))
+
+    def run(self):
+        """Run every job once, starting a job as soon as its dependencies are done.
+
+        Ready jobs are started longest critical path first, so the long
+        endpoints -> groups -> vulnerabilities chain is never queued behind short
+        independent jobs. A failed job skips all of its dependents.
+        Returns a dict of job name -> 'ok', 'failed' or 'skipped'.
+        """
+        memo = {}
+        waiting = {name: set(job['after']) for name, job in self.jobs.items()}
+        results = {}
+        running = {}
+        logger.info(f"Running {len(self.jobs)} jobs, expected duration {self.plan():.0f}s")
+
+        with ThreadPoolExecutor(max_workers=self.max_parallel) as executor:
+            while waiting or running:
+                ready = [name for name, deps in waiting.items() if not deps]
+                ready.sort(key=lambda name: self.critical_path(name, memo), reverse=True)
+                for name in ready[:self.max_parallel - len(running)]:
+                    del waiting[name]
+                    running[executor.submit(self._run_job, name)] = name
+
+                if not running:
+                    break
+
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                        results[name] = 'ok'
+                        for deps in waiting.values():
+                            deps.discard(name)
+                    except Exception as e:
+                        logger.error(f"Job {name} failed: {e}")
+                        results[name] = 'failed'
+                        self._skip_dependents(name, waiting, results)
+
+        return results
+
+    def _skip_dependents(self, name, waiting, results):
+        for child in self.dependents(name):
+            if child in waiting:
+                del waiting[child]
+                results[child] = 'skipped'
+                logger.warning(f"Skipping job {child}: dependency {name} failed")
+                self._skip_dependents(child, waiting, results)
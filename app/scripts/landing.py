@@ -0,0 +1,134 @@
+#Landing zone of raw API pages, replayed by VickyTopiaReportCLI --rebuild-from-landing
+import glob
+import gzip
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+
+LANDING_DIR = os.environ.get('LANDING_DIR', '/usr/src/app/reports/landing')
+LANDING_ENABLED = os.environ.get('LANDING_ENABLED', '').lower() in ('1', 'true', 'yes')
+
+# Set per run by configure(), pages are only written while enabled
+enabled = LANDING_ENABLED
+directory = LANDING_DIR
+
+_arrow = None
+_arrow_lock = threading.Lock()
+
+def configure(enable=None, path=None):
+    global enabled, directory
+    enabled = LANDING_ENABLED if enable is None else bool(enable)
+    directory = path or LANDING_DIR
+
+def arrow():
+    """(pyarrow, pyarrow.parquet), None when pyarrow is missing and pages are landed as gzip json lines.
+
+    pyarrow is in requirements.txt, the json lines are the fallback of installs without it.
+    """
+    global _arrow
+    if _arrow is None:
+        with _arrow_lock:
+            if _arrow is None:
+                try:
+                    import pyarrow
+                    import pyarrow.parquet
+                    _arrow = (pyarrow, pyarrow.parquet)
+                except ImportError:
+                    _arrow = False
+    return _arrow or None
+
+def partition(stream, day, root=None):
+    # Hive style stream=/date= directories, readable as one dataset by pyarrow or duckdb
+    return os.path.join(root or directory, f"stream={stream}", f"date={day}")
+
+def write_page(stream, page, context=None):
+    """Land one API page of stream, one row per document. context holds what the parser and the rebuild need.
+
+    A failure is printed and never stops the sync. Returns the file written, or None.
+    """
+    if not enabled or not page:
+        return None
+    docs = page.get('serverResponseObject') or []
+    if not docs:
+        return None
+    try:
+        now = datetime.now()
+        folder = partition(stream, now.strftime('%Y-%m-%d'))
+        os.makedirs(folder, exist_ok=True)
+        # Names sort in fetch order within a day
+        name = os.path.join(folder, f"{now.strftime('%H%M%S%f')}_{uuid.uuid4().hex[:8]}")
+        context = json.dumps(context or {}, default=str)
+        modules = arrow()
+        if modules:
+            path = name + '.parquet'
+            _write_parquet(modules, path + '.tmp', now, context, docs)
+        else:
+            documents = [json.dumps(doc, separators=(',', ':')) for doc in docs]
+            path = name + '.jsonl.gz'
+            with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as f:
+                for document in documents:
+                    f.write(json.dumps({'fetched_at': now.isoformat(), 'context': context, 'document': document}) + '\n')
+        os.replace(path + '.tmp', path)
+        return path
+    except Exception as e:
+        print(f"Page of {stream} was not landed: {e}")
+        return None
+
+# Columns every landed file has, document is the raw JSON the rebuild replays
+LANDING_COLUMNS = ('fetched_at', 'context', 'document')
+
+def _write_parquet(modules, path, now, context, docs):
+    # The replay reads the document column only, so a page comes back exactly as the API sent it.
+    # The top level fields are added as typed columns for analytics, each typed from the values
+    # of every document of the page, a missing key is null. A field pyarrow cannot type (mixed
+    # types, an empty object) is left out, it is still in the document column.
+    pa, pq = modules
+    columns = {
+        'fetched_at': pa.array([now] * len(docs), pa.timestamp('us')),
+        'context': pa.array([context] * len(docs), pa.string()).dictionary_encode(),
+        'document': pa.array([json.dumps(doc, separators=(',', ':')) for doc in docs], pa.string()),
+    }
+    fields = dict.fromkeys(key for doc in docs for key in doc)
+    for field in fields:
+        if field in LANDING_COLUMNS:
+            continue
+        try:
+            columns[field] = pa.array([doc.get(field) for doc in docs])
+        except (pa.ArrowException, ValueError, TypeError):
+            continue
+    pq.write_table(pa.table(columns), path, compression='zstd')
+
+def landed_files(stream, root=None):
+    """Landed files of stream in fetch order."""
+    files = glob.glob(os.path.join(partition(stream, '*', root), '*.parquet'))
+    files += glob.glob(os.path.join(partition(stream, '*', root), '*.jsonl.gz'))
+    return sorted(files, key=lambda path: (os.path.basename(os.path.dirname(path)), os.path.basename(path)))
+
+def _parquet(path):
+    modules = arrow()
+    if not modules:
+        raise RuntimeError(f"pyarrow is needed to read {path}")
+    return modules[1]
+
+def read_page(path):
+    """(context, documents) of one landed file, the documents as the API returned them."""
+    if path.endswith('.parquet'):
+        table = _parquet(path).read_table(path, columns=['context', 'document'])
+        contexts = table.column('context').to_pylist()
+        documents = table.column('document').to_pylist()
+    else:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f]
+        contexts = [row['context'] for row in rows]
+        documents = [row['document'] for row in rows]
+    return (json.loads(contexts[0]) if contexts else {}), [json.loads(document) for document in documents]
+
+def iter_pages(stream, root=None):
+    """Yield (context, page) for every landed page of stream, oldest first, pages look like the API responses."""
+    for path in landed_files(stream, root):
+        context, docs = read_page(path)
+        if not docs:
+            continue
+        yield context, {'serverResponseCount': len(docs), 'serverResponseObject': docs}
@@ -1,11 +1,12 @@
 import logging
 import subprocess
 import time
-from threading import Lock
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from datetime import datetime
 import gc 
+import jobgraph
+import reportWorker
 
 
 # Configure logging to log to a file
@@ -18,9 +19,6 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-# Create a global lock to ensure only one job runs at a time
-job_lock = Lock()
-
 # Define the jobs to run external Python scripts
 def run_script(script_path):
     try:
@@ -35,63 +33,46 @@ def run_script(script_path):
         logger.info(f"Finished execution of {script_path}")
     gc.collect()
 
-def run_bash_script(script_path):
+# Run every report once, independent branches of the report DAG in parallel
+def run_reports():
+    print("launching report graph " + str(datetime.now()))
     try:
-        logger.info(f"Starting execution of {script_path} " + str(datetime.now()))
-        # Run the external bash script using subprocess
-        subprocess.run(['bash', script_path], check=True)
-        logger.info(f"Successfully executed {script_path} at: {datetime.now()}")
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Error executing {script_path}: {e} "  + str(datetime.now()))
+        graph = jobgraph.JobGraph(runner=reportWorker.run_graph_job)
+        results = graph.run()
+        logger.info(f"Report graph finished: {results} " + str(datetime.now()))
     except Exception as e:
-        logger.error(f"Unexpected error: {e} "  + str(datetime.now()))
-    finally:
-        logger.info(f"Finished execution of {script_path} "  + str(datetime.now()))
-# Job 1: Run a specific Python script
-def job1():
-    with job_lock:
-        print("launcing job 1" + str(datetime.now()))
-        script_path = "/usr/src/app/scripts/refreshTables.sh"  # Update with your script's path
-  # Update with your script's path
-        run_bash_script(script_path)
-        print("sleeping" + str(datetime.now()))
-# Job 2: Run another Python script
-def job2():
-    with job_lock:
-        print("launcing job 2 " + str(datetime.now()))
-        script_path = "/usr/src/app/scripts/activeVulnsSync.sh"  # Update with your script's path
-        run_bash_script(script_path)
-        print("sleeping" + str(datetime.now()))
-# Job 3: Run another Python script
-def job3():
-    with job_lock:
-        print("launcing job 3" + str(datetime.now()))
-        script_path = "/usr/src/app/scripts/difTables.sh"  # Update with your script's path
-        run_bash_script(script_path)
-        print("sleeping" + str(datetime.now()))
+        logger.error(f"Unexpected error: {e} " + str(datetime.now()))
+    print("sleeping" + str(datetime.now()))
+    gc.collect()
+
+# The report worker forks its jobs from a fork server that imports this file as __mp_main__
+if __name__ == '__main__':
+    # Start the report worker, the scheduled reports and the web buttons all run their jobs through it
+    worker = reportWorker.ReportWorker()
+    worker.start()
+    logger.info("Report worker started " + str(datetime.now()))
 
-# Create a scheduler
-scheduler = BackgroundScheduler()
+    # Create a scheduler
+    scheduler = BackgroundScheduler()
 
-# Add jobs to the scheduler
-scheduler.add_job(job1, trigger=IntervalTrigger(hours=4))  # Runs every 10 seconds
-scheduler.add_job(job2, trigger=IntervalTrigger(hours=4))   # Runs every 1 minute
-scheduler.add_job(job3, trigger=IntervalTrigger(hours=4))   # Runs every 1 minute
-# Start the scheduler
-print("starting Scheduler: " + str(datetime.now()))
-scheduler.start()
-logger.info("Scheduler started" +  str(datetime.now()))
+    # Add the report graph to the scheduler, a run that overruns its slot is not started twice
+    scheduler.add_job(run_reports, trigger=IntervalTrigger(hours=4), max_instances=1, coalesce=True)
+    # Start the scheduler
+    print("starting Scheduler: " + str(datetime.now()))
+    scheduler.start()
+    logger.info("Scheduler started" +  str(datetime.now()))
+
+    try:
+        # Keep the script running
+        while True:
+            print("Running Script: " +  str(datetime.now()))
+            logger.info("Running Script:" +  str(datetime.now()))
+            gc.collect()
+            time.sleep(3600)
 
-try:
-    # Keep the script running
-    while True:
-        print("Running Script: " +  str(datetime.now()))
-        logger.info("Running Script:" +  str(datetime.now()))
-        gc.collect()
-        time.sleep(3600)
-        
-except (KeyboardInterrupt, SystemExit):
-    # Shut down the scheduler when exiting
-    scheduler.shutdown()
-    print("Scheduler shut down: " +  str(datetime.now()))
-    logger.info("Scheduler shut down" +  str(datetime.now()))
+    except (KeyboardInterrupt, SystemExit):
+        # Shut down the scheduler when exiting
+        scheduler.shutdown()
+        worker.stop()
+        print("Scheduler shut down: " +  str(datetime.now()))
+        logger.info("Scheduler shut down" +  str(datetime.now()))
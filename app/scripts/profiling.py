@@ -0,0 +1,176 @@
+#Profiling of the report stages for VickyTopiaReportCLI --profile
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/var/log/vickytopia')
+# Functions and allocation sites listed in the summary of every stage
+PROFILE_TOP_N = int(os.environ.get('PROFILE_TOP_N', 30))
+# Seconds between two stack samples, low enough to leave the sampler on in production
+SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.02))
+
+# tracemalloc is process wide, it is stopped when the last full profile using it ends
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_tracing_started = False
+
+class StackSampler:
+    """Samples the Python stack of every thread from a background thread.
+
+    Stacks are kept folded, root first and one frame per ';', the input format of
+    flamegraph.pl and speedscope. The thread name is the root frame.
+    """
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def _sample(self):
+        me = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.stacks[';'.join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def write(self, prefix, top=PROFILE_TOP_N):
+        with open(prefix + '.folded', 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')[1:]
+            if frames:
+                own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        with open(prefix + '.txt', 'w') as f:
+            f.write(f"{self.samples} samples every {self.interval} s, counts are summed over threads\n\n")
+            f.write("Top functions by own samples\n")
+            for frame, count in own.most_common(top):
+                f.write(f"{count:10} {frame}\n")
+            f.write("\nTop functions by inclusive samples\n")
+            for frame, count in total.most_common(top):
+                f.write(f"{count:10} {frame}\n")
+
+class Profiler:
+    """Writes a profile per report stage into directory.
+
+    mode 'full' runs cProfile on the stage thread, tracemalloc on the whole process and the
+    StackSampler for the pool threads cProfile does not see. It writes <stage>.pstats and
+    a .txt summary of the hottest functions and allocation sites, plus <stage>_threads.folded.
+    mode 'sample' runs the StackSampler over every thread and writes <stage>.folded plus a .txt summary.
+    A stage started inside a profiled stage on the same thread is part of the outer profile.
+    """
+    def __init__(self, mode='full', directory=PROFILE_DIR, run_id=None, top=PROFILE_TOP_N, interval=SAMPLE_INTERVAL):
+        if mode not in ('full', 'sample'):
+            raise ValueError(f"Unknown profile mode {mode}")
+        self.mode = mode
+        self.directory = directory
+        self.run_id = run_id
+        self.top = top
+        self.interval = interval
+        self.local = threading.local()
+        os.makedirs(directory, exist_ok=True)
+
+    def _prefix(self, name):
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        run = f"_{self.run_id[:8]}" if self.run_id else ''
+        return os.path.join(self.directory, f"{stamp}{run}_{name}")
+
+    @contextmanager
+    def stage(self, name):
+        if getattr(self.local, 'active', False):
+            yield
+            return
+        self.local.active = True
+        prefix = self._prefix(name)
+        try:
+            if self.mode == 'sample':
+                with self._sampled(prefix):
+                    yield
+            else:
+                with self._full(prefix):
+                    yield
+        finally:
+            self.local.active = False
+
+    @contextmanager
+    def _sampled(self, prefix):
+        sampler = StackSampler(self.interval)
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            sampler.write(prefix, self.top)
+            print(f"Profile written to {prefix}.folded")
+
+    @contextmanager
+    def _full(self, prefix):
+        global _tracing_users, _tracing_started
+        with _tracing_lock:
+            if _tracing_users == 0:
+                _tracing_started = not tracemalloc.is_tracing()
+                if _tracing_started:
+                    tracemalloc.start()
+            _tracing_users += 1
+        tracemalloc.reset_peak()
+        # cProfile only follows this thread, the parsers run in pool threads
+        sampler = StackSampler(self.interval)
+        sampler.start()
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            sampler.stop()
+            with _tracing_lock:
+                snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+                current, peak = tracemalloc.get_traced_memory()
+                _tracing_users -= 1
+                if _tracing_users == 0 and _tracing_started:
+                    tracemalloc.stop()
+            profile.dump_stats(prefix + '.pstats')
+            sampler.write(prefix + '_threads', self.top)
+            with open(prefix + '.txt', 'w') as f:
+                stats = pstats.Stats(profile, stream=f)
+                stats.strip_dirs()
+                f.write("Top functions by own time\n")
+                stats.sort_stats('tottime').print_stats(self.top)
+                f.write("Top functions by cumulative time\n")
+                stats.sort_stats('cumulative').print_stats(self.top)
+                f.write(f"Traced memory: {current / 1048576:.1f} MB still allocated, {peak / 1048576:.1f} MB peak\n\n")
+                if snapshot is not None:
+                    f.write("Top allocation sites still holding memory at the end of the stage\n")
+                    for statistic in snapshot.statistics('lineno')[:self.top]:
+                        f.write(f"{statistic}\n")
+            print(f"Profile written to {prefix}.pstats")
@@ -0,0 +1,118 @@
+#Shared API quota for every process and thread that calls the Vicarius API
+import fcntl
+import json
+import os
+import time
+
+import runmetrics
+
+# Overall budget of the API key, shared by the scheduler, cron entries and web triggered jobs
+QUOTA_PER_MINUTE = int(os.environ.get('API_QUOTA_PER_MINUTE', 55))
+# Tokens that can be saved up while nobody is querying
+QUOTA_BURST = int(os.environ.get('API_QUOTA_BURST', 5))
+# 'postgres' keeps the ledger in the api_quota table, 'file' in QUOTA_FILE
+QUOTA_BACKEND = os.environ.get('API_QUOTA_BACKEND', 'postgres')
+QUOTA_FILE = '/usr/src/app/reports/api_quota.json'
+
+def take_tokens(tokens, updated_at, now, cost, per_minute, burst):
+    """Token bucket step, returns (tokens left, seconds to wait).
+
+    Tokens may go negative: the caller reserves its slot right away and sleeps
+    outside the lock, the next caller queues behind it.
+    """
+    rate = per_minute / 60.0
+    tokens = min(burst, tokens + max(0, now - updated_at) * rate) - cost
+    wait = max(0, -tokens / rate)
+    return tokens, wait
+
+class QuotaLedger:
+    def __init__(self, name='vicarius', db_params=None, per_minute=QUOTA_PER_MINUTE, burst=QUOTA_BURST,
+                 backend=QUOTA_BACKEND, path=QUOTA_FILE):
+        self.name = name
+        self.db_params = db_params
+        self.per_minute = per_minute
+        self.burst = burst
+        self.backend = backend if db_params else 'file'
+        self.path = path
+        self.table_ready = False
+        self.degraded = False
+
+    def acquire(self, cost=1.0):
+        """Take cost tokens from the shared ledger, sleeping until they are available. Returns the seconds waited."""
+        wait = self._reserve(cost)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def _reserve(self, cost):
+        # A failed Postgres reservation falls back to the file for that call only, the next
+        # call tries Postgres again so the process goes back to the budget the others share
+        if self.backend == 'postgres':
+            try:
+                wait = self._reserve_postgres(cost)
+                if self.degraded:
+                    print("API quota ledger back in Postgres")
+                    self.degraded = False
+                return wait
+            except Exception as e:
+                if not self.degraded:
+                    print(f"API quota ledger unavailable in Postgres, using {self.path}: {e}")
+                    self.degraded = True
+        return self._reserve_file(cost)
+
+    def _reserve_postgres(self, cost):
+        import DatabaseConnector as db
+        conn = db.get_connection(self.db_params)
+        try:
+            with conn:
+                cur = conn.cursor()
+                if not self.table_ready:
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS api_quota (
+                            name TEXT PRIMARY KEY,
+                            tokens DOUBLE PRECISION NOT NULL,
+                            updated_at DOUBLE PRECISION NOT NULL
+                        );
+                    """)
+                # The advisory lock serializes every reservation on this quota across processes,
+                # the database clock is used so containers with skewed clocks agree
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", ('api_quota:' + self.name,))
+                cur.execute("SELECT extract(epoch from clock_timestamp())::double precision;")
+                now = cur.fetchone()[0]
+                cur.execute("SELECT tokens, updated_at FROM api_quota WHERE name = %s;", (self.name,))
+                row = cur.fetchone()
+                tokens, updated_at = row if row else (self.burst, now)
+                tokens, wait = take_tokens(tokens, updated_at, now, cost, self.per_minute, self.burst)
+                runmetrics.set_gauge('api_quota_tokens', tokens, quota=self.name)
+                cur.execute("""
+                    INSERT INTO api_quota (name, tokens, updated_at) VALUES (%s, %s, %s)
+                    ON CONFLICT (name) DO UPDATE SET tokens = EXCLUDED.tokens, updated_at = EXCLUDED.updated_at;
+                """, (self.name, tokens, now))
+                cur.close()
+            self.table_ready = True
+            return wait
+        finally:
+            conn.close()
+
+    def _reserve_file(self, cost):
+        # flock is held per open file, so threads of one process are serialized as well
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    ledger = json.loads(f.read() or '{}')
+                except ValueError:
+                    ledger = {}
+                now = time.time()
+                tokens, updated_at = ledger.get(self.name, (self.burst, now))
+                tokens, wait = take_tokens(tokens, updated_at, now, cost, self.per_minute, self.burst)
+                runmetrics.set_gauge('api_quota_tokens', tokens, quota=self.name)
+                ledger[self.name] = (tokens, now)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(ledger))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return wait
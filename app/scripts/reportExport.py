@@ -0,0 +1,40 @@
+#Streams reporting tables and views to gzip csv files with COPY ... TO STDOUT
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import DatabaseConnector as db
+
+EXPORT_DIR = '/usr/src/app/reports/exports'
+# Each export holds one pooled connection while it runs
+EXPORT_WORKERS = int(os.environ.get('REPORT_EXPORT_WORKERS', 4))
+
+# Exported when no relation is named, in place of the old string built csv reports
+DEFAULT_EXPORTS = ['endpoints', 'endpointgroups', 'activevulnerabilities', 'assetspatchs', 'apps',
+                   'tasks', 'incident', 'mitigation_time', 'unified_assets_view']
+
+def export_reports(db_params, relations=None, directory=EXPORT_DIR, workers=EXPORT_WORKERS):
+    """Export each table or view to <directory>/<name>.csv.gz, several at a time.
+
+    Relations that do not exist are skipped. Returns {name: rows or error string}.
+    """
+    os.makedirs(directory, exist_ok=True)
+    existing = db.list_relations(db_params)
+    requested = relations or DEFAULT_EXPORTS
+    missing = [name for name in requested if name not in existing]
+    for name in missing:
+        print(f"Export skipped, {name} is not a table or view")
+    names = [name for name in requested if name in existing]
+
+    def export(name):
+        path = os.path.join(directory, name + '.csv.gz')
+        try:
+            rows = db.export_relation_csv_gz(db_params, name, path)
+            print(f"Exported {rows} rows of {name} to {path}")
+            return rows
+        except Exception as e:
+            print(f"Export of {name} failed: {e}")
+            return str(e)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = dict(zip(names, pool.map(export, names)))
+    return results
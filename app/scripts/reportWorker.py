@@ -0,0 +1,299 @@
+#Long lived worker that runs VickyTopiaReportCLI jobs in warm child processes
+import hmac
+import itertools
+import json
+import logging
+import multiprocessing
+import multiprocessing.forkserver
+import os
+import queue
+import threading
+import traceback
+import urllib.request
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jobgraph
+import runmetrics
+
+logger = logging.getLogger(__name__)
+
+# Local only by default. docker-compose.yml sets REPORT_WORKER_HOST=0.0.0.0 and REPORT_WORKER_TOKEN
+# so the webapp container reaches it on vicarius-network (http://app:8765) with the same token.
+WORKER_HOST = os.environ.get('REPORT_WORKER_HOST', '127.0.0.1')
+WORKER_PORT = int(os.environ.get('REPORT_WORKER_PORT', 8765))
+WORKER_URL = os.environ.get('REPORT_WORKER_URL', f'http://127.0.0.1:{WORKER_PORT}')
+# Prometheus scrape of GET /metrics, on its own listener that stays on localhost
+METRICS_HOST = os.environ.get('REPORT_METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('REPORT_METRICS_PORT', 8766))
+# Shared secret of POST /jobs, sent in the X-Worker-Token header, not checked when empty.
+# Required whenever the worker listens on more than the loopback interface.
+WORKER_TOKEN = os.environ.get('REPORT_WORKER_TOKEN', '')
+LOOPBACK_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+# Jobs submitted from the web buttons run one at a time, next to the scheduled report graph
+WORKER_THREADS = int(os.environ.get('REPORT_WORKER_THREADS', 1))
+
+# Jobs of the web buttons that are not part of the report graph
+WEB_JOBS = {
+    'allreports': ['--allreports'],
+    'assets': ['--assetsreport'],
+    'metabaseTemplate': ['--metabaseTempalateReplace'],
+    'createMBUser': ['--createMBUser'],
+}
+# POST /jobs only starts these, by name, never a command line sent by the client
+JOBS = dict({name: job['flags'] for name, job in jobgraph.REPORT_JOBS.items()}, **WEB_JOBS)
+
+# Finished jobs kept for GET /jobs/<id>
+JOB_HISTORY_SIZE = 200
+
+# Seconds between two run metrics updates sent by a running job
+METRICS_PUSH_SECONDS = 15
+
+# CLI runs started by this process, scheduled graph jobs and web jobs alike
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+_context = None
+_context_lock = threading.Lock()
+
+def job_context():
+    """multiprocessing context whose fork server has the CLI and its API and DB modules imported.
+
+    Every job is forked from that server, it starts warm and gets its own copy of the
+    CLI module state, the run state, --land, --no-cache and --profile of one job
+    never reach another job running at the same time.
+    """
+    global _context
+    with _context_lock:
+        if _context is None:
+            import VickyTopiaReportCLI as cli
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['VickyTopiaReportCLI'] + [module.module_name for module in cli.LAZY_MODULES])
+            _context = context
+    return _context
+
+def set_pool_gauges():
+    # The DB pools live in the job processes, their gauges reach /metrics with a pid label
+    import DatabaseConnector as db
+    pools = {}
+    for pool in db.pool_stats():
+        totals = pools.setdefault(pool['database'], dict.fromkeys(('in_use', 'idle', 'waiting', 'max'), 0))
+        for key in totals:
+            totals[key] += pool[key]
+    for database, totals in pools.items():
+        for key, value in totals.items():
+            runmetrics.set_gauge('db_pool_connections', value, database=database, state=key)
+
+def _run_job_process(flags, conn):
+    # Body of the job process, conn gets the run metrics every METRICS_PUSH_SECONDS and at the end
+    import VickyTopiaReportCLI as cli
+    stop = threading.Event()
+
+    def push():
+        while not stop.wait(METRICS_PUSH_SECONDS):
+            set_pool_gauges()
+            conn.send(runmetrics.state())
+
+    pusher = threading.Thread(target=push, name='metrics-push', daemon=True)
+    pusher.start()
+    try:
+        cli.main(flags)
+    finally:
+        stop.set()
+        pusher.join()
+        set_pool_gauges()
+        conn.send(runmetrics.state())
+        conn.close()
+
+def run_cli(flags):
+    """Run VickyTopiaReportCLI.main() with the given flags in a process forked from the warm fork server.
+
+    The run metrics of the job are merged into this process while it runs, for GET /metrics.
+    Raises RuntimeError when the CLI exits with a non zero status.
+    """
+    global _in_flight
+    context = job_context()
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_run_job_process, args=(list(flags), sender), daemon=True)
+    with _in_flight_lock:
+        _in_flight += 1
+    try:
+        process.start()
+        sender.close()
+        previous = None
+        while True:
+            try:
+                current = receiver.recv()
+            except EOFError:
+                break
+            runmetrics.merge(process.pid, current, previous)
+            previous = current
+        process.join()
+    finally:
+        receiver.close()
+        runmetrics.forget(process.pid)
+        with _in_flight_lock:
+            _in_flight -= 1
+    if process.exitcode != 0:
+        raise RuntimeError(f"VickyTopiaReportCLI {' '.join(flags)} exited with {process.exitcode}")
+
+def run_graph_job(name, job):
+    """JobGraph runner for the report worker."""
+    run_cli(job['flags'])
+
+class ReportWorker:
+    def __init__(self, threads=WORKER_THREADS):
+        self.threads = max(1, int(threads))
+        self.queue = queue.Queue()
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.server = None
+        self.metrics_server = None
+
+    def submit(self, name):
+        """Queue the job name of JOBS and return its job id, ValueError for any other name."""
+        if not isinstance(name, str) or name not in JOBS:
+            raise ValueError(f"Unknown job {name}")
+        flags = list(JOBS[name])
+        with self.lock:
+            job_id = next(self.ids)
+            self.jobs[job_id] = {'id': job_id, 'job': name, 'flags': flags, 'status': 'queued',
+                                 'queued': str(datetime.now()), 'started': None, 'finished': None, 'error': None}
+            for old_id in sorted(self.jobs)[:-JOB_HISTORY_SIZE]:
+                if self.jobs[old_id]['status'] not in ('queued', 'running'):
+                    del self.jobs[old_id]
+        self.queue.put(job_id)
+        logger.info(f"Queued job {job_id}: {name} {flags}")
+        return job_id
+
+    def status(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def metrics(self):
+        """Prometheus text of the run metrics of this worker and its running jobs plus the job gauges."""
+        runmetrics.set_gauge('jobs_in_flight', _in_flight)
+        runmetrics.set_gauge('worker_queue_depth', self.queue.qsize())
+        return runmetrics.exposition()
+
+    def _update(self, job_id, **values):
+        with self.lock:
+            self.jobs[job_id].update(values)
+
+    def _loop(self):
+        while True:
+            job_id = self.queue.get()
+            flags = self.jobs[job_id]['flags']
+            self._update(job_id, status='running', started=str(datetime.now()))
+            logger.info(f"Starting job {job_id}: {flags}")
+            # A failing job is logged and recorded, the worker keeps serving the next ones
+            try:
+                run_cli(flags)
+                self._update(job_id, status='ok', finished=str(datetime.now()))
+                logger.info(f"Finished job {job_id}")
+            except Exception as e:
+                self._update(job_id, status='failed', finished=str(datetime.now()), error=str(e))
+                logger.error(f"Job {job_id} failed: {e}\n{traceback.format_exc()}")
+            finally:
+                self.queue.task_done()
+
+    def start(self, host=WORKER_HOST, port=WORKER_PORT, metrics_host=METRICS_HOST, metrics_port=METRICS_PORT):
+        """Start the job threads, the HTTP listener used by the Django and Flask apps and the metrics listener."""
+        if host not in LOOPBACK_HOSTS and not WORKER_TOKEN:
+            raise RuntimeError(f"REPORT_WORKER_TOKEN must be set to listen on {host}, "
+                               "every client on the network could start jobs otherwise")
+        # Start the fork server before the first job comes in, it imports the modules every job uses
+        job_context()
+        multiprocessing.forkserver.ensure_running()
+        for i in range(self.threads):
+            threading.Thread(target=self._loop, name=f'report-worker-{i}', daemon=True).start()
+        self.server = ThreadingHTTPServer((host, port), make_handler(self))
+        threading.Thread(target=self.server.serve_forever, name='report-worker-http', daemon=True).start()
+        logger.info(f"Report worker listening on {host}:{port}")
+        self.metrics_server = ThreadingHTTPServer((metrics_host, metrics_port), make_metrics_handler(self))
+        threading.Thread(target=self.metrics_server.serve_forever, name='report-worker-metrics', daemon=True).start()
+        logger.info(f"Report worker metrics on http://{metrics_host}:{metrics_port}/metrics")
+
+    def stop(self):
+        for server in (self.server, self.metrics_server):
+            if server:
+                server.shutdown()
+
+def make_handler(worker):
+    class WorkerHandler(BaseHTTPRequestHandler):
+        def _reply(self, code, body):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            # POST /jobs {"job": "endpoints"}, the name of one of JOBS
+            if self.path != '/jobs':
+                return self._reply(404, {'error': 'not found'})
+            if WORKER_TOKEN and not hmac.compare_digest(self.headers.get('X-Worker-Token', ''), WORKER_TOKEN):
+                return self._reply(403, {'error': 'forbidden'})
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+                if not isinstance(body, dict) or set(body) != {'job'}:
+                    raise ValueError('Body must be {"job": name}')
+                job_id = worker.submit(body['job'])
+            except ValueError as e:
+                return self._reply(400, {'error': str(e)})
+            self._reply(202, worker.status(job_id))
+
+        def do_GET(self):
+            # GET /jobs/<id>
+            parts = self.path.strip('/').split('/')
+            if len(parts) != 2 or parts[0] != 'jobs' or not parts[1].isdigit():
+                return self._reply(404, {'error': 'not found'})
+            job = worker.status(int(parts[1]))
+            if job is None:
+                return self._reply(404, {'error': 'unknown job'})
+            self._reply(200, job)
+
+        def log_message(self, format, *args):
+            logger.info("worker http: " + format % args)
+
+    return WorkerHandler
+
+def make_metrics_handler(worker):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            # GET /metrics, Prometheus scrape of the live run metrics
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            data = worker.metrics().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            # Scrapes every few seconds would flood the worker log
+            pass
+
+    return MetricsHandler
+
+def submit_remote(body, url=WORKER_URL, timeout=10):
+    """Send a job to a running worker, body is {"job": name}. Returns the job record."""
+    headers = {'Content-Type': 'application/json'}
+    if WORKER_TOKEN:
+        headers['X-Worker-Token'] = WORKER_TOKEN
+    request = urllib.request.Request(url + '/jobs', data=json.dumps(body).encode(), headers=headers, method='POST')
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+if __name__ == '__main__':
+    # Standalone worker for the web buttons, launcher.py starts its own worker next to the scheduler
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    worker = ReportWorker()
+    worker.start()
+    threading.Event().wait()
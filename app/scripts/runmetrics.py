@@ -0,0 +1,290 @@
+#Per stage run telemetry, counted in process, stored in the run_metrics table and served as Prometheus metrics
+import re
+import resource
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+COUNTERS = ('api_requests', 'api_bytes', 'api_throttled', 'api_retries', 'api_errors',
+            'rows_inserted', 'rows_updated', 'rows_deleted')
+
+# Leading verb of a statement, comments before it are skipped
+STATEMENT_VERB = re.compile(r'^\s*(?:--[^\n]*\n\s*)*(INSERT|UPDATE|DELETE|COPY|WITH)\b', re.IGNORECASE)
+# Main statement after the CTEs of a WITH query
+CTE_VERB = re.compile(r'\)\s*(INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+COPY_FROM = re.compile(r'\bFROM\s+STDIN\b', re.IGNORECASE)
+ROW_COUNTERS = {'INSERT': 'rows_inserted', 'COPY': 'rows_inserted', 'UPDATE': 'rows_updated', 'DELETE': 'rows_deleted'}
+
+# Upper bounds in seconds of the API latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Path segments that are ids, folded so every asset or export job does not get its own series
+ID_SEGMENT = re.compile(r'^(\d+|[0-9a-fA-F-]{16,})$')
+METRIC_PREFIX = 'vickytopia_'
+
+# Counters are process wide, a stage reports the difference between its start and end.
+# Stages running at the same time on other threads see each other's calls.
+_lock = threading.Lock()
+_totals = dict.fromkeys(COUNTERS, 0)
+# Each thread has its own current run (start_run) and stack of open stages
+_local = threading.local()
+# Live series for the /metrics endpoint of the report worker
+_path_requests = {}
+_path_latency = {}
+_stage_rows = {}
+_stage_seconds = {}
+_gauges = {}
+# (thread ident, stage name) of every stage running in this process
+_active = []
+# Stages running in the report worker's job processes and their gauges, by process
+_remote_active = {}
+_remote_gauges = {}
+
+def add(counter, value=1):
+    with _lock:
+        _totals[counter] += value
+
+def snapshot():
+    with _lock:
+        return dict(_totals)
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[(name, tuple(sorted(labels.items())))] = value
+
+def api_path(url):
+    """Path of an API url without host, query and ids, the label of the per path series."""
+    path = url.split('://', 1)[-1].split('?', 1)[0]
+    segments = path.split('/')[1:]
+    return '/' + '/'.join('{id}' if ID_SEGMENT.match(segment) else segment for segment in segments)
+
+def record_request(key, status=None, size=0, failed=False, path=None, seconds=None):
+    """Count one API call. key identifies the call, repeating the call that just failed on this thread is a retry."""
+    failed = failed or status == 429 or (status or 0) >= 500
+    with _lock:
+        _totals['api_requests'] += 1
+        _totals['api_bytes'] += size or 0
+        _totals['api_throttled'] += int(status == 429)
+        _totals['api_errors'] += int(failed and status != 429)
+        _totals['api_retries'] += int(getattr(_local, 'failed_key', None) == key)
+        if path is not None:
+            series = (path, str(status) if status else 'error')
+            _path_requests[series] = _path_requests.get(series, 0) + 1
+            if seconds is not None:
+                histogram = _path_latency.setdefault(path, [0] * len(LATENCY_BUCKETS) + [0, 0.0])
+                for i, bound in enumerate(LATENCY_BUCKETS):
+                    if seconds <= bound:
+                        histogram[i] += 1
+                histogram[-2] += 1
+                histogram[-1] += seconds
+    _local.failed_key = key if failed else None
+
+def _current_stage():
+    # Writes from a pool thread go to the stage that started the pool, which is only
+    # known for sure while the running stages all belong to one thread
+    stack = _stack()
+    if stack:
+        return stack[-1]['name']
+    with _lock:
+        threads = {ident for ident, _ in _active}
+        return _active[-1][1] if len(threads) == 1 else 'none'
+
+def record_statement(query, rowcount):
+    """Count the rows written by one INSERT, UPDATE, DELETE or COPY FROM statement."""
+    if rowcount is None or rowcount < 1:
+        return
+    match = STATEMENT_VERB.match(query)
+    if not match:
+        return
+    verb = match.group(1).upper()
+    if verb == 'WITH':
+        verbs = CTE_VERB.findall(query)
+        if not verbs:
+            return
+        verb = verbs[-1].upper()
+    if verb == 'COPY' and not COPY_FROM.search(query):
+        return
+    stage_name = _current_stage()
+    with _lock:
+        _totals[ROW_COUNTERS[verb]] += rowcount
+        _stage_rows[stage_name] = _stage_rows.get(stage_name, 0) + rowcount
+
+def _reset_peak_rss():
+    # Linux lets a process reset its peak RSS, elsewhere the process peak so far is reported
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def _peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class Run:
+    def __init__(self):
+        self.run_id = str(uuid.uuid4())
+        self.stages = []
+        # Context manager factory taking the stage name, set by VickyTopiaReportCLI --profile
+        self.profiler = None
+
+def start_run():
+    """Start collecting the stages of a new CLI run on this thread and return it."""
+    _local.run = Run()
+    return _local.run
+
+def current_run():
+    return getattr(_local, 'run', None)
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+@contextmanager
+def stage(name):
+    """Record wall time, counters and peak RSS of the enclosed block as one stage of the current run.
+
+    The peak RSS is reset for the stage only when no stage of another thread is running,
+    the reset is process wide. Overlapping stages report the process peak since the last reset.
+    """
+    run = current_run()
+    stack = _stack()
+    if stack:
+        # Resetting the peak below would hide what the enclosing stage used so far
+        stack[-1]['peak'] = max(stack[-1]['peak'], _peak_rss_mb())
+    me = threading.get_ident()
+    with _lock:
+        alone = all(ident == me for ident, _ in _active)
+        _active.append((me, name))
+    if alone:
+        _reset_peak_rss()
+    frame = {'peak': 0.0, 'name': name}
+    stack.append(frame)
+    before = snapshot()
+    started = datetime.now()
+    start = time.perf_counter()
+    status, error = 'ok', None
+    wrap = run.profiler if run is not None else None
+    try:
+        if wrap is None:
+            yield
+        else:
+            with wrap(name):
+                yield
+    except Exception as e:
+        status, error = 'failed', str(e)
+        raise
+    finally:
+        stack.pop()
+        with _lock:
+            _active.remove((me, name))
+            _stage_seconds[name] = _stage_seconds.get(name, 0.0) + time.perf_counter() - start
+        peak = max(frame['peak'], _peak_rss_mb())
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        after = snapshot()
+        record = {'stage': name, 'started_at': started, 'finished_at': datetime.now(),
+                  'wall_seconds': round(time.perf_counter() - start, 3), 'peak_rss_mb': round(peak, 1),
+                  'status': status, 'error': error}
+        record.update({counter: after[counter] - before[counter] for counter in COUNTERS})
+        if run is not None:
+            run.stages.append(record)
+
+def timed_stage(function):
+    """Decorator recording every call of function as a stage named after it."""
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        with stage(function.__name__):
+            return function(*args, **kwargs)
+    return wrapper
+
+def state():
+    """Counters and live series of this process, merged by the report worker that started it."""
+    with _lock:
+        return {'totals': dict(_totals), 'path_requests': dict(_path_requests),
+                'path_latency': {path: list(histogram) for path, histogram in _path_latency.items()},
+                'stage_rows': dict(_stage_rows), 'stage_seconds': dict(_stage_seconds),
+                'active': [name for _, name in _active], 'gauges': dict(_gauges)}
+
+def merge(source, current, previous=None):
+    """Add what the process source counted between its previous and current state() to this process."""
+    previous = previous or {}
+    with _lock:
+        for key, series in (('totals', _totals), ('path_requests', _path_requests),
+                            ('stage_rows', _stage_rows), ('stage_seconds', _stage_seconds)):
+            before = previous.get(key, {})
+            for name, value in current[key].items():
+                series[name] = series.get(name, 0) + value - before.get(name, 0)
+        before = previous.get('path_latency', {})
+        for path, histogram in current['path_latency'].items():
+            old = before.get(path, [0] * len(histogram))
+            merged = _path_latency.setdefault(path, [0] * len(LATENCY_BUCKETS) + [0, 0.0])
+            for i, value in enumerate(histogram):
+                merged[i] += value - old[i]
+        _remote_active[source] = list(current['active'])
+        _remote_gauges[source] = dict(current['gauges'])
+
+def forget(source):
+    # The process has exited, its stages are no longer running
+    with _lock:
+        _remote_active.pop(source, None)
+        _remote_gauges.pop(source, None)
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+def exposition():
+    """Every series in the Prometheus text format. rate() of the rows counters gives the rows/s per report stage."""
+    with _lock:
+        totals = dict(_totals)
+        path_requests = dict(_path_requests)
+        path_latency = {path: list(histogram) for path, histogram in _path_latency.items()}
+        stage_rows = dict(_stage_rows)
+        stage_seconds = dict(_stage_seconds)
+        active = [name for _, name in _active] + [name for names in _remote_active.values() for name in names]
+        gauges = dict(_gauges)
+        for source, remote in _remote_gauges.items():
+            for (name, labels), value in remote.items():
+                gauges[(name, tuple(sorted(labels + (('pid', source),))))] = value
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        lines.append(f'# HELP {METRIC_PREFIX}{name} {help_text}')
+        lines.append(f'# TYPE {METRIC_PREFIX}{name} {kind}')
+        for suffix, labels, value in samples:
+            lines.append(f'{METRIC_PREFIX}{name}{suffix}{_labels(labels)} {value}')
+
+    for counter in COUNTERS:
+        family(counter + '_total', 'counter', counter.replace('_', ' ') + ' since the process started', [('', (), totals[counter])])
+    family('api_path_requests_total', 'counter', 'API calls per path and status',
+           [('', (('path', path), ('status', status)), count) for (path, status), count in sorted(path_requests.items())])
+    samples = []
+    for path, histogram in sorted(path_latency.items()):
+        for bound, count in zip(LATENCY_BUCKETS, histogram):
+            samples.append(('_bucket', (('path', path), ('le', bound)), count))
+        samples.append(('_bucket', (('path', path), ('le', '+Inf')), histogram[-2]))
+        samples.append(('_count', (('path', path),), histogram[-2]))
+        samples.append(('_sum', (('path', path),), round(histogram[-1], 6)))
+    family('api_request_duration_seconds', 'histogram', 'API call latency per path', samples)
+    family('stage_rows_written_total', 'counter', 'Rows inserted, updated or deleted per report stage',
+           [('', (('stage', stage),), rows) for stage, rows in sorted(stage_rows.items())])
+    family('stage_seconds_total', 'counter', 'Wall seconds spent in finished report stages',
+           [('', (('stage', stage),), round(seconds, 3)) for stage, seconds in sorted(stage_seconds.items())])
+    family('stage_in_progress', 'gauge', 'Report stages running right now',
+           [('', (('stage', stage),), active.count(stage)) for stage in sorted(set(active))])
+    for name in sorted({name for name, _ in gauges}):
+        family(name, 'gauge', name.replace('_', ' '),
+               [('', labels, value) for (gauge, labels), value in sorted(gauges.items()) if gauge == name])
+    return '\n'.join(lines) + '\n'
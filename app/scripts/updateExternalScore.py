@@ -1,69 +1,201 @@
 # epss_data_loader.py
 
-import requests
 import gzip
-import pandas as pd
-from sqlalchemy import create_engine, text, Table, Column, String, Float, MetaData
-from datetime import datetime
+import io
+import re
+from datetime import datetime, timedelta
 
-def download_and_load_epss_data(db_host, db_port, db_username, db_password, db_name):
+import httpclient
+import DatabaseConnector as db
 
-    table_name = 'epssdata'
+EPSS_URL = "https://epss.cyentia.com/epss_scores-{date}.csv.gz"
+
+def open_epss_source(source=None):
+    """Return (text stream, file date) for the EPSS csv.
+
+    source is a local .csv or .csv.gz path, otherwise today's file (or
+    yesterday's when today's is not published yet) is streamed from the EPSS
+    site and decompressed on the fly, nothing is buffered or written to disk.
+    """
+    if source:
+        print("Loading EPSS scores from " + source)
+        stream = gzip.open(source, 'rt') if source.endswith('.gz') else open(source)
+        return stream, None
 
     # Mimic a common User-Agent
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'}
 
-    # Get today's date in the correct format
-    today = (datetime.now() - - timedelta(days=1)).strftime('%Y-%m-%d')
-
-    url = f"https://epss.cyentia.com/epss_scores-{today}.csv.gz"
-
-    print (url)
-    # Download the file
-    response = requests.get(url)
-    print (response)
-    if response.status_code == 200:
-        # Save the gzip file
-        with open("epss_scores.csv.gz", "wb") as file:
-            file.write(response.content)
-
-        # Extract the gzip file
-        with gzip.open("epss_scores.csv.gz", "rb") as f_in:
-            with open("epss_scores.csv", "wb") as f_out:
-                f_out.write(f_in.read())
-
-        # Load the CSV into a DataFrame
-        df = pd.read_csv("epss_scores.csv")
-
-        # Connect to the PostgreSQL database
-        engine = create_engine(f'postgresql://{db_username}:{db_password}@{db_host}:{db_port}/{db_name}')
-        metadata = MetaData()
-
-        # Define the table structure
-        table = Table(table_name, metadata,
-                    Column('cve', String, primary_key=True),
-                    Column('epss', Float),
-                    Column('percentile', Float),
-                    Column('score_date', String))
-
-        # Check if the table exists, create it if not
-        if not engine.dialect.has_table(engine, table_name):
-            table.create(engine)
-
-        # Check if data already exists for today
-        with engine.connect() as conn:
-            result = conn.execute(text(f"SELECT EXISTS(SELECT 1 FROM {table_name} WHERE score_date = :date)"), {'date': today}).scalar()
-            if result:
-                # If data exists, delete it
-                conn.execute(text(f"DELETE FROM {table_name} WHERE score_date = :date"), {'date': today})
-
-        # Insert new data
-        df.to_sql(table_name, engine, if_exists='append', index=False)
-
-        print("Data inserted successfully.")
-    else:
-        print(f"Failed to download the file. Status code: {response.status_code}")
+    for days_back in (0, 1):
+        day = (datetime.now() - timedelta(days=days_back)).strftime('%Y-%m-%d')
+        url = EPSS_URL.format(date=day)
+        print (url)
+        response = httpclient.get(url, headers=headers, stream=True, timeout=60)
+        print (response)
+        if response.status_code == 200:
+            return io.TextIOWrapper(gzip.GzipFile(fileobj=response.raw), encoding='utf-8'), day
+        response.close()
+    raise RuntimeError(f"Failed to download the file. Status code: {response.status_code}")
+
+def check_create_table_epssdata(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS epssdata (
+            cve TEXT PRIMARY KEY,
+            epss DOUBLE PRECISION,
+            percentile DOUBLE PRECISION,
+            score_date TEXT
+        );
+    """)
+    # Tables left by the old loader may hold one row per CVE and day and lack the key the upsert needs
+    cur.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_index i JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+            WHERE i.indrelid = 'epssdata'::regclass AND i.indisunique AND i.indnatts = 1 AND a.attname = 'cve'
+        );
+    """)
+    if not cur.fetchone()[0]:
+        cur.execute("DELETE FROM epssdata a USING epssdata b WHERE a.cve = b.cve AND (a.score_date, a.ctid) < (b.score_date, b.ctid);")
+        cur.execute("CREATE UNIQUE INDEX epssdata_cve_idx ON epssdata (cve);")
+    # Only changed scores are rewritten, the date of the loaded file is kept in epss_load
+    cur.execute("""
+        COMMENT ON COLUMN epssdata.score_date IS
+            'Date of the EPSS file that last changed this score, the date of the loaded file is epss_load.score_date';
+        CREATE TABLE IF NOT EXISTS epss_load (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            score_date TEXT NOT NULL,
+            loaded_at TIMESTAMP NOT NULL DEFAULT now()
+        );
+        COMMENT ON TABLE epss_load IS 'One row, the EPSS file epssdata holds. Filter dashboards on its score_date';
+    """)
+
+def record_epss_load(cur, score_date):
+    cur.execute("""
+        INSERT INTO epss_load (id, score_date, loaded_at) VALUES (TRUE, %s, now())
+        ON CONFLICT (id) DO UPDATE SET score_date = EXCLUDED.score_date, loaded_at = EXCLUDED.loaded_at;
+    """, (score_date,))
+
+def check_create_table_epss_history(cur):
+    # One row per CVE and score, valid_to is NULL for the score in effect today
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS epss_history (
+            cve TEXT NOT NULL,
+            epss DOUBLE PRECISION,
+            percentile DOUBLE PRECISION,
+            valid_from DATE NOT NULL,
+            valid_to DATE,
+            PRIMARY KEY (cve, valid_from)
+        );
+        CREATE INDEX IF NOT EXISTS epss_history_open_idx ON epss_history (cve) WHERE valid_to IS NULL;
+
+        -- Score of one CVE on a given day
+        CREATE OR REPLACE FUNCTION epss_score_as_of(p_cve TEXT, p_date DATE)
+        RETURNS TABLE (epss DOUBLE PRECISION, percentile DOUBLE PRECISION) AS $$
+            SELECT h.epss, h.percentile FROM epss_history h
+            WHERE h.cve = p_cve AND h.valid_from <= p_date AND (h.valid_to IS NULL OR h.valid_to > p_date)
+        $$ LANGUAGE SQL STABLE;
+
+        -- Every score in effect on a given day
+        CREATE OR REPLACE FUNCTION epss_as_of(p_date DATE)
+        RETURNS TABLE (cve TEXT, epss DOUBLE PRECISION, percentile DOUBLE PRECISION) AS $$
+            SELECT h.cve, h.epss, h.percentile FROM epss_history h
+            WHERE h.valid_from <= p_date AND (h.valid_to IS NULL OR h.valid_to > p_date)
+        $$ LANGUAGE SQL STABLE;
+    """)
+
+def latest_score_date(cur):
+    """Newest score date loaded into epss_load, epssdata or epss_history as YYYY-MM-DD, None while all are empty."""
+    cur.execute("""
+        SELECT GREATEST((SELECT score_date FROM epss_load), (SELECT max(valid_from)::text FROM epss_history),
+                        (SELECT max(score_date) FROM epssdata));
+    """)
+    latest = cur.fetchone()[0]
+    return latest[:10] if latest else None
+
+def apply_epss_history(cur, score_date):
+    """Close the ranges of the staged CVEs whose score changed and open new ones. Returns the new ranges."""
+    # A re-run of the same day corrects the range it opened instead of adding one
+    cur.execute("""
+        UPDATE epss_history h SET epss = s.epss, percentile = s.percentile
+        FROM epss_staging s
+        WHERE h.cve = s.cve AND h.valid_to IS NULL AND h.valid_from = %(date)s::date
+            AND (h.epss, h.percentile) IS DISTINCT FROM (s.epss, s.percentile);
+    """, {'date': score_date})
+    cur.execute("""
+        UPDATE epss_history h SET valid_to = %(date)s::date
+        FROM epss_staging s
+        WHERE h.cve = s.cve AND h.valid_to IS NULL AND h.valid_from < %(date)s::date
+            AND (h.epss, h.percentile) IS DISTINCT FROM (s.epss, s.percentile);
+    """, {'date': score_date})
+    cur.execute("""
+        INSERT INTO epss_history (cve, epss, percentile, valid_from)
+        SELECT DISTINCT ON (s.cve) s.cve, s.epss, s.percentile, %(date)s::date FROM epss_staging s
+        WHERE NOT EXISTS (SELECT 1 FROM epss_history h WHERE h.cve = s.cve AND h.valid_to IS NULL)
+        ON CONFLICT (cve, valid_from) DO UPDATE SET epss = EXCLUDED.epss, percentile = EXCLUDED.percentile, valid_to = NULL;
+    """, {'date': score_date})
+    return cur.rowcount
+
+def download_and_load_epss_data(db_host, db_port, db_username, db_password, db_name, source=None):
+    """Load the EPSS scores into epssdata and epss_history, only CVEs whose score changed are written. Returns that count."""
+    db_params = {
+        'host': db_host,
+        'port': db_port,
+        'user': db_username,
+        'password': db_password,
+        'database': db_name
+    }
+
+    stream, score_date = open_epss_source(source)
+    conn = db.get_connection(db_params)
+    try:
+        with stream:
+            # First line is "#model_version:...,score_date:2024-01-01T00:00:00+0000", the csv header follows
+            first_line = stream.readline()
+            match = re.search(r'score_date:(\d{4}-\d{2}-\d{2})', first_line)
+            if match:
+                score_date = match.group(1)
+            score_date = score_date or datetime.now().strftime('%Y-%m-%d')
+            # Files without the comment line start with the header, which readline() already consumed
+            header = 'true' if first_line.startswith('#') else 'false'
+
+            with conn:
+                cur = conn.cursor()
+                check_create_table_epssdata(cur)
+                check_create_table_epss_history(cur)
+                # An older file, e.g. an old --epss-file, would put stale scores back into epssdata
+                latest = latest_score_date(cur)
+                if latest and latest > score_date:
+                    print(f"EPSS scores from {latest} are already loaded, not loading the older {score_date} file")
+                    cur.close()
+                    return 0
+                cur.execute("""
+                    CREATE TEMP TABLE epss_staging (
+                        cve TEXT, epss DOUBLE PRECISION, percentile DOUBLE PRECISION
+                    ) ON COMMIT DROP;
+                """)
+                cur.copy_expert("COPY epss_staging (cve, epss, percentile) FROM STDIN WITH (FORMAT csv, HEADER " + header + ")", stream)
+                staged = cur.rowcount
+                cur.execute("""
+                    INSERT INTO epssdata (cve, epss, percentile, score_date)
+                    SELECT DISTINCT ON (cve) cve, epss, percentile, %s FROM epss_staging
+                    ON CONFLICT (cve) DO UPDATE SET
+                        epss = EXCLUDED.epss,
+                        percentile = EXCLUDED.percentile,
+                        score_date = EXCLUDED.score_date
+                    WHERE (epssdata.epss, epssdata.percentile) IS DISTINCT FROM (EXCLUDED.epss, EXCLUDED.percentile);
+                """, (score_date,))
+                changed = cur.rowcount
+                ranges = apply_epss_history(cur, score_date)
+                record_epss_load(cur, score_date)
+                cur.close()
+    finally:
+        conn.close()
+
+    print(f"EPSS {score_date}: {staged} scores read, {changed} new or changed, {ranges} history ranges opened")
+    return changed
 
 if __name__ == "__main__":
-    download_and_load_epss_data()
+    import sys
+    import os
+    download_and_load_epss_data(os.environ.get('POSTGRES_HOST', 'appdb'), os.environ.get('POSTGRES_PORT', '5432'),
+                                os.environ.get('POSTGRES_USER'), os.environ.get('POSTGRES_PASSWORD'),
+                                os.environ.get('POSTGRES_DB'), sys.argv[1] if len(sys.argv) > 1 else None)
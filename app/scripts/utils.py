@@ -1,5 +1,7 @@
 
 import datetime
+import importlib
+import threading
 
 def timestamptodatetime(timestamp_with_ms):
 
@@ -7,4 +9,32 @@ def timestamptodatetime(timestamp_with_ms):
     dt = datetime.datetime.fromtimestamp(timestamp) + datetime.timedelta(milliseconds=ms)    
     formatted_time = dt.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
   
-    return formatted_time
\ No newline at end of file
+    return formatted_time
+
+class LazyModule:
+    """Module placeholder that imports the real module on first attribute access.
+
+    Lets a script keep `pd.read_sql(...)` style calls while pandas and the API
+    modules are only imported by the runs that use them.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    @property
+    def module_name(self):
+        return self._name
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        return f"<LazyModule {self._name} {'loaded' if self._module else 'not loaded'}>"
@@ -0,0 +1,57 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+import landing
+
+# Only Mitigated events carry incidentEventDetecetdDate and patchId is optional,
+# the first document of the page has neither
+DOCS = [
+    {'incidentEventIncidentEventType': 'DetectedVulnerability', 'analyticsEventCreatedAtNano': 1700000000000000001,
+     'incidentEventVulnerability': {'vulnerabilitySensitivityLevel': {'sensitivityLevelName': 'High'}}},
+    {'incidentEventIncidentEventType': 'MitigatedVulnerability', 'analyticsEventCreatedAtNano': 1700000000000000002,
+     'incidentEventDetecetdDate': 1700000000000, 'patchId': 42,
+     'incidentEventVulnerability': {'vulnerabilitySensitivityLevel': {'threatLevelId': 3}}},
+    {'incidentEventIncidentEventType': 'MitigatedVulnerability', 'analyticsEventCreatedAtNano': 1700000000000000003,
+     'incidentEventDetecetdDate': '2024-01-01', 'incidentEventVulnerability': {}, 'tags': []},
+]
+
+class LandingRoundTrip(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        landing.configure(True, self.directory.name)
+
+    def tearDown(self):
+        landing.configure()
+        self.directory.cleanup()
+
+    def round_trip(self):
+        path = landing.write_page('incidents', {'serverResponseObject': DOCS}, {'minDate': 1, 'maxDate': 2})
+        self.assertIsNotNone(path)
+        return landing.read_page(path)
+
+    def test_heterogeneous_page(self):
+        context, docs = self.round_trip()
+        self.assertEqual(context, {'minDate': 1, 'maxDate': 2})
+        self.assertEqual(docs, DOCS)
+
+    def test_json_lines_fallback(self):
+        modules, landing._arrow = landing._arrow, False
+        try:
+            path = landing.write_page('incidents', {'serverResponseObject': DOCS})
+        finally:
+            landing._arrow = modules
+        self.assertTrue(path.endswith('.jsonl.gz'))
+        self.assertEqual(landing.read_page(path)[1], DOCS)
+
+    def test_iter_pages(self):
+        landing.write_page('incidents', {'serverResponseObject': DOCS[:1]})
+        landing.write_page('incidents', {'serverResponseObject': DOCS[1:]})
+        pages = [page['serverResponseObject'] for _, page in landing.iter_pages('incidents', self.directory.name)]
+        self.assertEqual(pages, [DOCS[:1], DOCS[1:]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -131,6 +131,22 @@ psql -v ON_ERROR_STOP=1 --username "$ADMIN_USER" --dbname "integration_db" <<-EO
         mitigation_percentage NUMERIC(5,2)
     );
 
+    -- Group assignment rules read by etl_orchestrator.py, first match by priority wins
+    -- match_field: 'hostname' or 'vicarius_group' (Vicarius groups of the endpoint joined by '|')
+    CREATE TABLE IF NOT EXISTS "Integracion_Group_Rules" (
+        rule_id SERIAL PRIMARY KEY,
+        pattern TEXT NOT NULL,
+        group_name TEXT NOT NULL,
+        priority INTEGER DEFAULT 100,
+        match_field TEXT DEFAULT 'hostname',
+        is_regex BOOLEAN DEFAULT FALSE,
+        enabled BOOLEAN DEFAULT TRUE
+    );
+
+    INSERT INTO "Integracion_Group_Rules" (pattern, group_name, priority)
+    SELECT * FROM (VALUES ('UNICON', 'UNICON', 10), ('UNACEM', 'UNACEM', 20), ('CONCREMAX', 'CONCREMAX', 30), ('ARPL', 'ARPL', 40)) AS seed
+    WHERE NOT EXISTS (SELECT FROM "Integracion_Group_Rules");
+
     CREATE TABLE IF NOT EXISTS "Integracion_Daily_Reboot_Audit" (
         audit_id SERIAL PRIMARY KEY,
         hostname TEXT,
@@ -1,6 +1,8 @@
 #!/bin/bash
 
 
-sudo docker stack deploy --compose-file webapp/mgntDash/docker-compose.yml vrx-reports-stack
+# The web app queues its jobs in the report worker with the token initDocker.sh wrote to .env
+REPORT_WORKER_TOKEN=$(grep '^REPORT_WORKER_TOKEN=' .env 2>/dev/null | cut -d= -f2-)
+sudo REPORT_WORKER_TOKEN="$REPORT_WORKER_TOKEN" docker stack deploy --compose-file webapp/mgntDash/docker-compose.yml vrx-reports-stack
 echo "Deployed Web app to port 8000"
 
@@ -41,3 +41,14 @@ echo "Docker secrets created successfully."
 read -p "List Optional tools to install (e.g., metabase)" optional_tools
 echo 
 create_or_update_secret optional_tools "$optional_tools"
+
+# Shared token of the report worker and the web app, read by both docker-compose files from .env
+if ! grep -q '^REPORT_WORKER_TOKEN=.' .env 2>/dev/null; then
+    report_worker_token=$(openssl rand -hex 32)
+    if grep -q '^REPORT_WORKER_TOKEN=' .env 2>/dev/null; then
+        sed -i "s/^REPORT_WORKER_TOKEN=.*/REPORT_WORKER_TOKEN=$report_worker_token/" .env
+    else
+        echo "REPORT_WORKER_TOKEN=$report_worker_token" >> .env
+    fi
+    echo "Report worker token written to .env"
+fi
@@ -1,57 +1,56 @@
 from django.shortcuts import render
 from django.http import HttpResponse
-import subprocess
+from datetime import datetime
+import json
+import os
+import urllib.error
+import urllib.request
+
+# Reports run in the long lived report worker of the app container (scripts/reportWorker.py)
+# docker-compose.yml of both stacks passes the same REPORT_WORKER_TOKEN to the worker and to this app
+REPORT_WORKER_URL = os.environ.get('REPORT_WORKER_URL', 'http://app:8765')
+REPORT_WORKER_TOKEN = os.environ.get('REPORT_WORKER_TOKEN', '')
+
+def dispatch_to_worker(jobs, log_file):
+    # jobs are names of the worker's job list (reportWorker.JOBS), the worker picks the flags
+    output = ""
+    headers = {'Content-Type': 'application/json'}
+    if REPORT_WORKER_TOKEN:
+        headers['X-Worker-Token'] = REPORT_WORKER_TOKEN
+    for name in jobs:
+        try:
+            request = urllib.request.Request(REPORT_WORKER_URL + '/jobs', data=json.dumps({'job': name}).encode(),
+                                             headers=headers, method='POST')
+            with urllib.request.urlopen(request, timeout=10) as response:
+                job = json.loads(response.read())
+            output += f"Queued job {job['id']} for {name} with flags {job['flags']}\n"
+        except urllib.error.HTTPError as e:
+            output += f"Error queuing {name}: {e.read().decode()}\n"
+        except Exception as e:
+            output += f"Error queuing {name}: {str(e)}\n"
+    with open(log_file, 'a') as f:
+        f.write(f"{datetime.now()} {output}")
+    return output
 
 def index(request):
     return render(request, 'myapp/index.html')
 
 def update_all_tables(request):
-    scripts = [
-        ('scripts/VickyTopiaReportCLI.py',['--allreports']),
-
-    ]
+    jobs = ['allreports']
     log_file = "/var/log/Web-alltables.log"
-    output = ""
-    for script, flags in scripts:
-        try:
-            with open(log_file, 'a') as f:
-                result = subprocess.run(['python3', script] + flags, capture_output=True, text=True)
-            output += f"Output of {script} with flags {flags}:\n{result.stdout}\n"
-        except Exception as e:
-            output += f"Error running {script} with flags {flags}: {str(e)}\n"
-    
+    output = dispatch_to_worker(jobs, log_file)
     return HttpResponse(f"<pre>{output}</pre>")
 
 def update_metabase_template(request):
-    scripts = [
-        ('scripts/VickyTopiaReportCLI.py',['--metabaseTempalateReplace']),
-    ]
+    jobs = ['metabaseTemplate']
     log_file = "/var/log/Web-metabase_tempalte.log"
-    output = ""
-    for script, flags in scripts:
-        try:
-            with open(log_file, 'a') as f:
-                result = subprocess.run(['python3', script] + flags, capture_output=True, text=True)
-            output += f"Output of {script} with flags {flags}:\n{result.stdout}\n"
-        except Exception as e:
-            output += f"Error running {script} with flags {flags}: {str(e)}\n"
-    
+    output = dispatch_to_worker(jobs, log_file)
     return HttpResponse(f"<pre>{output}</pre>")
 
 def create_mb_user(request):
-    scripts = [
-        ('scripts/VickyTopiaReportCLI.py',['--createMBUser']),
-    ]
+    jobs = ['createMBUser']
     log_file = "/var/log/Web-metabase_tempalte.log"
-    output = ""
-    for script, flags in scripts:
-        try:
-            with open(log_file, 'a') as f:
-                result = subprocess.run(['python3', script] + flags, capture_output=True, text=True)
-            output += f"Output of {script} with flags {flags}:\n{result.stdout}\n"
-        except Exception as e:
-            output += f"Error running {script} with flags {flags}: {str(e)}\n"
-    
+    output = dispatch_to_worker(jobs, log_file)
     return HttpResponse(f"<pre>{output}</pre>")
 
 def update_refresh_tables(request):
@@ -74,37 +73,13 @@ def update_refresh_tables(request):
     
     return HttpResponse(f"<pre>{output}</pre>")
     '''
-    scripts = [
-        ('scripts/VickyTopiaReportCLI.py',['-a']),
-        ('scripts/VickyTopiaReportCLI.py',['-p']),
-        ('scripts/VickyTopiaReportCLI.py',['-hp']),
-        ('scripts/VickyTopiaReportCLI.py',['-v']),
-    ]
+    jobs = ['assets', 'patches', 'hasPatchApps', 'vulnerabilities']
     log_file = "/var/log/Web-refreshTables.log"
-    output = ""
-    for script, flags in scripts:
-        try:
-            with open(log_file, 'a') as f:
-                result = subprocess.run(['python3', script] + flags, capture_output=True, text=True)
-            output += f"Output of {script} with flags {flags}:\n{result.stdout}\n"
-        except Exception as e:
-            output += f"Error running {script} with flags {flags}: {str(e)}\n"
-    
+    output = dispatch_to_worker(jobs, log_file)
     return HttpResponse(f"<pre>{output}</pre>")
 
 def update_sync_tables(request):
-    scripts = [
-        ('scripts/VickyTopiaReportCLI.py',['-t']),
-        ('scripts/VickyTopiaReportCLI.py',['-i']),
-    ]
+    jobs = ['tasks', 'incidents']
     log_file = "/var/log/Web-syncTables.log"
-    output = ""
-    for script, flags in scripts:
-        try:
-            with open(log_file, 'a') as f:
-                result = subprocess.run(['python3', script] + flags, capture_output=True, text=True)
-            output += f"Output of {script} with flags {flags}:\n{result.stdout}\n"
-        except Exception as e:
-            output += f"Error running {script} with flags {flags}: {str(e)}\n"
-    
+    output = dispatch_to_worker(jobs, log_file)
     return HttpResponse(f"<pre>{output}</pre>")